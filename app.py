@@ -1,10 +1,18 @@
-import os
-from together import Together
+import hashlib
+import json
+import time
 import streamlit as st
-import pandas as pd
-import joblib
 from datetime import datetime
-from fpdf import FPDF
+from itertools import chain
+import llm
+import llm_guard
+import metrics
+import neighbours
+import pipeline
+import what_if
+from prediction_cache import PredictionCache
+from response_cache import ResponseCache
+from tasks import SessionTasks, TaskCancelled, TaskTimeout, create_executor, create_stream_executor
 
 # -------------------------
 # Page Config
@@ -162,138 +170,132 @@ st.markdown("""
 # Load Model & Preprocessing
 # -------------------------
 @st.cache_resource
-def load_models():
-    model = joblib.load("KNN_heart.pkl")
-    scaler = joblib.load("scaler.pkl")
-    expected_columns = joblib.load("columns.pkl")
-    return model, scaler, expected_columns
+def get_executor():
+    return create_executor()
 
-model, scaler, expected_columns = load_models()
+@st.cache_resource
+def get_stream_executor():
+    return create_stream_executor()
+
+@st.cache_resource
+def get_loaded_models():
+    # The last future load_models() returned, so a new version that only
+    # appended rows can reuse that engine's index
+    return {}
+
+@st.cache_resource(max_entries=1)
+def load_models(version):
+    # Unpickling imports sklearn (~1s), so it runs in the background while
+    # the page paints; predictions wait on the future. A new CURRENT version
+    # is picked up on the next rerun.
+    loaded = get_loaded_models()
+    previous = loaded.get('future')
+    base = None
+    if previous is not None and previous.done() and previous.exception() is None:
+        base = previous.result()[0]
+    future = get_executor().submit(pipeline.load_pipeline, base=base)
+    loaded['future'] = future
+    return future
+
+@st.cache_resource
+def get_prediction_cache():
+    return PredictionCache()
+
+@st.cache_resource(max_entries=1)
+def load_reference_rows(version, _models_future):
+    # Maps the model's reference rows back to heart.csv for the "similar
+    # patients" list; reads heart.csv and imports sklearn, so also off-thread
+    return get_executor().submit(lambda: neighbours.ReferenceRows(*_models_future.result()))
+
+model_version = pipeline.artifact_version()
+models_future = load_models(model_version)
+reference_rows_future = load_reference_rows(model_version, models_future)
+
+def predict_risk(raw_input):
+    # Label, neighbour vote and the nearest reference patients from one search,
+    # plus the what-if grid around the submission from a second, batched one
+    knn, encoder = models_future.result()
+    with metrics.span("encode"):
+        row = encoder.encode(raw_input, scaled=False)
+    with metrics.span("scale"):
+        encoder.scale_rows(row)
+    with metrics.span("predict"):
+        assessment = neighbours.assess(knn, reference_rows_future.result(), row)[0]
+    with metrics.span("what_if"):
+        assessment['what_if'] = what_if.explore(knn, encoder, raw_input)
+    return assessment
+
+prediction_cache = get_prediction_cache()
+prediction_cache.check_version(model_version)
 
 # -------------------------
-# Setup Together Client
+# Metrics
 # -------------------------
-TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-client = Together(api_key=TOGETHER_API_KEY)
+# Stage timings are recorded when HEARTALERT_METRICS is set; with
+# HEARTALERT_METRICS_PORT they are served for Prometheus at /metrics
+@st.cache_resource
+def start_metrics_server(port):
+    return metrics.start_http_server(port)
+
+if metrics.enabled() and metrics.PORT:
+    start_metrics_server(metrics.PORT)
 
 # -------------------------
-# PDF Report Generation
+# LLM Response Cache
 # -------------------------
-class HeartAlertReport(FPDF):
-    def header(self):
-        self.set_font('Arial', 'B', 24)
-        self.set_text_color(102, 126, 234)
-        self.cell(0, 12, 'HeartAlert', 0, 1, 'C')
-        self.set_font('Arial', 'I', 11)
-        self.set_text_color(100, 100, 100)
-        self.cell(0, 8, 'AI-Powered Heart Health Assessment Report', 0, 1, 'C')
-        self.ln(8)
-        
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.set_text_color(150, 150, 150)
-        self.cell(0, 10, f'Generated by HeartAlert - Page {self.page_no()}', 0, 0, 'C')
-    
-    def chapter_title(self, title):
-        self.set_font('Arial', 'B', 14)
-        self.set_fill_color(102, 126, 234)
-        self.set_text_color(255, 255, 255)
-        self.cell(0, 10, title, 0, 1, 'L', 1)
-        self.ln(4)
-    
-    def chapter_body(self, body):
-        self.set_font('Arial', '', 11)
-        self.set_text_color(0, 0, 0)
-        self.multi_cell(0, 7, body)
-        self.ln()
-
-def generate_pdf_report(user_data, prediction, tips, symptoms, chat_history):
-    pdf = HeartAlertReport()
-    pdf.add_page()
-    
-    # Patient Information
-    pdf.chapter_title('PATIENT INFORMATION')
-    patient_info = f"""Name: {user_data['name']}
-Date: {datetime.now().strftime('%B %d, %Y')}
-Time: {datetime.now().strftime('%I:%M %p')}
-Report ID: HRT-{datetime.now().strftime('%Y%m%d%H%M%S')}"""
-    pdf.chapter_body(patient_info)
-    
-    # Symptoms
-    if symptoms:
-        pdf.chapter_title('REPORTED SYMPTOMS')
-        pdf.chapter_body(symptoms)
-    
-    # Health Metrics
-    pdf.chapter_title('HEALTH METRICS')
-    metrics = f"""Age: {user_data['Age']} years
-Gender: {user_data['sex']}
-Resting Blood Pressure: {user_data['RestingBP']} mm Hg
-Cholesterol: {user_data['Cholesterol']} mg/dL
-Maximum Heart Rate: {user_data['MaxHR']} bpm
-Chest Pain Type: {user_data['chest_pain']}
-Oldpeak (ST Depression): {user_data['oldpeak']}
-Fasting Blood Sugar: {'> 120 mg/dL' if user_data['fasting_bs'] else '< 120 mg/dL'}
-Resting ECG: {user_data['resting_ecg']}
-Exercise Angina: {user_data['exercise_angina']}
-ST Slope: {user_data['st_slope']}"""
-    pdf.chapter_body(metrics)
-    
-    # Assessment Result
-    pdf.chapter_title('RISK ASSESSMENT')
-    pdf.set_font('Arial', 'B', 12)
-    if prediction == 1:
-        pdf.set_text_color(220, 38, 38)
-        result = "HIGH RISK - Immediate medical consultation recommended"
-    else:
-        pdf.set_text_color(34, 197, 94)
-        result = "LOW RISK - Continue maintaining healthy lifestyle"
-    pdf.multi_cell(0, 8, result)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln()
-    
-    # AI Recommendations
-    pdf.chapter_title('PERSONALIZED HEALTH RECOMMENDATIONS')
-    pdf.chapter_body(tips)
-    
-    # Chat History
-    if len(chat_history) > 0:
-        pdf.add_page()
-        pdf.chapter_title('AI CONSULTATION CONVERSATION')
-        for msg in chat_history:
-            if msg['role'] == 'user':
-                pdf.set_font('Arial', 'B', 10)
-                pdf.set_text_color(102, 126, 234)
-                pdf.multi_cell(0, 6, f"Patient: {msg['content']}")
-                pdf.ln(2)
-            elif msg['role'] == 'assistant':
-                pdf.set_font('Arial', '', 10)
-                pdf.set_text_color(0, 0, 0)
-                pdf.multi_cell(0, 6, f"HeartAlert AI: {msg['content']}")
-                pdf.ln(3)
-    
-    # Disclaimer
-    pdf.add_page()
-    pdf.chapter_title('MEDICAL DISCLAIMER')
-    disclaimer = """This report is generated by HeartAlert, an AI-powered heart health assessment tool. This is NOT a substitute for professional medical advice, diagnosis, or treatment.
+# Requests go through llm.get_client(), a process-wide gateway that creates
+# the Together client lazily
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
 
-Always seek the advice of your physician or other qualified health provider with any questions regarding a medical condition. Never disregard professional medical advice or delay seeking it because of information from this report.
+response_cache = get_response_cache()
 
-HeartAlert uses machine learning algorithms to provide risk assessment based on the data provided. Results should be discussed with a healthcare professional for proper interpretation and action.
+# -------------------------
+# PDF Report Generation
+# -------------------------
+def generate_pdf_report(user_data, prediction, tips, symptoms, chat_history, assessment=None):
+    # Rendered reports are cached by content; fpdf is only imported once the
+    # first report is built
+    import report_engine
+    return report_engine.get_report(user_data, prediction, tips, symptoms, chat_history, assessment)
 
-This report is for informational purposes only and should be presented to a licensed medical professional for validation and further evaluation.
+# -------------------------
+# Background Tasks
+# -------------------------
+RECOMMENDATION_TIMEOUT = 60
+REPORT_TIMEOUT = 30
+
+def report_inputs():
+    # Snapshot, so a background build never sees later chat turns
+    return (
+        dict(st.session_state["user_data"]),
+        st.session_state["prediction"],
+        st.session_state.get("tips", ""),
+        st.session_state["user_data"]["symptoms"],
+        [dict(msg) for msg in st.session_state["messages"]],
+        st.session_state.get("assessment")
+    )
 
-HeartAlert is a verified AI health assessment platform designed to assist healthcare professionals and patients in preliminary risk screening."""
-    pdf.chapter_body(disclaimer)
-    
-    # Footer certification
-    pdf.ln(5)
-    pdf.set_font('Arial', 'B', 10)
-    pdf.set_text_color(102, 126, 234)
-    pdf.cell(0, 6, 'Verified AI Health Assessment Platform', 0, 1, 'C')
-    
-    return pdf.output(dest='S').encode('latin1')
+def report_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+def prefetch_report():
+    # Build the PDF speculatively so the download doesn't wait for FPDF
+    inputs = report_inputs()
+    st.session_state["report_key"] = report_key(inputs)
+    st.session_state["tasks"].submit("report", generate_pdf_report, *inputs, timeout=REPORT_TIMEOUT)
+
+def get_report_bytes():
+    inputs = report_inputs()
+    task = st.session_state["tasks"].get("report")
+    if task is not None and st.session_state.get("report_key") == report_key(inputs):
+        try:
+            return task.result()
+        except Exception:
+            # Cancelled, late or failed: build it now instead
+            pass
+    return generate_pdf_report(*inputs)
 
 # -------------------------
 # Initialize Session State
@@ -310,13 +312,35 @@ if "user_data" not in st.session_state:
 if "show_chat_modal" not in st.session_state:
     st.session_state["show_chat_modal"] = False
 
+if "tasks" not in st.session_state:
+    st.session_state["tasks"] = SessionTasks(get_executor(), get_stream_executor())
+
+# Keeps chat prompts within a token budget; the full history stays in
+# "messages" for the PDF report
+if "chat_context" not in st.session_state:
+    st.session_state["chat_context"] = llm.create_chat_context()
+
 # -------------------------
 # Header with Logo
 # -------------------------
+LOGO_WIDTH = 250
+
+@st.cache_resource
+def load_logo():
+    # Decoded and downscaled once; st.image would otherwise resize the
+    # 1024px PNG on every rerun
+    from io import BytesIO
+    from PIL import Image
+    with Image.open("HeartProjectLogo.png") as logo:
+        logo = logo.resize((LOGO_WIDTH, round(logo.height * LOGO_WIDTH / logo.width)), Image.LANCZOS)
+        buffer = BytesIO()
+        logo.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
 try:
     col_logo1, col_logo2, col_logo3 = st.columns([1, 1, 1])
     with col_logo2:
-        st.image("HeartProjectLogo.png", width=250)
+        st.image(load_logo(), width=LOGO_WIDTH)
 except:
     st.markdown('<h1 style="text-align: center; color: #1f2937; font-size: 2.5rem; font-weight: 600; margin: 1rem 0;">❤️ HeartAlert</h1>', unsafe_allow_html=True)
 
@@ -348,313 +372,317 @@ st.markdown("""
 
 st.markdown("<br>", unsafe_allow_html=True)
 
+# -------------------------
+# Page Areas
+# -------------------------
+# Chat, assessment and report are fragments: a widget in one reruns only
+# that area, so a chat turn doesn't rebuild the form or replay the
+# prediction, and a form change doesn't redraw the chat history
+def show_result(prediction, assessment):
+    st.markdown("---")
+    if prediction == 1:
+        st.error("**HIGH RISK of Heart Disease Detected**")
+        st.warning("""
+        **Immediate Action Recommended:**
+        - Consult a cardiologist as soon as possible
+        - Do not ignore this assessment
+        - Download your report and bring it to your doctor
+        """)
+    else:
+        st.success("**LOW RISK of Heart Disease**")
+        st.info("""
+        **Great News!** Your current health metrics indicate a lower risk. 
+        Continue maintaining a healthy lifestyle and regular check-ups.
+        """)
+    st.caption(neighbours.similar_patients_text(assessment))
+    with st.expander("Most similar patients"):
+        st.markdown("\n".join(f"- {neighbours.neighbour_line(n)}" for n in assessment['neighbours']))
+    if assessment.get('what_if'):
+        with st.expander("🔍 What if my numbers changed?"):
+            st.markdown("\n\n".join(what_if.what_if_lines(assessment['what_if'])))
+
+    # Generate AI Recommendations
+    st.markdown("---")
+    st.markdown("### Personalized Health Recommendations")
+
+def show_tips(box, tips):
+    box.markdown(f"""
+    <div class="info-box">
+    {tips}
+    </div>
+    """, unsafe_allow_html=True)
+
 # -------------------------
 # AI Chat Interface (Always Visible)
 # -------------------------
 st.markdown("### 💬 AI Health Assistant")
 st.markdown("Ask me anything about heart health, symptoms, or how this assessment works.")
 
-# Quick Questions
-with st.expander("📌 Quick Questions", expanded=False):
-    quick_questions = [
-        "What are the warning signs of a heart attack?",
-        "How can I lower my cholesterol naturally?",
-        "What does high blood pressure mean?",
-        "How does this AI prediction work?",
-        "What lifestyle changes can improve heart health?",
-        "What do my test results mean?",
-        "When should I see a cardiologist?",
-        "How can I prevent heart disease?"
-    ]
-    
-    cols = st.columns(2)
-    for idx, question in enumerate(quick_questions):
-        with cols[idx % 2]:
-            if st.button(question, key=f"quick_q_{idx}", use_container_width=True):
-                # Add user question
-                st.session_state["messages"].append({"role": "user", "content": question})
-                
-                # Get AI response
-                try:
-                    system_message = """You are HeartAlert, a professional and caring heart health AI assistant. 
-                    Provide evidence-based, supportive, and actionable health guidance. 
-                    Be empathetic but clear. Keep responses concise and well-formatted.
-                    If the user asks about specific symptoms or medical advice, 
-                    always remind them to consult a healthcare professional."""
-                    
-                    messages = [{"role": "system", "content": system_message}] + st.session_state["messages"]
-                    
-                    response = client.chat.completions.create(
-                        model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
-                        messages=messages,
-                        temperature=0.7,
-                        max_tokens=500
-                    )
-                    ai_reply = response.choices[0].message.content.strip()
-                    # Remove markdown symbols
-                    ai_reply = ai_reply.replace('**', '').replace('*', '')
-                    st.session_state["messages"].append({"role": "assistant", "content": ai_reply})
-                except Exception as e:
-                    st.session_state["messages"].append({"role": "assistant", "content": f"Sorry, I encountered an error: {e}"})
-                
-                st.rerun()
-
-# Display chat messages
-for msg in st.session_state["messages"]:
-    if msg["role"] == "user":
-        with st.chat_message("user", avatar="👤"):
-            st.markdown(msg["content"])
-    elif msg["role"] == "assistant":
-        with st.chat_message("assistant", avatar="❤️"):
-            st.markdown(msg["content"])
-
-# Chat input
-if user_input := st.chat_input("Ask me anything about heart health..."):
-    st.session_state["messages"].append({"role": "user", "content": user_input})
-    
-    with st.chat_message("user", avatar="👤"):
-        st.markdown(user_input)
-    
-    with st.chat_message("assistant", avatar="❤️"):
-        with st.spinner("Thinking..."):
+@st.fragment(key="chat")
+def chat_panel():
+    # Quick Questions
+    with st.expander("📌 Quick Questions", expanded=False):
+        cols = st.columns(2)
+        for idx, question in enumerate(llm.QUICK_QUESTIONS):
+            with cols[idx % 2]:
+                if st.button(question, key=f"quick_q_{idx}", use_container_width=True):
+                    # Add user question; the answer is streamed below the chat history
+                    st.session_state["messages"].append({"role": "user", "content": question})
+                    st.session_state["pending_quick_reply"] = True
+
+    # Display chat messages. New turns are drawn into the same container,
+    # above the input box, so a turn needs no second rerun to reorder them
+    history = st.container()
+    for msg in st.session_state["messages"]:
+        if msg["role"] == "user":
+            with history.chat_message("user", avatar="👤"):
+                st.markdown(msg["content"])
+        elif msg["role"] == "assistant":
+            with history.chat_message("assistant", avatar="❤️"):
+                st.markdown(msg["content"])
+
+    # Answer a clicked quick question, from the response cache when possible
+    if st.session_state.pop("pending_quick_reply", False):
+        messages = llm.chat_messages(st.session_state["messages"], st.session_state["chat_context"])
+        # Only the question on its own, as `response_cache.py warm` asks it, is
+        # cached: a reply to a patient's own chat is never shared and never
+        # kept on disk
+        shared = messages == llm.chat_messages(st.session_state["messages"][-1:])
+        cache_key = llm.chat_request_key(messages) if shared else None
+        with history.chat_message("assistant", avatar="❤️"):
+            ai_reply = response_cache.get(cache_key) if shared else None
+            if ai_reply is not None:
+                st.markdown(ai_reply)
+            else:
+                reply = llm.guarded_chat_reply(messages)
+                ai_reply = st.write_stream(reply)
+                # Fallback notices aren't cached, so the next click asks the LLM again
+                if shared and reply.outcome == "llm":
+                    response_cache.put(cache_key, ai_reply)
+            st.session_state["messages"].append({"role": "assistant", "content": ai_reply})
+            if st.session_state["prediction_made"]:
+                prefetch_report()
+
+    # Chat input
+    if user_input := st.chat_input("Ask me anything about heart health..."):
+        st.session_state["messages"].append({"role": "user", "content": user_input})
+
+        with history.chat_message("user", avatar="👤"):
+            st.markdown(user_input)
+
+        with history.chat_message("assistant", avatar="❤️"):
             try:
-                system_message = """You are HeartAlert, a professional and caring heart health AI assistant. 
-                Provide evidence-based, supportive, and actionable health guidance. 
-                Be empathetic but clear. Keep responses concise and well-formatted.
-                If the user asks about specific symptoms or medical advice, 
-                always remind them to consult a healthcare professional."""
-                
-                messages = [{"role": "system", "content": system_message}] + st.session_state["messages"]
-                
-                response = client.chat.completions.create(
-                    model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=500
-                )
-                ai_reply = response.choices[0].message.content.strip()
-                # Remove markdown symbols
-                ai_reply = ai_reply.replace('**', '').replace('*', '')
+                # Tokens render as they arrive; markdown symbols are stripped on the fly
+                messages = llm.chat_messages(st.session_state["messages"], st.session_state["chat_context"])
+                ai_reply = st.write_stream(llm.guarded_chat_reply(messages))
                 st.session_state["messages"].append({"role": "assistant", "content": ai_reply})
-                st.markdown(ai_reply)
-                st.rerun()
+                if st.session_state["prediction_made"]:
+                    prefetch_report()
             except Exception as e:
                 st.error(f"⚠️ Chat error: {e}")
 
+chat_panel()
+
 st.markdown("---")
 
 # -------------------------
 # Main Assessment Form
 # -------------------------
-st.markdown("### Patient Assessment Form")
-
-# Personal Information
-col1, col2 = st.columns([1, 1])
-
-with col1:
-    st.markdown("**Personal Information**")
-    user_name = st.text_input("Full Name *", placeholder="Enter your full name")
-    age = st.slider("Age", 18, 100, 40)
-    sex = st.selectbox("Gender", ["M", "F"], format_func=lambda x: "Male" if x == "M" else "Female")
-
-with col2:
-    st.markdown("**Symptoms & Concerns**")
-    symptoms = st.text_area(
-        "Describe any symptoms you're experiencing *",
-        placeholder="E.g., chest pain, shortness of breath, fatigue, dizziness, palpitations...",
-        height=120
-    )
-
-st.markdown("---")
+@st.fragment(key="assessment")
+def assessment_panel():
+    st.markdown("### Patient Assessment Form")
+
+    # Personal Information
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.markdown("**Personal Information**")
+        user_name = st.text_input("Full Name *", placeholder="Enter your full name")
+        age = st.slider("Age", 18, 100, 40)
+        sex = st.selectbox("Gender", ["M", "F"], format_func=lambda x: "Male" if x == "M" else "Female")
+
+    with col2:
+        st.markdown("**Symptoms & Concerns**")
+        symptoms = st.text_area(
+            "Describe any symptoms you're experiencing *",
+            placeholder="E.g., chest pain, shortness of breath, fatigue, dizziness, palpitations...",
+            height=120
+        )
 
-# Vital Signs
-st.markdown("**Vital Signs & Medical Information**")
+    st.markdown("---")
 
-col3, col4, col5 = st.columns(3)
+    # Vital Signs
+    st.markdown("**Vital Signs & Medical Information**")
 
-with col3:
-    resting_bp = st.number_input("Resting Blood Pressure (mm Hg)", 80, 200, 120)
-    max_hr = st.slider("Maximum Heart Rate (bpm)", 60, 220, 150)
-    chest_pain = st.selectbox("Chest Pain Type", ["ATA", "NAP", "TA", "ASY"],
-                             help="ATA: Atypical Angina, NAP: Non-Anginal Pain, TA: Typical Angina, ASY: Asymptomatic")
+    col3, col4, col5 = st.columns(3)
 
-with col4:
-    cholesterol = st.number_input("Cholesterol (mg/dL)", 100, 600, 200)
-    oldpeak = st.slider("Oldpeak (ST Depression)", 0.0, 6.0, 1.0, 0.1)
-    fasting_bs = st.selectbox("Fasting Blood Sugar > 120 mg/dL", [0, 1],
-                             format_func=lambda x: "No" if x == 0 else "Yes")
+    with col3:
+        resting_bp = st.number_input("Resting Blood Pressure (mm Hg)", 80, 200, 120)
+        max_hr = st.slider("Maximum Heart Rate (bpm)", 60, 220, 150)
+        chest_pain = st.selectbox("Chest Pain Type", ["ATA", "NAP", "TA", "ASY"],
+                                 help="ATA: Atypical Angina, NAP: Non-Anginal Pain, TA: Typical Angina, ASY: Asymptomatic")
 
-with col5:
-    resting_ecg = st.selectbox("Resting ECG", ["Normal", "ST", "LVH"],
-                              help="Normal, ST: ST-T wave abnormality, LVH: Left Ventricular Hypertrophy")
-    exercise_angina = st.selectbox("Exercise-Induced Angina", ["N", "Y"],
-                                  format_func=lambda x: "No" if x == "N" else "Yes")
-    st_slope = st.selectbox("ST Slope", ["Up", "Flat", "Down"],
-                           help="Slope of peak exercise ST segment")
+    with col4:
+        cholesterol = st.number_input("Cholesterol (mg/dL)", 100, 600, 200)
+        oldpeak = st.slider("Oldpeak (ST Depression)", 0.0, 6.0, 1.0, 0.1)
+        fasting_bs = st.selectbox("Fasting Blood Sugar > 120 mg/dL", [0, 1],
+                                 format_func=lambda x: "No" if x == 0 else "Yes")
 
-st.markdown("---")
+    with col5:
+        resting_ecg = st.selectbox("Resting ECG", ["Normal", "ST", "LVH"],
+                                  help="Normal, ST: ST-T wave abnormality, LVH: Left Ventricular Hypertrophy")
+        exercise_angina = st.selectbox("Exercise-Induced Angina", ["N", "Y"],
+                                      format_func=lambda x: "No" if x == "N" else "Yes")
+        st_slope = st.selectbox("ST Slope", ["Up", "Flat", "Down"],
+                               help="Slope of peak exercise ST segment")
 
-# -------------------------
-# Analyze Button
-# -------------------------
-col_btn1, col_btn2, col_btn3 = st.columns([1, 2, 1])
+    st.markdown("---")
 
-with col_btn2:
-    analyze_btn = st.button("Analyze Heart Health", use_container_width=True)
+    # Analyze Button
+    col_btn1, col_btn2, col_btn3 = st.columns([1, 2, 1])
+
+    with col_btn2:
+        # Reruns the report area too, which appears once there is a prediction
+        analyze_btn = st.button("Analyze Heart Health", use_container_width=True,
+                                on_click=st.rerun, args=(["assessment", "report"],))
+
+    if analyze_btn:
+        if not user_name or not symptoms:
+            st.error("⚠️ Please enter your full name and describe your symptoms before proceeding.")
+        else:
+            # A new submission supersedes anything still running from the last one
+            st.session_state["tasks"].cancel_all()
+            analysis_start = time.perf_counter()
+
+            with st.spinner("🔄 Analyzing your heart health data..."):
+                # Prepare input
+                raw_input = {
+                    'Age': age,
+                    'RestingBP': resting_bp,
+                    'Cholesterol': cholesterol,
+                    'FastingBS': fasting_bs,
+                    'MaxHR': max_hr,
+                    'Oldpeak': oldpeak,
+                    'Gender_' + sex: 1,
+                    'ChestPainType_' + chest_pain: 1,
+                    'RestingECG_' + resting_ecg: 1,
+                    'ExerciseAngina_' + exercise_angina: 1,
+                    'ST_Slope_' + st_slope: 1
+                }
+
+                # Predict (repeat submissions are served from the cache)
+                assessment = prediction_cache.get_or_compute(raw_input, predict_risk)
+                prediction = assessment['prediction']
 
-if analyze_btn:
-    if not user_name or not symptoms:
-        st.error("⚠️ Please enter your full name and describe your symptoms before proceeding.")
-    else:
-        with st.spinner("🔄 Analyzing your heart health data..."):
-            # Prepare input
-            raw_input = {
-                'Age': age,
-                'RestingBP': resting_bp,
-                'Cholesterol': cholesterol,
-                'FastingBS': fasting_bs,
-                'MaxHR': max_hr,
-                'Oldpeak': oldpeak,
-                'Gender_' + sex: 1,
-                'ChestPainType_' + chest_pain: 1,
-                'RestingECG_' + resting_ecg: 1,
-                'ExerciseAngina_' + exercise_angina: 1,
-                'ST_Slope_' + st_slope: 1
-            }
-
-            input_df = pd.DataFrame([raw_input])
-
-            # Fill missing columns
-            for col in expected_columns:
-                if col not in input_df.columns:
-                    input_df[col] = 0
-
-            # Reorder columns
-            input_df = input_df[expected_columns]
-
-            # Scale input
-            scaled_input = scaler.transform(input_df)
-
-            # Predict
-            prediction = model.predict(scaled_input)[0]
-            
-            # Store data for report
-            st.session_state["user_data"] = {
-                'name': user_name,
-                'Age': age,
-                'sex': 'Male' if sex == 'M' else 'Female',
-                'RestingBP': resting_bp,
-                'Cholesterol': cholesterol,
-                'MaxHR': max_hr,
-                'chest_pain': chest_pain,
-                'oldpeak': oldpeak,
-                'fasting_bs': fasting_bs,
-                'resting_ecg': resting_ecg,
-                'exercise_angina': 'Yes' if exercise_angina == 'Y' else 'No',
-                'st_slope': st_slope,
-                'symptoms': symptoms
-            }
-            st.session_state["prediction"] = prediction
-            st.session_state["prediction_made"] = True
-
-            # Display prediction
-            st.markdown("---")
-            if prediction == 1:
-                st.error("**HIGH RISK of Heart Disease Detected**")
-                st.warning("""
-                **Immediate Action Recommended:**
-                - Consult a cardiologist as soon as possible
-                - Do not ignore this assessment
-                - Download your report and bring it to your doctor
-                """)
-            else:
-                st.success("**LOW RISK of Heart Disease**")
-                st.info("""
-                **Great News!** Your current health metrics indicate a lower risk. 
-                Continue maintaining a healthy lifestyle and regular check-ups.
-                """)
-
-            # Generate AI Recommendations
-            st.markdown("---")
-            st.markdown("### Personalized Health Recommendations")
-            
-            with st.spinner("🤖 Generating personalized health tips..."):
                 prompt = f"""
-                Patient Information:
-                - Name: {user_name}
-                - Age: {age}, Gender: {'Male' if sex == 'M' else 'Female'}
-                - Blood Pressure: {resting_bp} mm Hg
-                - Cholesterol: {cholesterol} mg/dL
-                - Max Heart Rate: {max_hr} bpm
-                - Symptoms: {symptoms}
-                - Risk Assessment: {'HIGH RISK' if prediction == 1 else 'LOW RISK'}
-
-                Provide 4-5 specific, actionable health recommendations in clear sections:
-                1. Immediate Actions (if high risk) or Preventive Measures (if low risk)
-                2. Dietary Recommendations
-                3. Exercise Guidelines
-                4. Lifestyle Modifications
-                5. Medical Follow-up
-
-                Be empathetic, encouraging, and professional. Use simple headings without asterisks.
-                """
+                    Patient Information:
+                    - Name: {user_name}
+                    - Age: {age}, Gender: {'Male' if sex == 'M' else 'Female'}
+                    - Blood Pressure: {resting_bp} mm Hg
+                    - Cholesterol: {cholesterol} mg/dL
+                    - Max Heart Rate: {max_hr} bpm
+                    - Symptoms: {symptoms}
+                    - Risk Assessment: {'HIGH RISK' if prediction == 1 else 'LOW RISK'}
+                    - Similar Patients: {neighbours.similar_patients_text(assessment)}
+
+                    Provide 4-5 specific, actionable health recommendations in clear sections:
+                    1. Immediate Actions (if high risk) or Preventive Measures (if low risk)
+                    2. Dietary Recommendations
+                    3. Exercise Guidelines
+                    4. Lifestyle Modifications
+                    5. Medical Follow-up
+
+                    Be empathetic, encouraging, and professional. Use simple headings without asterisks.
+                    """
+
+                # Store data for report
+                st.session_state["user_data"] = {
+                    'name': user_name,
+                    'Age': age,
+                    'sex': 'Male' if sex == 'M' else 'Female',
+                    'RestingBP': resting_bp,
+                    'Cholesterol': cholesterol,
+                    'MaxHR': max_hr,
+                    'chest_pain': chest_pain,
+                    'oldpeak': oldpeak,
+                    'fasting_bs': fasting_bs,
+                    'resting_ecg': resting_ecg,
+                    'exercise_angina': 'Yes' if exercise_angina == 'Y' else 'No',
+                    'st_slope': st_slope,
+                    'symptoms': symptoms
+                }
+
+                # Start the recommendations call now so it overlaps with rendering the result.
+                # It falls back to locally generated tips if the LLM misses its deadline.
+                tips_task = st.session_state["tasks"].stream(
+                    "recommendations", llm.guarded_recommendations, prompt,
+                    st.session_state["user_data"], prediction,
+                    timeout=RECOMMENDATION_TIMEOUT
+                )
+                st.session_state["prediction"] = prediction
+                st.session_state["assessment"] = assessment
+                st.session_state["prediction_made"] = True
 
+                show_result(prediction, assessment)
+                tips_box = st.empty()
                 try:
-                    response = client.chat.completions.create(
-                        model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
-                        messages=[
-                            {"role": "system", "content": "You are HeartAlert AI. Provide clear, well-structured health recommendations. Use simple numbered sections without markdown symbols like asterisks or double asterisks. Write in plain text with clear formatting."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.7,
-                        max_tokens=700
-                    )
-                    tips = response.choices[0].message.content.strip()
-                    # Remove all markdown symbols
-                    tips_clean = tips.replace('**', '').replace('*', '').replace('#', '')
+                    chunks = iter(tips_task)
+                    # Spinner only until the first token; the rest renders as it streams
+                    with st.spinner("🤖 Generating personalized health tips..."):
+                        first_chunk = next(chunks, "")
+
+                    tips_clean = ""
+                    for text in chain([first_chunk], chunks):
+                        tips_clean += text
+                        show_tips(tips_box, tips_clean)
                     st.session_state["tips"] = tips_clean
 
-                    st.markdown(f"""
-                    <div class="info-box">
-                    {tips_clean}
-                    </div>
-                    """, unsafe_allow_html=True)
+                except (TaskTimeout, TaskCancelled):
+                    st.session_state["tips"] = llm_guard.local_recommendations(st.session_state["user_data"],
+                                                                               prediction)
+                    show_tips(tips_box, st.session_state["tips"])
+
+                # Form submission to the last recommendation token
+                metrics.record_stage("analysis", time.perf_counter() - analysis_start)
+                prefetch_report()
 
-                except Exception as e:
-                    st.error(f"Error generating recommendations: {e}")
-                    st.session_state["tips"] = "Unable to generate recommendations at this time."
+    elif st.session_state["prediction_made"]:
+        # The last result stays on screen while the form is edited
+        show_result(st.session_state["prediction"], st.session_state["assessment"])
+        show_tips(st.empty(), st.session_state.get("tips", ""))
+
+assessment_panel()
 
 # -------------------------
 # Download Report
 # -------------------------
-if st.session_state["prediction_made"]:
-    st.markdown("---")
-    col_report1, col_report2, col_report3 = st.columns([1, 2, 1])
-    
-    with col_report2:
-        if st.button("Download Complete Report (PDF)", use_container_width=True):
-            with st.spinner("📝 Generating your comprehensive health report..."):
-                try:
-                    pdf_bytes = generate_pdf_report(
-                        st.session_state["user_data"],
-                        st.session_state["prediction"],
-                        st.session_state.get("tips", ""),
-                        st.session_state["user_data"]["symptoms"],
-                        st.session_state["messages"]
-                    )
-                    
-                    st.download_button(
-                        label="Click to Download",
-                        data=pdf_bytes,
-                        file_name=f"HeartAlert_Report_{st.session_state['user_data']['name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
-                    
-                    st.success("Report generated successfully! This includes your assessment, AI recommendations, and complete chat history.")
-                    
-                except Exception as e:
-                    st.error(f"Error generating report: {e}")
+@st.fragment(key="report")
+def report_panel():
+    if st.session_state["prediction_made"]:
+        st.markdown("---")
+        col_report1, col_report2, col_report3 = st.columns([1, 2, 1])
+
+        with col_report2:
+            if st.button("Download Complete Report (PDF)", use_container_width=True):
+                with st.spinner("📝 Generating your comprehensive health report..."):
+                    try:
+                        # Usually already built in the background after the last change
+                        pdf_bytes = get_report_bytes()
+
+                        st.download_button(
+                            label="Click to Download",
+                            data=pdf_bytes,
+                            file_name=f"HeartAlert_Report_{st.session_state['user_data']['name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.pdf",
+                            mime="application/pdf",
+                            use_container_width=True
+                        )
+
+                        st.success("Report generated successfully! This includes your assessment, AI recommendations, and complete chat history.")
+
+                    except Exception as e:
+                        st.error(f"Error generating report: {e}")
+
+report_panel()
 
 # Footer
 st.markdown("---")
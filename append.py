@@ -0,0 +1,192 @@
+import argparse
+import sys
+
+import numpy as np
+
+import artifact
+from knn_engine import ExactKNN
+from pipeline import LABEL_COLUMN, NUMERIC_COLUMNS, FeatureEncoder
+
+# Appends newly labeled patients to the KNN reference set without
+# retraining: the column schema and scaler stay frozen, so the rows already
+# in the store keep their encoding and serving processes only compute the
+# new rows' part of the index. When the data appended since the scaler was
+# fit drifts too far from it, the scaler is refit on the whole set instead.
+# Below DRIFT_MIN_ROWS the sample statistics are too noisy to act on: random
+# 100-row draws from heart.csv move a column's std by up to ~0.4 and its mean
+# by ~0.35; at 200 rows both stay under 0.3.
+DEFAULT_DRIFT_THRESHOLD = 0.5
+DRIFT_MIN_ROWS = 200
+
+# Zeros in these columns are missing measurements (see train.prepare_dataset)
+IMPUTED_COLUMNS = ('Cholesterol', 'RestingBP')
+# Columns whose spread can be checked for drift too (threshold_policy's
+# check_spread); for the binary columns a mean shift already says everything
+CONTINUOUS_COLUMNS = ('Age', 'RestingBP', 'Cholesterol', 'MaxHR', 'Oldpeak')
+
+
+# -------------------------
+# Encoding
+# -------------------------
+def encode_labeled(df, encoder, classes):
+    # New rows are preprocessed like the reference rows were in training:
+    # missing measurements take the scaler's mean and numbers are truncated
+    # to integers (the notebook's astype(int)), then scaled with the frozen scaler
+    if LABEL_COLUMN not in df.columns:
+        raise ValueError(f"Input has no {LABEL_COLUMN} column")
+    labels = df[LABEL_COLUMN].to_numpy()
+    known = np.isin(labels, classes)
+    if not known.all():
+        raise ValueError(f"Unknown {LABEL_COLUMN} values in {int((~known).sum())} rows; "
+                         f"expected one of {', '.join(map(str, classes))}")
+
+    df = df.copy()
+    for col in IMPUTED_COLUMNS:
+        if encoder.mean is not None:
+            df[col] = df[col].replace(0, encoder.mean[encoder.index[col]])
+    for col in NUMERIC_COLUMNS:
+        if df[col].notnull().all():
+            df[col] = np.trunc(df[col].to_numpy(dtype=np.float64))
+
+    X = encoder.encode_frame(df)
+    y = np.searchsorted(classes, labels)
+    return X, y
+
+
+# -------------------------
+# Drift
+# -------------------------
+def drift_report(X, columns):
+    # X is scaled with the frozen scaler, whose training data has mean 0 and
+    # std 1 in every column: the score is the largest mean shift, and the
+    # spread score the largest change of a continuous column's std, both in
+    # standard deviations
+    shifts = np.abs(X.mean(axis=0))
+    continuous = [pos for pos, col in enumerate(columns) if col in CONTINUOUS_COLUMNS]
+    spreads = np.abs(X[:, continuous].std(axis=0) - 1.0)
+    worst = int(np.argmax(shifts))
+    widest = int(np.argmax(spreads))
+    return {
+        'rows': len(X),
+        'score': float(shifts[worst]),
+        'feature': columns[worst],
+        'spread_score': float(spreads[widest]),
+        'spread_feature': columns[continuous[widest]],
+        'shifts': {col: round(float(shift), 4) for col, shift in zip(columns, shifts)},
+        'spreads': {columns[pos]: round(float(spread), 4) for pos, spread in zip(continuous, spreads)},
+    }
+
+
+def threshold_policy(threshold=DEFAULT_DRIFT_THRESHOLD, min_rows=DRIFT_MIN_ROWS, check_spread=False):
+    # Drift policy: called with drift_report() output, returns True to refit.
+    # check_spread: also refit when a continuous column's std moves that far
+    def policy(drift):
+        score = max(drift['score'], drift['spread_score']) if check_spread else drift['score']
+        return drift['rows'] >= min_rows and score > threshold
+    return policy
+
+
+def refit_scaler(fit_X, encoder):
+    # Undo the frozen scaling, then fit a StandardScaler's mean/scale on the
+    # whole reference set (constant columns keep a scale of 1, like sklearn)
+    X = np.array(fit_X, dtype=np.float64)
+    if encoder.scale is not None:
+        X *= encoder.scale
+    if encoder.mean is not None:
+        X += encoder.mean
+    mean = X.mean(axis=0) if encoder.mean is not None else None
+    scale = None
+    if encoder.scale is not None:
+        scale = X.std(axis=0)
+        scale[scale < 10 * np.finfo(np.float64).eps] = 1.0
+    refit = FeatureEncoder(encoder.columns, mean, scale)
+    return refit.scale_rows(X), refit
+
+
+# -------------------------
+# Append
+# -------------------------
+def append_rows(df, store=artifact.STORE_DIR, activate=True, drift_policy=None, source=None):
+    # Writes a new version with df's rows appended to the current one.
+    # drift_policy defaults to threshold_policy(); pass lambda drift: False
+    # to never refit.
+    drift_policy = threshold_policy() if drift_policy is None else drift_policy
+    bundle = artifact.load_artifact(store)
+    encoder = FeatureEncoder(bundle.columns, bundle.scaler_mean, bundle.scaler_scale)
+    X_new, y_new = encode_labeled(df, encoder, bundle.classes)
+
+    base = ExactKNN.from_artifact(bundle)
+    n_base = len(bundle.fit_X)
+    rows_since_fit = bundle.manifest.get('metadata', {}).get('rows_since_fit', 0)
+    recent = np.vstack([bundle.fit_X[n_base - rows_since_fit:], X_new])
+    drift = drift_report(recent, bundle.columns)
+
+    fit_X = np.vstack([bundle.fit_X, X_new])
+    y = np.concatenate([bundle.y, y_new])
+    refit = bool(drift_policy(drift))
+    metadata = {'drift': drift}
+    if refit:
+        fit_X, encoder = refit_scaler(fit_X, encoder)
+        knn = ExactKNN(fit_X, y, base.classes, n_neighbors=base.n_neighbors,
+                       weights=base.weights, leaf_size=base.leaf_size)
+        metadata.update(description=f"{len(X_new)} rows appended to {bundle.version}, scaler refit",
+                        rows_since_fit=0)
+    else:
+        knn = base.extended(fit_X, y)
+        # Lets serving processes extend their loaded engine instead of rebuilding it
+        metadata.update(description=f"{len(X_new)} rows appended to {bundle.version}",
+                        append={'base_version': bundle.version, 'base_rows': n_base, 'rows': len(X_new)},
+                        rows_since_fit=rows_since_fit + len(X_new))
+    if source:
+        metadata['source'] = source
+
+    # A refit engine is rebuilt in float64; keep the float32 store if the base had one
+    version = artifact.export_engine(knn, encoder, store=store, activate=activate, metadata=metadata,
+                                     compact=base.compact_X is not None)
+    return {
+        'base_version': bundle.version,
+        'version': version,
+        'appended': len(X_new),
+        'rows': len(fit_X),
+        'drift': drift,
+        'refit': refit,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append newly labeled rows to the KNN reference set.")
+    parser.add_argument("input", help=f"CSV in heart.csv format, including {LABEL_COLUMN}")
+    parser.add_argument("--store", default=artifact.STORE_DIR, help=f"Artifact store (default: {artifact.STORE_DIR})")
+    parser.add_argument("--no-activate", action="store_true", help="Don't point CURRENT at the new version")
+    parser.add_argument("--drift-threshold", type=float, default=DEFAULT_DRIFT_THRESHOLD,
+                        help="Refit the scaler when the rows appended since it was fit shift a column's "
+                             f"mean by more than this many standard deviations (default: {DEFAULT_DRIFT_THRESHOLD})")
+    parser.add_argument("--drift-min-rows", type=int, default=DRIFT_MIN_ROWS,
+                        help=f"Rows needed before drift is acted on (default: {DRIFT_MIN_ROWS})")
+    parser.add_argument("--drift-spread", action="store_true",
+                        help="Also refit when a continuous column's std moves by more than the threshold")
+    parser.add_argument("--no-refit", action="store_true", help="Report drift but never refit the scaler")
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+
+    policy = (lambda drift: False) if args.no_refit else threshold_policy(args.drift_threshold, args.drift_min_rows,
+                                                                          args.drift_spread)
+    try:
+        result = append_rows(pd.read_csv(args.input), args.store, not args.no_activate, policy, source=args.input)
+    except (artifact.ArtifactError, OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    drift = result['drift']
+    print(f"Appended {result['appended']} rows to {result['base_version']}: "
+          f"{result['version']} has {result['rows']} reference rows")
+    print(f"Drift since the scaler was fit: mean {drift['score']:.3f} ({drift['feature']}), "
+          f"std {drift['spread_score']:.3f} ({drift['spread_feature']}) over {drift['rows']} rows")
+    if result['refit']:
+        print("Drift exceeded the threshold: scaler refit on the whole reference set")
+    if args.no_activate:
+        print(f"Serve it with: python artifact.py activate {result['version']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from knn_engine import compact_store
+
+# -------------------------
+# Store Layout
+# -------------------------
+# model_store/
+#   CURRENT                  version id of the artifact being served
+#   <version>/manifest.json  schema, scaler flags, KNN hyperparameters, checksums
+#   <version>/*.npy          raw arrays, memory-mapped read-only on load
+#   <version>/fit_X32.npy    optional float32 copy of fit_X that the
+#                            neighbour search runs on (knn_engine.compact_store)
+#   <version>/tree_*.npy     optional KD-tree layout of the model the artifact
+#                            was made from, so ties break in the same order
+#                            whichever sklearn loads it (knn_engine.restore_tree)
+STORE_DIR = "model_store"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+FORMAT_VERSION = 1
+
+ARRAYS = ('fit_X', 'y', 'classes', 'scaler_mean', 'scaler_scale')
+TREE_ARRAYS = ('tree_idx', 'tree_nodes', 'tree_bounds')
+OPTIONAL_ARRAYS = ('fit_X32',) + TREE_ARRAYS
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class Artifact:
+    def __init__(self, path, manifest, arrays):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest['version']
+        self.columns = manifest['columns']
+        self.knn_params = manifest['knn']
+        self.fit_X = arrays['fit_X']
+        self.y = arrays['y']
+        self.classes = arrays['classes']
+        self.scaler_mean = arrays['scaler_mean'] if manifest['scaler']['with_mean'] else None
+        self.scaler_scale = arrays['scaler_scale'] if manifest['scaler']['with_std'] else None
+        self.compact_X = arrays.get('fit_X32')
+        self.tree_layout = tuple(arrays[name] for name in TREE_ARRAYS) if 'tree_idx' in arrays else None
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _version_of(manifest):
+    # Checksum over everything that affects predictions
+    payload = {key: manifest[key] for key in ('format', 'columns', 'scaler', 'knn', 'arrays')}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# -------------------------
+# Writing
+# -------------------------
+def write_artifact(arrays, columns, knn_params, scaler_flags, store=STORE_DIR, activate=True, metadata=None):
+    os.makedirs(store, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=store)
+    try:
+        entries = {}
+        for name in ARRAYS + tuple(name for name in OPTIONAL_ARRAYS if name in arrays):
+            array = np.ascontiguousarray(arrays[name])
+            filename = f"{name}.npy"
+            np.save(os.path.join(staging, filename), array, allow_pickle=False)
+            entries[name] = {
+                'file': filename,
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'sha256': _sha256(os.path.join(staging, filename)),
+            }
+
+        manifest = {
+            'format': FORMAT_VERSION,
+            'columns': list(columns),
+            'scaler': scaler_flags,
+            'knn': knn_params,
+            'arrays': entries,
+        }
+        manifest['version'] = _version_of(manifest)
+        # Provenance (e.g. how a reference set was reduced); not part of the version
+        if metadata:
+            manifest['metadata'] = metadata
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        target = os.path.join(store, manifest['version'])
+        if os.path.exists(target):
+            shutil.rmtree(staging)
+        else:
+            os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    if activate:
+        set_current(manifest['version'], store)
+    return manifest['version']
+
+
+def set_current(version, store=STORE_DIR):
+    if not os.path.isfile(os.path.join(store, version, MANIFEST_FILE)):
+        raise ArtifactError(f"No artifact {version} in {store}")
+    # os.replace is atomic, so readers see either the old or the new version
+    fd, tmp = tempfile.mkstemp(prefix=".current-", dir=store)
+    with os.fdopen(fd, 'w') as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(store, CURRENT_FILE))
+
+
+def canonical_classes(classes):
+    # Integer labels are stored as int64 whatever platform the model was
+    # pickled on, so retraining the same model gives the same version
+    classes = np.asarray(classes)
+    return classes.astype(np.int64) if classes.dtype.kind in 'iu' else classes
+
+
+def convert_pickles(model, scaler, columns, store=STORE_DIR, activate=True, compact=False):
+    if model.effective_metric_ != 'euclidean':
+        raise ArtifactError(f"Only euclidean KNN models are supported, got {model.effective_metric_!r}")
+    arrays = {
+        'fit_X': np.asarray(model._fit_X, dtype=np.float64),
+        'y': np.asarray(model._y, dtype=np.int64),
+        'classes': canonical_classes(model.classes_),
+        'scaler_mean': np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(len(columns)), dtype=np.float64),
+        'scaler_scale': np.asarray(scaler.scale_ if scaler.with_std else np.ones(len(columns)), dtype=np.float64),
+    }
+    knn_params = {
+        'n_neighbors': int(model.n_neighbors),
+        'weights': model.weights,
+        'leaf_size': int(model.leaf_size),
+    }
+    scaler_flags = {'with_mean': bool(scaler.with_mean), 'with_std': bool(scaler.with_std)}
+    if compact:
+        arrays['fit_X32'] = compact_store(arrays['fit_X'])
+    if model._fit_method == 'kd_tree':
+        _, idx, nodes, bounds = model._tree.get_arrays()
+        arrays.update(zip(TREE_ARRAYS, (np.asarray(idx, dtype=np.int64), nodes, bounds)))
+    return write_artifact(arrays, columns, knn_params, scaler_flags, store=store, activate=activate)
+
+
+def export_engine(knn, encoder, store=STORE_DIR, activate=True, metadata=None, compact=None):
+    # Writes a loaded (ExactKNN, FeatureEncoder) pair, e.g. after its
+    # reference set was changed, as a new version. compact: also write the
+    # float32 store (default: if the engine has one)
+    n_features = len(encoder.columns)
+    arrays = {
+        'fit_X': np.asarray(knn.fit_X, dtype=np.float64),
+        'y': np.asarray(knn.y, dtype=np.int64),
+        'classes': canonical_classes(knn.classes),
+        'scaler_mean': np.zeros(n_features) if encoder.mean is None else np.asarray(encoder.mean, dtype=np.float64),
+        'scaler_scale': np.ones(n_features) if encoder.scale is None else np.asarray(encoder.scale, dtype=np.float64),
+    }
+    knn_params = {
+        'n_neighbors': int(knn.n_neighbors),
+        'weights': knn.weights,
+        'leaf_size': int(knn.leaf_size),
+    }
+    scaler_flags = {'with_mean': encoder.mean is not None, 'with_std': encoder.scale is not None}
+    if compact is None:
+        compact = knn.compact_X is not None
+    if compact:
+        arrays['fit_X32'] = compact_store(arrays['fit_X'])
+    layout = knn.saved_tree_layout()
+    if layout is not None:
+        arrays.update(zip(TREE_ARRAYS, layout))
+    return write_artifact(arrays, encoder.columns, knn_params, scaler_flags, store=store,
+                          activate=activate, metadata=metadata)
+
+
+# -------------------------
+# Reading
+# -------------------------
+def current_version(store=STORE_DIR):
+    try:
+        with open(os.path.join(store, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(store=STORE_DIR):
+    if not os.path.isdir(store):
+        return []
+    versions = []
+    for name in os.listdir(store):
+        path = os.path.join(store, name, MANIFEST_FILE)
+        if os.path.isfile(path):
+            with open(path) as f:
+                versions.append(json.load(f))
+    return sorted(versions, key=lambda manifest: os.path.getmtime(os.path.join(store, manifest['version'])))
+
+
+def load_artifact(store=STORE_DIR, version=None, verify=False):
+    version = version or current_version(store)
+    if version is None:
+        raise ArtifactError(f"No current artifact in {store}")
+
+    path = os.path.join(store, version)
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ArtifactError(f"Unsupported artifact format {manifest.get('format')!r}")
+
+    arrays = {}
+    for name in ARRAYS + tuple(name for name in OPTIONAL_ARRAYS if name in manifest['arrays']):
+        entry = manifest['arrays'][name]
+        file_path = os.path.join(path, entry['file'])
+        if verify and _sha256(file_path) != entry['sha256']:
+            raise ArtifactError(f"Checksum mismatch for {entry['file']} in {version}")
+        # Read-only mapping: pages are shared between server processes and
+        # nothing is read until a query touches it
+        arrays[name] = np.load(file_path, mmap_mode='r', allow_pickle=False)
+        if arrays[name].dtype.str != entry['dtype'] or list(arrays[name].shape) != entry['shape']:
+            raise ArtifactError(f"{entry['file']} does not match the manifest")
+
+    if verify and _version_of(manifest) != manifest['version']:
+        raise ArtifactError(f"Manifest checksum mismatch for {version}")
+    return Artifact(path, manifest, arrays)
+
+
+# -------------------------
+# Command Line
+# -------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and inspect the HeartAlert model artifact.")
+    parser.add_argument("command", choices=["convert", "compact", "info", "verify", "list", "activate"])
+    parser.add_argument("version", nargs="?",
+                        help="activate: version to serve; compact/info/verify: version to use (default: current)")
+    parser.add_argument("--store", default=STORE_DIR, help=f"Artifact store directory (default: {STORE_DIR})")
+    parser.add_argument("--no-activate", action="store_true",
+                        help="convert/compact: don't point CURRENT at the new version")
+    parser.add_argument("--compact", action="store_true", help="convert: also write the float32 reference store")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        from pipeline import load_models
+
+        model, scaler, columns = load_models()
+        version = convert_pickles(model, scaler, columns, store=args.store, activate=not args.no_activate,
+                                  compact=args.compact)
+        print(f"Wrote artifact {version} to {os.path.join(args.store, version)}")
+        return
+
+    if args.command == "compact":
+        # Same reference set plus its float32 copy, as a new version
+        from knn_engine import ExactKNN
+        from pipeline import FeatureEncoder
+
+        try:
+            bundle = load_artifact(args.store, args.version, verify=True)
+        except (ArtifactError, OSError) as e:
+            sys.exit(f"Error: {e}")
+        if bundle.compact_X is not None:
+            sys.exit(f"Error: {bundle.version} already has a float32 store")
+        metadata = dict(bundle.manifest.get('metadata', {}))
+        # Not an append: a serving process reloads it rather than extending its engine
+        metadata.pop('append', None)
+        metadata['description'] = f"float32 store for {bundle.version}"
+        version = export_engine(ExactKNN.from_artifact(bundle),
+                                FeatureEncoder(bundle.columns, bundle.scaler_mean, bundle.scaler_scale),
+                                store=args.store, activate=not args.no_activate, metadata=metadata, compact=True)
+        print(f"Wrote artifact {version} to {os.path.join(args.store, version)}")
+        return
+
+    if args.command == "list":
+        current = current_version(args.store)
+        for manifest in list_versions(args.store):
+            rows = manifest['arrays']['fit_X']['shape'][0]
+            note = manifest.get('metadata', {}).get('description', '')
+            marker = "*" if manifest['version'] == current else " "
+            print(f"{marker} {manifest['version']}  {rows:>8} rows  {note}")
+        return
+
+    if args.command == "activate":
+        if not args.version:
+            parser.error("activate needs a version")
+        try:
+            load_artifact(args.store, args.version, verify=True)
+            set_current(args.version, args.store)
+        except (ArtifactError, OSError) as e:
+            sys.exit(f"Error: {e}")
+        print(f"Serving {args.version}")
+        return
+
+    try:
+        artifact = load_artifact(args.store, args.version, verify=args.command == "verify")
+    except (ArtifactError, OSError) as e:
+        sys.exit(f"Error: {e}")
+
+    if args.command == "verify":
+        print(f"ok   {artifact.version}")
+    else:
+        print(f"version:    {artifact.version}")
+        print(f"path:       {artifact.path}")
+        print(f"reference:  {artifact.fit_X.shape[0]} rows x {artifact.fit_X.shape[1]} features")
+        print(f"knn:        {artifact.knn_params}")
+        print(f"search:     {'float32 store' if artifact.compact_X is not None else 'float64'}")
+        print(f"kd-tree:    {'saved layout' if artifact.tree_layout is not None else 'rebuilt on load'}")
+        print(f"columns:    {', '.join(artifact.columns)}")
+        if 'metadata' in artifact.manifest:
+            print(f"metadata:   {json.dumps(artifact.manifest['metadata'])}")
+
+
+if __name__ == "__main__":
+    main()
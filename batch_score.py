@@ -0,0 +1,256 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+from pipeline import DEFAULT_CHUNK_SIZE, load_pipeline
+
+# Scores a CSV of any size in bounded memory. The input is read in
+# fixed-size chunks of raw lines; each chunk is parsed, encoded, scaled and
+# scored (in worker processes with --workers > 1) and appended to the output
+# in input order. After every chunk the output is flushed to disk and a
+# checkpoint records how far both files got, so a crashed job resumes from
+# the last committed chunk. Input records must be one per line, and each
+# input line is written back as read with the results added to it, so values
+# keep their exact text whatever dtype pandas infers for a chunk.
+CHECKPOINT_SUFFIX = ".checkpoint"
+CHUNKS_PER_WORKER = 2
+RISK_LABELS = {0: 'LOW', 1: 'HIGH'}
+RESULT_COLUMNS = ('Prediction', 'Risk')
+
+_worker = {}
+
+
+# -------------------------
+# Pipeline Stages
+# -------------------------
+def read_chunks(f, chunk_size, header):
+    # Yields (header + chunk_size raw lines, input offset after the chunk)
+    offset = f.tell()
+    while True:
+        lines = list(itertools.islice(f, chunk_size))
+        if not lines:
+            return
+        offset += sum(map(len, lines))
+        yield header + b"".join(lines), offset
+
+
+def parse_chunk(payload):
+    return pd.read_csv(io.BytesIO(payload))
+
+
+def encode_chunk(df, encoder, buffer):
+    return encoder.encode_frame(df, out=buffer, scaled=False)
+
+
+def scale_chunk(X, encoder):
+    return encoder.scale_rows(X)
+
+
+def predict_chunk(X, knn):
+    return knn.predict(X)
+
+
+def format_chunk(payload, predictions):
+    header, *lines = payload.splitlines()
+    lines = [line for line in lines if line.strip()]
+    if len(lines) != len(predictions):
+        raise ValueError(f"{len(predictions)} records on {len(lines)} lines; input records must be one per line")
+    results = [(str(int(p)), RISK_LABELS[int(p)]) for p in predictions]
+
+    positions = result_positions(header)
+    if positions == [None] * len(RESULT_COLUMNS):
+        return b"".join(line + f",{prediction},{risk}\n".encode() for line, (prediction, risk) in zip(lines, results))
+
+    # The input already has result columns (e.g. it was scored before):
+    # overwrite those fields and leave the others as they are
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for fields, values in zip(csv.reader(line.decode('utf-8') for line in lines), results):
+        for position, value in zip(positions, values):
+            if position is None or position >= len(fields):
+                fields.append(value)
+            else:
+                fields[position] = value
+        writer.writerow(fields)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _init_worker(chunk_size):
+    knn, encoder = load_pipeline()
+    _worker.update(knn=knn, encoder=encoder, buffer=np.empty((chunk_size, encoder.n_features)))
+
+
+def score_chunk(payload):
+    # Returns (output CSV bytes, rows, high-risk rows)
+    knn, encoder = _worker['knn'], _worker['encoder']
+    df = parse_chunk(payload)
+    X = scale_chunk(encode_chunk(df, encoder, _worker['buffer']), encoder)
+    predictions = predict_chunk(X, knn)
+    return format_chunk(payload, predictions), len(df), int(predictions.sum())
+
+
+def score_chunks(chunks, workers, chunk_size):
+    # Results in input order, with at most workers * CHUNKS_PER_WORKER
+    # chunks in flight so memory doesn't grow with the input
+    if workers <= 1:
+        _init_worker(chunk_size)
+        for payload, offset in chunks:
+            yield score_chunk(payload), offset
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(chunk_size,)) as pool:
+        pending = deque()
+        for payload, offset in chunks:
+            pending.append((pool.submit(score_chunk, payload), offset))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                future, done_offset = pending.popleft()
+                yield future.result(), done_offset
+        while pending:
+            future, done_offset = pending.popleft()
+            yield future.result(), done_offset
+
+
+# -------------------------
+# Checkpoints
+# -------------------------
+def job_identity(input_path, chunk_size):
+    # A checkpoint is only valid for the same input, chunking and model
+    stat = os.stat(input_path)
+    return {
+        'input': os.path.abspath(input_path),
+        'input_size': stat.st_size,
+        'input_mtime_ns': stat.st_mtime_ns,
+        'chunk_size': chunk_size,
+        'model_version': str(pipeline.artifact_version()),
+    }
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def input_columns(header):
+    return next(csv.reader([header.decode('utf-8-sig')]), [])
+
+
+def result_positions(header):
+    # Column index of Prediction and Risk in the input, None where they are appended
+    columns = input_columns(header)
+    return [columns.index(col) if col in columns else None for col in RESULT_COLUMNS]
+
+
+def output_header(header):
+    missing = [col for col in RESULT_COLUMNS if col not in input_columns(header)]
+    return header.rstrip(b"\r\n") + "".join(f",{col}" for col in missing).encode('utf-8') + b"\n"
+
+
+# -------------------------
+# Command Line
+# -------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Score a CSV cohort (heart.csv schema) with the HeartAlert KNN model."
+    )
+    parser.add_argument("input", help="CSV file with the same columns as heart.csv")
+    parser.add_argument("-o", "--output",
+                        help="Where to write predictions (default: <input>_scored.csv)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Rows read and scored per chunk (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes scoring chunks in parallel (default: 1)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore a checkpoint left by an interrupted run and start over")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.chunk_size < 1:
+        sys.exit("--chunk-size must be at least 1")
+    if args.workers < 1:
+        sys.exit("--workers must be at least 1")
+
+    output = args.output or f"{os.path.splitext(args.input)[0]}_scored.csv"
+    checkpoint_path = output + CHECKPOINT_SUFFIX
+    identity = job_identity(args.input, args.chunk_size)
+
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint['job'] != identity:
+        sys.exit(f"Error: {checkpoint_path} belongs to a different input, chunk size or model; "
+                 "use --restart to start over")
+    if checkpoint is not None:
+        # The checkpoint vouches for the first output_offset bytes of the output
+        size = os.path.getsize(output) if os.path.isfile(output) else None
+        if size is None or size < checkpoint['output_offset']:
+            found = "is missing" if size is None else f"is shorter ({size} bytes) than the checkpoint records"
+            sys.exit(f"Error: cannot resume from {checkpoint_path}: {output} {found}; use --restart to start over")
+
+    start = time.perf_counter()
+    with open(args.input, 'rb') as f:
+        header = f.readline()
+        if not header.strip():
+            sys.exit(f"Error: {args.input} is empty; expected a header row with the heart.csv columns")
+        if checkpoint is None:
+            checkpoint = {'job': identity, 'chunks': 0, 'rows': 0, 'high_risk': 0,
+                          'input_offset': f.tell(), 'output_offset': 0}
+            out = open(output, 'wb')
+            out.write(output_header(header))
+        else:
+            print(f"Resuming after chunk {checkpoint['chunks']} ({checkpoint['rows']} rows already scored)")
+            out = open(output, 'r+b')
+            out.truncate(checkpoint['output_offset'])
+            out.seek(checkpoint['output_offset'])
+            f.seek(checkpoint['input_offset'])
+
+        resumed_rows = checkpoint['rows']
+        with out:
+            chunks = read_chunks(f, args.chunk_size, header)
+            try:
+                for (payload, rows, high), offset in score_chunks(chunks, args.workers, args.chunk_size):
+                    out.write(payload)
+                    out.flush()
+                    os.fsync(out.fileno())
+                    checkpoint['chunks'] += 1
+                    checkpoint['rows'] += rows
+                    checkpoint['high_risk'] += high
+                    checkpoint['input_offset'] = offset
+                    checkpoint['output_offset'] = out.tell()
+                    save_checkpoint(checkpoint_path, checkpoint)
+            except ValueError as e:
+                sys.exit(f"Error in chunk {checkpoint['chunks'] + 1} "
+                         f"(rows {checkpoint['rows'] + 1}-{checkpoint['rows'] + args.chunk_size}): {e}")
+    elapsed = time.perf_counter() - start
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    scored = checkpoint['rows'] - resumed_rows
+    rate = scored / elapsed if elapsed > 0 else float('inf')
+    print(f"Scored {scored} rows in {elapsed:.3f}s ({rate:,.0f} rows/sec)")
+    print(f"High risk: {checkpoint['high_risk']} / {checkpoint['rows']}")
+    print(f"Predictions written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm  # noqa: E402
+import llm_gateway  # noqa: E402
+from stub_together import start_stub  # noqa: E402
+
+# A burst of chat requests from many sessions at once, against a stub that
+# answers 429 beyond --api-concurrency requests, like the API's rate limit.
+# "direct" shares one SDK client the way every session used to; "gateway"
+# sends the same traffic through llm_gateway.Gateway, which coalesces
+# identical questions and queues the rest for a slot.
+
+
+def workload(users, requests, quick_share, seed):
+    # Per user, the chat messages of each request: a Quick Question (the same
+    # messages for every user who picks it) or a question of their own
+    rng = random.Random(seed)
+    plans = []
+    for user in range(users):
+        plan = []
+        for i in range(requests):
+            if rng.random() < quick_share:
+                question = rng.choice(llm.QUICK_QUESTIONS)
+            else:
+                question = f"User {user}, question {i}: is my blood pressure too high?"
+            plan.append(llm.chat_messages([{'role': 'user', 'content': question}]))
+        plans.append(plan)
+    return plans
+
+
+def run(client, plans):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(len(plans))
+
+    def user(plan):
+        start_gate.wait()
+        for messages in plan:
+            start = time.perf_counter()
+            try:
+                reply = ''.join(llm.stream_chat_reply(messages, client))
+                if not reply:
+                    raise RuntimeError("empty reply")
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=user, args=(plan,)) for plan in plans]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def main(argv=None):
+    from together import Together
+
+    parser = argparse.ArgumentParser(description="Compare direct LLM calls with the shared gateway under a burst.")
+    parser.add_argument("--users", type=int, default=32, help="Concurrent sessions")
+    parser.add_argument("--requests", type=int, default=3, help="Chat requests per session")
+    parser.add_argument("--quick-share", type=float, default=0.5, help="Fraction of requests that are Quick Questions")
+    parser.add_argument("--api-concurrency", type=int, default=8, help="Requests the stub API serves at once")
+    parser.add_argument("--concurrency", type=int, default=8, help="Gateway slots")
+    parser.add_argument("--tokens-per-minute", type=int, default=0, help="Gateway token budget (0: unlimited)")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    plans = workload(args.users, args.requests, args.quick_share, args.seed)
+    total = args.users * args.requests
+    print(f"{args.users} sessions x {args.requests} requests, {args.quick_share:.0%} Quick Questions, "
+          f"API serves {args.api_concurrency} at once\n")
+    print(f"{'mode':<8} {'ok':>5} {'errors':>7} {'upstream':>9} {'429s':>6} {'conns':>6} {'coalesced':>10} "
+          f"{'wait p95':>9} {'p50':>9} {'p95':>9} {'wall':>7}")
+    for mode in ('direct', 'gateway'):
+        server, url = start_stub(first_token_delay=args.first_token_ms / 1000, token_delay=args.token_ms / 1000,
+                                 max_concurrent=args.api_concurrency)
+        config = server.RequestHandlerClass.config
+        try:
+            if mode == 'direct':
+                client = Together(api_key="benchmark", base_url=url, max_retries=0)
+            else:
+                client = llm_gateway.Gateway(
+                    lambda: Together(api_key="benchmark", base_url=url, max_retries=0,
+                                     http_client=llm_gateway.http_client(args.concurrency)),
+                    concurrency=args.concurrency, tokens_per_minute=args.tokens_per_minute)
+            latencies, errors, wall = run(client, plans)
+        finally:
+            server.shutdown()
+        stats = client.stats() if mode == 'gateway' else {'coalesced': 0, 'wait_p95_ms': 0.0}
+        ms = np.array(latencies) * 1e3 if latencies else np.zeros(1)
+        print(f"{mode:<8} {len(latencies):>5} {len(errors):>7} {config.requests:>9} {config.rate_limited:>6} "
+              f"{config.connections:>6} {stats['coalesced']:>10} {stats['wait_p95_ms']:>7.0f}ms "
+              f"{np.percentile(ms, 50):>7.0f}ms {np.percentile(ms, 95):>7.0f}ms {wall:>6.1f}s")
+        if len(latencies) + len(errors) != total:
+            sys.exit(f"{mode}: {total - len(latencies) - len(errors)} requests unaccounted for")
+
+
+if __name__ == "__main__":
+    main()
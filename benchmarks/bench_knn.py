@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knn_engine import ExactKNN  # noqa: E402
+from pipeline import load_models  # noqa: E402
+
+BATCH_SIZES = [1, 4, 16, 64, 256, 1024, 16384]
+
+
+def best_of(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def make_queries(fit_X, n_rows, seed=0):
+    # Jittered copies of training rows so queries look like real patients
+    rng = np.random.default_rng(seed)
+    base = fit_X[rng.integers(0, len(fit_X), n_rows)]
+    return base + rng.normal(0.0, 0.25, base.shape)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark ExactKNN against KNeighborsClassifier.predict.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--reference-rows", type=int,
+                        help="Grow the reference set to this many jittered rows to see the tree/BLAS crossover")
+    args = parser.parse_args(argv)
+
+    model, _, _ = load_models()
+    if args.reference_rows:
+        rng = np.random.default_rng(1)
+        picks = rng.integers(0, len(model._fit_X), args.reference_rows)
+        model = KNeighborsClassifier(n_neighbors=model.n_neighbors, algorithm='kd_tree').fit(
+            make_queries(model._fit_X, args.reference_rows, seed=1), model.classes_[model._y[picks]])
+    knn = ExactKNN.from_model(model)
+    compact = knn.compacted()
+    print(f"reference rows: {len(knn.fit_X)} ({knn.fit_X.nbytes / 2 ** 20:.1f} MB float64, "
+          f"{compact.compact_X.nbytes / 2 ** 20:.1f} MB float32), tree used below batch {knn.batch_threshold} "
+          f"from {knn.tree_min_reference} reference rows\n")
+
+    print(f"{'batch':>7} {'sklearn':>12} {'tree':>12} {'blas':>12} {'blas f32':>12} {'engine':>12} {'speedup':>8}")
+    for n_rows in args.batch_sizes:
+        X = make_queries(knn.fit_X, n_rows)
+        if not np.array_equal(model.predict(X), knn.predict(X)):
+            sys.exit(f"prediction mismatch at batch size {n_rows}")
+        if not np.array_equal(compact._compact_kneighbors(X)[1], knn._brute_kneighbors(X)[1]):
+            sys.exit(f"float32 store neighbour mismatch at batch size {n_rows}")
+
+        repeats = args.repeats if n_rows > 64 else args.repeats * 20
+        sk = best_of(lambda: model.predict(X), repeats)
+        tree = best_of(lambda: knn.tree.query(X, k=knn.n_neighbors), repeats)
+        blas = best_of(lambda: knn._brute_kneighbors(X), repeats)
+        blas32 = best_of(lambda: compact._compact_kneighbors(X), repeats)
+        engine = best_of(lambda: knn.predict(X), repeats)
+        print(f"{n_rows:>7} {sk * 1e3:>10.3f}ms {tree * 1e3:>10.3f}ms {blas * 1e3:>10.3f}ms "
+              f"{blas32 * 1e3:>10.3f}ms {engine * 1e3:>10.3f}ms {sk / engine:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm  # noqa: E402
+import llm_guard  # noqa: E402
+from stub_together import DEFAULT_REPLY, start_stub  # noqa: E402
+
+# Runs guarded recommendation calls against the local stub under injected
+# faults and reports how each call was answered and how long the user
+# waited for the first text. Budgets are scaled down so a run takes seconds.
+USER_DATA = {
+    'name': "Benchmark", 'Age': 58, 'sex': 'Male', 'RestingBP': 150, 'Cholesterol': 260, 'MaxHR': 98,
+    'chest_pain': 'ASY', 'oldpeak': 2.3, 'fasting_bs': 1, 'resting_ecg': 'ST', 'exercise_angina': 'Yes',
+    'st_slope': 'Flat', 'symptoms': "Tightness when climbing stairs",
+}
+
+# name: (stub settings, hedge percentile)
+SCENARIOS = {
+    'healthy': ({}, None),
+    'errors-30%': ({'error_rate': 0.3}, None),
+    'stalls-10%': ({'stall_rate': 0.1}, None),
+    'stalls-10%-hedged': ({'stall_rate': 0.1}, 90),
+    'drops-20%': ({'drop_rate': 0.2}, None),
+    'down': ({'error_rate': 1.0}, None),
+    'slow': ({'first_token_delay': 5.0}, None),
+}
+
+
+def run_scenario(stub_settings, hedge, args):
+    from together import Together
+
+    settings = {'first_token_delay': args.first_token_ms / 1000, 'token_delay': 0.0005,
+                'stall_delay': 10.0, 'seed': args.seed, **stub_settings}
+    server, url = start_stub(**settings)
+    client = Together(api_key="benchmark", base_url=url, max_retries=0)
+    policy = llm_guard.GuardPolicy(budget=args.budget, attempt_timeout=args.attempt_timeout,
+                                   stall_timeout=args.attempt_timeout, retries=args.retries,
+                                   hedge_percentile=hedge, hedge_min_samples=10, seed=args.seed)
+    latency = llm_guard.LatencyTracker()
+    expected = DEFAULT_REPLY.strip().replace('*', '').replace('#', '')
+
+    first, total, outcomes, attempts, hedged, wrong = [], [], Counter(), [], 0, 0
+    try:
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            stream = llm.guarded_recommendations("Patient summary", USER_DATA, 1, client, policy)
+            stream.latency = latency
+            chunks = []
+            for text in stream:
+                if not chunks:
+                    first.append(time.perf_counter() - start)
+                chunks.append(text)
+            total.append(time.perf_counter() - start)
+            outcomes[stream.outcome] += 1
+            attempts.append(stream.attempts)
+            hedged += stream.hedged
+            reply = ''.join(chunks)
+            if stream.outcome == 'llm' and reply != expected:
+                wrong += 1
+            if stream.outcome == 'fallback' and reply != llm_guard.local_recommendations(USER_DATA, 1):
+                wrong += 1
+    finally:
+        server.shutdown()
+    first_ms = np.array(first) * 1e3
+    return {
+        'outcomes': outcomes,
+        'first_p50': np.percentile(first_ms, 50),
+        'first_p95': np.percentile(first_ms, 95),
+        'first_max': first_ms.max(),
+        'total_p95': np.percentile(np.array(total) * 1e3, 95),
+        'attempts': float(np.mean(attempts)),
+        'hedged': hedged,
+        'wrong': wrong,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exercise the LLM deadline guard against injected faults.")
+    # argparse %-formats help text, and some scenario names contain '%'
+    names = ', '.join(name.replace('%', '%%') for name in SCENARIOS)
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {names} (default: all)")
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--first-token-ms", type=float, default=50.0, help="Stub time to first token")
+    parser.add_argument("--budget", type=float, default=2.0, help="Seconds to the first token, retries included")
+    parser.add_argument("--attempt-timeout", type=float, default=0.5, help="Seconds per attempt")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    print(f"{args.calls} calls per scenario, budget {args.budget:g}s, attempt timeout {args.attempt_timeout:g}s, "
+          f"{args.retries} retries\n")
+    print(f"{'scenario':<20} {'llm':>5} {'partial':>8} {'fallback':>9} {'attempts':>9} {'hedged':>7} "
+          f"{'first p50':>10} {'first p95':>10} {'first max':>10} {'total p95':>10}")
+    failed = False
+    for name in args.scenarios or SCENARIOS:
+        stub_settings, hedge = SCENARIOS[name]
+        r = run_scenario(stub_settings, hedge, args)
+        print(f"{name:<20} {r['outcomes']['llm']:>5} {r['outcomes']['partial']:>8} {r['outcomes']['fallback']:>9} "
+              f"{r['attempts']:>9.2f} {r['hedged']:>7} {r['first_p50']:>8.1f}ms {r['first_p95']:>8.1f}ms "
+              f"{r['first_max']:>8.1f}ms {r['total_p95']:>8.1f}ms")
+        # Every call has to be answered before the budget (plus the fallback itself) runs out
+        if r['first_max'] > (args.budget + 0.25) * 1e3 or r['wrong']:
+            failed = True
+            print(f"  FAIL: first text after {r['first_max']:.0f}ms, {r['wrong']} replies differ from the expected text")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from st_client import AppSession, start_server, stop_server  # noqa: E402
+from stub_together import start_stub  # noqa: E402
+
+# Measures what one interaction costs on a real `streamlit run` server once
+# a session has a prediction and some chat history: wall time until the
+# script finishes, and how many elements the server re-sent. --baseline
+# runs the same flow on app.py from another git revision for comparison.
+SYMPTOMS_PREFIX = "Describe any symptoms"
+INTERACTIONS = ('form tweak', 'chat turn', 'quick question', 'report')
+
+
+async def measure(url, history, repeat):
+    session = AppSession(url)
+    await session.connect()
+    await session.set_value('text_input', "Full Name *", "Jane Doe")
+    await session.set_value('text_area', session.find_widget('text_area', SYMPTOMS_PREFIX).label, "chest pain")
+    await session.click("Analyze Heart Health")
+    for i in range(history):
+        await session.chat(f"Question {i}: how can I improve my heart health?")
+
+    results = {name: [] for name in INTERACTIONS}
+    for i in range(repeat):
+        results['form tweak'].append(await session.set_value('slider', "Age", 40 + i % 20))
+        results['chat turn'].append(await session.chat(f"Follow-up {i}"))
+        # Answered from the response cache after the first click
+        results['quick question'].append(await session.click("What does high blood pressure mean?"))
+        results['report'].append(await session.click("Download Complete Report (PDF)"))
+    await session.close()
+    if session.exceptions:
+        raise RuntimeError(f"app raised: {session.exceptions[0]}")
+    return results
+
+
+def run_app(app_path, args, stub_url):
+    env = {'TOGETHER_API_KEY': "benchmark", 'TOGETHER_BASE_URL': stub_url}
+    process, url = start_server(app_path, args.port, env)
+    try:
+        return asyncio.run(measure(url, args.history, args.repeat))
+    finally:
+        stop_server(process)
+
+
+def summary(stats):
+    ms = sorted(s.seconds * 1e3 for s in stats)
+    return (statistics.median(ms), ms[int(0.9 * (len(ms) - 1))],
+            statistics.median(s.elements for s in stats), statistics.median(s.bytes for s in stats) / 1024)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure per-interaction rerun cost of app.py on a real server.")
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--baseline", help="Git revision whose app.py to measure first, e.g. HEAD~1")
+    parser.add_argument("--history", type=int, default=20, help="Chat turns before measuring")
+    parser.add_argument("--repeat", type=int, default=10, help="Samples per interaction")
+    parser.add_argument("--port", type=int, default=8611)
+    args = parser.parse_args(argv)
+
+    # The LLM answers immediately, so the numbers are the app's own cost
+    stub, stub_url = start_stub(first_token_delay=0.0, token_delay=0.0, chunk_chars=64)
+    apps = [('current', args.app)]
+    baseline_path = None
+    if args.baseline:
+        # Next to app.py, so it imports this tree's modules
+        baseline_path = os.path.join(ROOT, f"_bench_app_{args.baseline.replace('~', '_').replace('/', '_')}.py")
+        source = subprocess.run(["git", "show", f"{args.baseline}:app.py"], cwd=ROOT,
+                                capture_output=True, check=True).stdout
+        with open(baseline_path, 'wb') as f:
+            f.write(source)
+        apps.insert(0, (args.baseline, baseline_path))
+
+    try:
+        results = {name: run_app(path, args, stub_url) for name, path in apps}
+    finally:
+        stub.shutdown()
+        if baseline_path:
+            os.remove(baseline_path)
+
+    print(f"{args.history} chat turns of history, {args.repeat} samples per interaction\n")
+    print(f"{'interaction':<16} {'app':<10} {'median':>9} {'p90':>9} {'elements':>9} {'sent':>9}")
+    for interaction in INTERACTIONS:
+        for name, _ in apps:
+            median, p90, elements, kb = summary(results[name][interaction])
+            print(f"{interaction:<16} {name:<10} {median:>7.1f}ms {p90:>7.1f}ms {elements:>9.0f} {kb:>7.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+
+# Runs in a fresh interpreter so module imports and cached resources are cold
+CHILD = r"""
+import json, os, sys, time
+import warnings
+warnings.filterwarnings("ignore")
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_import = time.perf_counter() - start
+
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+start = time.perf_counter()
+at.run()
+first_run = time.perf_counter() - start
+if at.exception:
+    sys.exit(f"app raised: {at.exception}")
+
+reruns = []
+for i in range(int(sys.argv[2])):
+    # A widget interaction that doesn't trigger any model or LLM work
+    at.slider[0].set_value(30 + i % 50)
+    start = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - start)
+
+heavy = [name for name in ("together", "fpdf", "pandas") if name in sys.modules]
+print(json.dumps({"streamlit_import": streamlit_import, "first_run": first_run,
+                  "reruns": reruns, "loaded_modules": heavy}))
+"""
+
+
+def run_once(reruns):
+    env = dict(os.environ, TOGETHER_API_KEY=os.getenv("TOGETHER_API_KEY", "benchmark"))
+    out = subprocess.run([sys.executable, "-c", CHILD, APP_PATH, str(reruns)],
+                         capture_output=True, text=True, cwd=ROOT, env=env, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app.py time-to-first-paint and per-interaction rerun time.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes to start")
+    parser.add_argument("--reruns", type=int, default=20, help="Widget interactions per process")
+    args = parser.parse_args(argv)
+
+    results = [run_once(args.reruns) for _ in range(args.runs)]
+    first = [r["first_run"] for r in results]
+    reruns = [t for r in results for t in r["reruns"]]
+
+    print(f"first run (script, cold):  median {statistics.median(first) * 1e3:8.1f}ms  "
+          f"min {min(first) * 1e3:8.1f}ms")
+    print(f"rerun (slider change):     median {statistics.median(reruns) * 1e3:8.1f}ms  "
+          f"p90 {statistics.quantiles(reruns, n=10)[-1] * 1e3:8.1f}ms")
+    print(f"heavy modules after first paint: {', '.join(results[0]['loaded_modules']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from st_client import AppSession, start_server, stop_server  # noqa: E402
+from stub_together import start_stub  # noqa: E402
+
+# Drives N concurrent headless sessions through the app's real flow (fill in
+# the form, Analyze, chat, download the report) against a `streamlit run`
+# server and a stub LLM with configurable latency. Each concurrency level
+# gets a fresh server, so its memory growth is attributable to the sessions.
+INTERACTIONS = ('connect', 'fill form', 'analyze', 'chat', 'report', 'download')
+SYMPTOMS_PREFIX = "Describe any symptoms"
+
+
+# -------------------------
+# Sessions
+# -------------------------
+async def user_flow(url, index, chat_turns, timings, errors, sessions):
+    session = AppSession(url)
+    sessions.append(session)
+
+    async def timed(name, coro):
+        start = time.perf_counter()
+        result = await coro
+        timings[name].append(time.perf_counter() - start)
+        return result
+
+    try:
+        await timed('connect', session.connect())
+        start = time.perf_counter()
+        await session.set_value('text_input', "Full Name *", f"Load Test {index}")
+        await session.set_value('text_area', session.find_widget('text_area', SYMPTOMS_PREFIX).label,
+                                "Chest tightness when climbing stairs")
+        timings['fill form'].append(time.perf_counter() - start)
+        await timed('analyze', session.click("Analyze Heart Health"))
+        for turn in range(chat_turns):
+            await timed('chat', session.chat(f"Session {index}, question {turn}: what should I eat?"))
+        await timed('report', session.click("Download Complete Report (PDF)"))
+        pdf = await timed('download', session.download("Click to Download"))
+        if not pdf.startswith(b"%PDF"):
+            errors.append(f"session {index}: download is not a PDF")
+    except Exception as e:
+        errors.append(f"session {index}: {type(e).__name__}: {e}")
+    if session.exceptions:
+        errors.append(f"session {index}: app raised {session.exceptions[0]}")
+
+
+async def run_sessions(url, count, chat_turns):
+    # Sessions stay connected until all have finished, so their state is
+    # still held by the server when memory peaks
+    timings = {name: [] for name in INTERACTIONS}
+    errors, sessions = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(user_flow(url, i, chat_turns, timings, errors, sessions) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(session.close() for session in sessions))
+    return timings, errors, elapsed
+
+
+# -------------------------
+# Server Memory
+# -------------------------
+def rss_bytes(pid):
+    # Linux only; None elsewhere
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = rss_bytes(pid)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# -------------------------
+# Levels
+# -------------------------
+def run_level(count, args, stub_url):
+    env = {'TOGETHER_API_KEY': "load-test", 'TOGETHER_BASE_URL': stub_url}
+    process, url = start_server(args.app, args.port, env)
+    try:
+        # One warm-up session loads the model and imports, so the idle
+        # baseline already includes them
+        asyncio.run(run_sessions(url, 1, 0))
+        idle = rss_bytes(process.pid)
+        with RssSampler(process.pid) as sampler:
+            timings, errors, elapsed = asyncio.run(run_sessions(url, count, args.chat_turns))
+        peak = sampler.peak
+    finally:
+        stop_server(process)
+
+    result = {'sessions': count, 'errors': errors, 'elapsed': elapsed,
+              'rss_idle_mb': idle / 2 ** 20 if idle else None,
+              'rss_peak_mb': peak / 2 ** 20 if peak else None,
+              'rss_per_session_mb': (peak - idle) / 2 ** 20 / count if idle and peak else None,
+              'interactions': {}}
+    for name, samples in timings.items():
+        if samples:
+            ms = np.array(samples) * 1e3
+            result['interactions'][name] = {
+                'samples': len(ms),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'p99_ms': float(np.percentile(ms, 99)),
+            }
+    return result
+
+
+def degradation_point(results, factor, min_increase_ms):
+    # First level where some interaction's p95 is more than `factor` times
+    # its p95 at the lowest level; the absolute floor keeps a few ms of noise
+    # on a fast interaction (the PDF fetch) from counting
+    base = results[0]['interactions']
+    for result in results[1:]:
+        for name, stats in result['interactions'].items():
+            if name not in base:
+                continue
+            p95, base_p95 = stats['p95_ms'], base[name]['p95_ms']
+            if p95 > factor * base_p95 and p95 - base_p95 > min_increase_ms:
+                return result['sessions'], name, stats['p95_ms'], base[name]['p95_ms']
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test app.py with concurrent headless sessions.")
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--port", type=int, default=8621)
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="Comma-separated concurrent session counts")
+    parser.add_argument("--chat-turns", type=int, default=2, help="Chat questions per session")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="Stub LLM time to first token")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="Stub LLM delay between chunks")
+    parser.add_argument("--stub-url", help="Use this Together-compatible server instead of a local stub")
+    parser.add_argument("--degrade-factor", type=float, default=2.0,
+                        help="Latency counts as degraded when a p95 exceeds this multiple of the first level's")
+    parser.add_argument("--min-increase-ms", type=float, default=100.0,
+                        help="...and is also at least this much slower")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+    levels = [int(c) for c in args.sessions.split(",")]
+
+    stub = None
+    stub_url = args.stub_url
+    if stub_url is None:
+        stub, stub_url = start_stub(first_token_delay=args.first_token_ms / 1000,
+                                    token_delay=args.token_ms / 1000)
+
+    results = []
+    try:
+        for count in levels:
+            result = run_level(count, args, stub_url)
+            results.append(result)
+            per_session = result['rss_per_session_mb']
+            print(f"\n{count} sessions: {result['elapsed']:.1f}s, server RSS {result['rss_idle_mb'] or 0:.0f} -> "
+                  f"{result['rss_peak_mb'] or 0:.0f} MB "
+                  f"({'n/a' if per_session is None else f'{per_session:.1f} MB'} per session), "
+                  f"{len(result['errors'])} errors")
+            for error in result['errors'][:3]:
+                print(f"  {error}")
+            print(f"  {'interaction':<12} {'n':>5} {'p50':>10} {'p95':>10} {'p99':>10}")
+            for name, stats in result['interactions'].items():
+                print(f"  {name:<12} {stats['samples']:>5} {stats['p50_ms']:>8.0f}ms "
+                      f"{stats['p95_ms']:>8.0f}ms {stats['p99_ms']:>8.0f}ms")
+    finally:
+        if stub is not None:
+            stub.shutdown()
+
+    point = degradation_point(results, args.degrade_factor, args.min_increase_ms) if len(results) > 1 else None
+    if point:
+        sessions, name, p95, base = point
+        print(f"\nLatency degrades at {sessions} sessions: {name} p95 {p95:.0f}ms vs {base:.0f}ms "
+              f"at {results[0]['sessions']} (more than {args.degrade_factor:g}x)")
+    elif len(results) > 1:
+        print(f"\nNo interaction's p95 grew more than {args.degrade_factor:g}x up to {levels[-1]} sessions")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results,
+                       'degrades_at': point[0] if point else None}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
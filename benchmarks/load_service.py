@@ -0,0 +1,150 @@
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_PATH = os.path.join(ROOT, "service.py")
+sys.path.insert(0, ROOT)
+
+from pipeline import FEATURE_COLUMNS  # noqa: E402
+
+
+def load_records(path):
+    df = pd.read_csv(path)[FEATURE_COLUMNS]
+    return [{col: (value.item() if hasattr(value, 'item') else value) for col, value in row.items()}
+            for row in df.to_dict(orient='records')]
+
+
+def start_service(port, max_batch_size, max_wait_ms):
+    # A separate process, so the load generator's threads don't share its GIL
+    proc = subprocess.Popen(
+        [sys.executable, "-W", "ignore", SERVICE_PATH, "--port", str(port),
+         "--max-batch-size", str(max_batch_size), "--max-wait-ms", str(max_wait_ms)],
+        cwd=ROOT, stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit("Service exited during startup")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.1)
+    proc.terminate()
+    sys.exit("Service did not become ready within 60s")
+
+
+def client(host, port, bodies, stop, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = 0
+    while not stop.is_set():
+        body = bodies[i % len(bodies)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/score", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+    conn.close()
+
+
+def run_level(host, port, bodies, concurrency, duration):
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=client, args=(host, port, bodies[i::concurrency] or bodies, stop, latencies, errors))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1e3 if latencies else np.array([np.nan])
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(lat, 50)),
+        'p95_ms': float(np.percentile(lat, 95)),
+        'p99_ms': float(np.percentile(lat, 99)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the HeartAlert scoring service with single-patient requests.")
+    parser.add_argument("--url", help="Existing service to target (default: start one locally)")
+    parser.add_argument("--port", type=int, default=8601, help="Port for the locally started service")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--concurrency", default="1,4,16,32,64", help="Comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per concurrency level")
+    parser.add_argument("--p99-target-ms", type=float, default=50.0)
+    parser.add_argument("--data", default=os.path.join(ROOT, "heart.csv"))
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    bodies = [json.dumps(record).encode('utf-8') for record in load_records(args.data)]
+    proc = None
+    if args.url:
+        parsed = urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = "127.0.0.1", args.port
+        proc = start_service(port, args.max_batch_size, args.max_wait_ms)
+
+    results = []
+    try:
+        print(f"{'clients':>8} {'req/s':>10} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            result = run_level(host, port, bodies, concurrency, args.duration)
+            results.append(result)
+            print(f"{concurrency:>8} {result['throughput']:>10.0f} {result['p50_ms']:>7.2f}ms "
+                  f"{result['p95_ms']:>7.2f}ms {result['p99_ms']:>7.2f}ms {result['errors']:>7}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    within = [r for r in results if r['p99_ms'] <= args.p99_target_ms and not r['errors']]
+    if within:
+        best = max(within, key=lambda r: r['throughput'])
+        print(f"\nBest throughput with p99 <= {args.p99_target_ms:g}ms: "
+              f"{best['throughput']:.0f} req/s at {best['concurrency']} clients")
+    else:
+        print(f"\nNo level met p99 <= {args.p99_target_ms:g}ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
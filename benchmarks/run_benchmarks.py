@@ -0,0 +1,284 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import llm  # noqa: E402
+import report  # noqa: E402
+import what_if  # noqa: E402
+from knn_engine import ExactKNN  # noqa: E402
+from pipeline import FeatureEncoder, load_models  # noqa: E402
+from stub_together import DEFAULT_REPLY, start_stub  # noqa: E402
+from verify import raw_input_from_row, reference_scaled  # noqa: E402
+
+DATA_PATH = os.path.join(ROOT, "heart.csv")
+DEFAULT_THRESHOLD = 0.20
+GROUPS = ('encode', 'predict', 'what_if', 'pdf', 'llm')
+
+SHORT_CHAT = [
+    {'role': 'user', 'content': "What does high blood pressure mean?"},
+    {'role': 'assistant', 'content': "Blood pressure above 130/80 mm Hg means your heart works harder than it should."},
+]
+LONG_CHAT = [
+    {'role': 'user', 'content': f"Question {i}: how can I improve my heart health this month?"}
+    if i % 2 == 0 else
+    {'role': 'assistant', 'content': "Walk 30 minutes a day, eat more vegetables and fish, and cut down on salt. " * 8}
+    for i in range(40)
+]
+
+
+# -------------------------
+# Timing
+# -------------------------
+def measure(fn, repeat, number=1, warmup=1):
+    # Per-call seconds for `repeat` samples of `number` calls each
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+
+def summarize(samples, **extra):
+    ms = np.array(samples) * 1e3
+    return {
+        'median_ms': float(np.median(ms)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'min_ms': float(ms.min()),
+        'samples': len(ms),
+        **extra,
+    }
+
+
+# -------------------------
+# Benchmarks
+# -------------------------
+def bench_encode(ctx, repeat):
+    rows = ctx['raw_inputs']
+    scaler, columns, encoder = ctx['scaler'], ctx['columns'], ctx['encoder']
+    cycle = itertools.count()
+
+    def dataframe():
+        reference_scaled(rows[next(cycle) % len(rows)], scaler, columns)
+
+    def encoder_single():
+        encoder.encode(rows[next(cycle) % len(rows)])
+
+    return {
+        'encode.dataframe_single': summarize(measure(dataframe, repeat, number=20)),
+        'encode.encoder_single': summarize(measure(encoder_single, repeat, number=200)),
+        'encode.encoder_batch': summarize(measure(lambda: encoder.encode_frame(ctx['df']), repeat),
+                                          rows=len(ctx['df'])),
+    }
+
+
+def bench_predict(ctx, repeat):
+    model, scaler, knn = ctx['model'], ctx['scaler'], ctx['knn']
+    X_raw, X = ctx['X_raw'], ctx['X']
+    cycle = itertools.count()
+
+    def sklearn_single():
+        i = next(cycle) % len(X)
+        model.predict(scaler.transform(X_raw.iloc[i:i + 1]))
+
+    def engine_single():
+        i = next(cycle) % len(X)
+        knn.predict(X[i:i + 1])
+
+    return {
+        'predict.sklearn_single': summarize(measure(sklearn_single, repeat, number=20)),
+        'predict.sklearn_batch': summarize(measure(lambda: model.predict(scaler.transform(X_raw)), repeat),
+                                           rows=len(X)),
+        'predict.engine_single': summarize(measure(engine_single, repeat, number=200)),
+        'predict.engine_batch': summarize(measure(lambda: knn.predict(X), repeat), rows=len(X)),
+    }
+
+
+def bench_what_if(ctx, repeat):
+    # The whole grid in one batched search vs one search per variant
+    knn, encoder = ctx['knn'], ctx['encoder']
+    raw_input = ctx['raw_inputs'][0]
+    X = what_if.variant_rows(raw_input, encoder, what_if.factor_values(raw_input))
+
+    def one_by_one():
+        for i in range(len(X)):
+            knn.query(X[i:i + 1])
+
+    return {
+        'what_if.explore': summarize(measure(lambda: what_if.explore(knn, encoder, raw_input), repeat, number=5),
+                                     variants=len(X)),
+        'what_if.one_by_one': summarize(measure(one_by_one, repeat), variants=len(X)),
+    }
+
+
+def bench_pdf(ctx, repeat):
+    user_data = {
+        'name': "Benchmark Patient", 'Age': 54, 'sex': 'Male', 'RestingBP': 140, 'Cholesterol': 239,
+        'MaxHR': 160, 'chest_pain': 'ASY', 'oldpeak': 1.2, 'fasting_bs': 0, 'resting_ecg': 'Normal',
+        'exercise_angina': 'No', 'st_slope': 'Flat', 'symptoms': "Occasional chest tightness when climbing stairs",
+    }
+    tips = llm.MarkdownStripper(llm.RECOMMENDATION_STRIP_SYMBOLS).feed(DEFAULT_REPLY)
+
+    def render(chat):
+        return lambda: report.generate_pdf_report(user_data, 1, tips, user_data['symptoms'], chat)
+
+    return {
+        'pdf.short_chat': summarize(measure(render(SHORT_CHAT), repeat, number=5)),
+        'pdf.long_chat': summarize(measure(render(LONG_CHAT), repeat, number=2), messages=len(LONG_CHAT)),
+    }
+
+
+def bench_llm(ctx, repeat):
+    from together import Together
+
+    client = Together(api_key="benchmark", base_url=ctx['stub_url'])
+    messages = llm.chat_messages(SHORT_CHAT[:1])
+    results = {}
+    for name, stream in (('llm.chat_stream', lambda: llm.stream_chat_reply(messages, client)),
+                         ('llm.recommendations_stream', lambda: llm.stream_recommendations("Patient summary", client))):
+        first, total = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for i, _chunk in enumerate(stream()):
+                if i == 0:
+                    first.append(time.perf_counter() - start)
+            total.append(time.perf_counter() - start)
+        results[name] = summarize(total, first_chunk_median_ms=statistics.median(first) * 1e3)
+    return results
+
+
+BENCHMARKS = {
+    'encode': bench_encode,
+    'predict': bench_predict,
+    'what_if': bench_what_if,
+    'pdf': bench_pdf,
+    'llm': bench_llm,
+}
+
+
+def build_context(args):
+    df = pd.read_csv(args.data)
+    model, scaler, columns = load_models()
+    encoder = FeatureEncoder.from_scaler(columns, scaler)
+    # Same one-hot frame app.py builds before scaler.transform
+    X_raw = pd.DataFrame(FeatureEncoder(columns).encode_frame(df), columns=columns)
+    stub, stub_url = start_stub(first_token_delay=args.stub_first_token_ms / 1000,
+                                token_delay=args.stub_token_ms / 1000)
+    return {
+        'df': df,
+        'raw_inputs': [raw_input_from_row(row) for _, row in df.iterrows()],
+        'model': model,
+        'scaler': scaler,
+        'columns': columns,
+        'encoder': encoder,
+        'knn': ExactKNN.from_model(model),
+        'X_raw': X_raw,
+        'X': encoder.encode_frame(df),
+        'stub': stub,
+        'stub_url': stub_url,
+    }
+
+
+def environment():
+    import sklearn
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+# -------------------------
+# Comparison
+# -------------------------
+def compare(baseline, current, threshold):
+    # A benchmark regresses when its median is more than `threshold` slower
+    rows = []
+    for name, result in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            rows.append((name, None, result['median_ms'], None, "new"))
+            continue
+        change = result['median_ms'] / base['median_ms'] - 1.0 if base['median_ms'] else 0.0
+        status = "REGRESSION" if change > threshold else "improved" if change < -threshold else "ok"
+        rows.append((name, base['median_ms'], result['median_ms'], change, status))
+
+    print(f"\n{'benchmark':<30} {'baseline':>12} {'current':>12} {'change':>9}  status")
+    for name, base_ms, cur_ms, change, status in rows:
+        base_text = f"{base_ms:10.3f}ms" if base_ms is not None else f"{'-':>12}"
+        change_text = f"{change:+8.1%}" if change is not None else f"{'-':>9}"
+        print(f"{name:<30} {base_text} {cur_ms:10.3f}ms {change_text}  {status}")
+    return [row[0] for row in rows if row[4] == "REGRESSION"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the HeartAlert assessment pipeline.")
+    parser.add_argument("groups", nargs="*", help=f"Groups to run: {', '.join(GROUPS)} (default: all)")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Where to write the results")
+    parser.add_argument("--repeat", type=int, default=15, help="Samples per benchmark")
+    parser.add_argument("--compare", metavar="BASELINE", help="Results file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative slowdown of the median that counts as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--stub-first-token-ms", type=float, default=50.0)
+    parser.add_argument("--stub-token-ms", type=float, default=2.0)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.groups if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(unknown)}")
+
+    ctx = build_context(args)
+    results = {}
+    for group in args.groups or GROUPS:
+        for name, result in BENCHMARKS[group](ctx, args.repeat).items():
+            results[name] = result
+            print(f"{name:<30} median {result['median_ms']:10.3f}ms   p95 {result['p95_ms']:10.3f}ms")
+    ctx['stub'].shutdown()
+
+    current = {
+        'environment': environment(),
+        'settings': {'repeat': args.repeat, 'stub_first_token_ms': args.stub_first_token_ms,
+                     'stub_token_ms': args.stub_token_ms},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            sys.exit(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+# A headless Streamlit browser tab: speaks the app's websocket protocol, so
+# benchmarks drive a real `streamlit run` server (fragment reruns, session
+# state, one script thread per session) rather than AppTest, which always
+# reruns the whole script.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Element type -> WidgetState field the browser sends for it
+VALUE_FIELDS = {
+    'button': 'trigger_value',
+    'text_input': 'string_value',
+    'text_area': 'string_value',
+    'slider': 'double_array_value',
+    'number_input': 'double_value',
+    'chat_input': 'chat_input_value',
+}
+DONE = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+        ForwardMsg.FINISHED_WITH_COMPILE_ERROR)
+
+
+class Widget:
+    def __init__(self, kind, proto, fragment_id):
+        self.kind = kind
+        self.id = proto.id
+        # chat_input has a placeholder instead of a label
+        self.label = proto.label if kind != 'chat_input' else proto.placeholder
+        self.proto = proto
+        self.fragment_id = fragment_id
+
+
+class RunStats:
+    # One interaction: from sending the rerun request to the script finishing
+    # (following any st.rerun() the script makes on the way)
+    def __init__(self):
+        self.seconds = 0.0
+        self.runs = 0
+        self.messages = 0
+        self.elements = 0
+        self.bytes = 0
+        self.fragment = False
+
+
+class AppSession:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.ws = None
+        self.widgets = {}
+        self.values = {}
+        self.texts = []
+        self.exceptions = []
+
+    async def connect(self):
+        ws_url = self.base_url.replace('http', 'ws', 1) + "/_stcore/stream"
+        self.ws = await websockets.connect(ws_url, subprotocols=["streamlit"], max_size=None)
+        return await self.run()
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    def widget(self, kind, label):
+        for widget in reversed(list(self.widgets.values())):
+            if widget.kind == kind and widget.label == label:
+                return widget
+        raise KeyError(f"No {kind} labelled {label!r} on the page")
+
+    def find_widget(self, kind, prefix):
+        for widget in self.widgets.values():
+            if widget.kind == kind and widget.label.startswith(prefix):
+                return widget
+        raise KeyError(f"No {kind} starting with {prefix!r} on the page")
+
+    def widget_states(self, trigger=None, trigger_value=None):
+        msg = BackMsg()
+        states = msg.rerun_script.widget_states
+        for widget_id, (field, value) in self.values.items():
+            if widget_id in self.widgets:
+                set_state(states.widgets.add(), widget_id, field, value)
+        if trigger is not None:
+            set_state(states.widgets.add(), trigger.id, VALUE_FIELDS[trigger.kind], trigger_value)
+        return msg
+
+    async def run(self, trigger=None, trigger_value=True, fragment_id=""):
+        msg = self.widget_states(trigger, trigger_value)
+        msg.rerun_script.fragment_id = fragment_id
+        stats = RunStats()
+        stats.fragment = bool(fragment_id)
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            data = await self.ws.recv()
+            stats.messages += 1
+            stats.bytes += len(data)
+            fwd = ForwardMsg()
+            fwd.ParseFromString(data)
+            kind = fwd.WhichOneof('type')
+            if kind == 'delta':
+                if fwd.delta.WhichOneof('type') == 'new_element':
+                    stats.elements += 1
+                    self.record_element(fwd.delta.new_element, fwd.delta.fragment_id)
+            elif kind == 'script_finished':
+                stats.runs += 1
+                if fwd.script_finished in DONE:
+                    break
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def record_element(self, element, fragment_id):
+        kind = element.WhichOneof('type')
+        proto = getattr(element, kind)
+        if kind in VALUE_FIELDS or kind == 'download_button':
+            self.widgets[proto.id] = Widget(kind, proto, fragment_id)
+        elif kind == 'markdown':
+            self.texts.append(proto.body)
+        elif kind == 'alert':
+            self.texts.append(proto.body)
+        elif kind == 'exception':
+            self.exceptions.append(f"{proto.type}: {proto.message}")
+
+    # Interactions, as a browser sends them: every widget's current value,
+    # scoped to the widget's fragment when it has one
+    async def set_value(self, kind, label, value):
+        widget = self.widget(kind, label)
+        self.values[widget.id] = (VALUE_FIELDS[kind], value)
+        return await self.run(fragment_id=widget.fragment_id)
+
+    async def click(self, label, kind='button'):
+        widget = self.widget(kind, label)
+        return await self.run(trigger=widget, fragment_id=widget.fragment_id)
+
+    async def chat(self, text):
+        widget = next(w for w in self.widgets.values() if w.kind == 'chat_input')
+        return await self.run(trigger=widget, trigger_value=text, fragment_id=widget.fragment_id)
+
+    async def download(self, label):
+        # Fetches the file behind a download button, like the browser does
+        widget = self.widget('download_button', label)
+        url = widget.proto.url
+        if not url.startswith('http'):
+            url = self.base_url + (url if url.startswith('/') else '/' + url)
+        return await asyncio.to_thread(fetch, url)
+
+
+def set_state(state, widget_id, field, value):
+    state.id = widget_id
+    if field == 'double_array_value':
+        state.double_array_value.data[:] = value if isinstance(value, (list, tuple)) else [value]
+    elif field == 'chat_input_value':
+        state.chat_input_value.data = value
+    else:
+        setattr(state, field, value)
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+
+# -------------------------
+# Server
+# -------------------------
+def start_server(app_path, port, env=None):
+    # `streamlit run` in a child process; returns once it answers health checks
+    cmd = [sys.executable, "-m", "streamlit", "run", app_path, "--server.headless", "true",
+           "--server.port", str(port), "--server.address", "127.0.0.1",
+           "--browser.gatherUsageStats", "false", "--server.fileWatcherType", "none"]
+    process = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"streamlit exited with code {process.returncode}")
+        try:
+            if fetch(f"{url}/_stcore/health").strip() == b"ok":
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("streamlit did not start within 60s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
@@ -0,0 +1,226 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the Together chat completions API, so the LLM path can
+# be benchmarked (and the app exercised) without network access or an API key.
+# Point the client at it with TOGETHER_BASE_URL=http://127.0.0.1:<port>/v1.
+# Faults can be injected to exercise llm_guard: error responses, stalls
+# before the first token and connections dropped halfway through a stream.
+# With max_concurrent it answers 429 beyond that many requests at once, like
+# the real API's rate limit. Streams are chunked, so connections are kept
+# alive between requests; `connections` counts how many clients opened.
+
+DEFAULT_REPLY = (
+    "1. Preventive Measures\n"
+    "Keep a record of your **blood pressure** and cholesterol and share it with your doctor.\n\n"
+    "2. Dietary Recommendations\n"
+    "Choose whole grains, vegetables, fruit and fish; limit salt, sugar and saturated fat.\n\n"
+    "3. Exercise Guidelines\n"
+    "Aim for 150 minutes of moderate activity such as brisk walking each week.\n\n"
+    "4. Lifestyle Modifications\n"
+    "Stop smoking, limit alcohol, sleep 7-9 hours and manage stress.\n\n"
+    "5. Medical Follow-up\n"
+    "Book a check-up to review these results with a healthcare professional.\n"
+)
+
+
+class StubConfig:
+    # Fault rates are per-request probabilities; the first `fail_first`
+    # requests always fail with error_status
+    def __init__(self, reply=DEFAULT_REPLY, first_token_delay=0.05, token_delay=0.002, chunk_chars=4,
+                 error_rate=0.0, error_status=500, stall_rate=0.0, stall_delay=30.0, drop_rate=0.0,
+                 fail_first=0, max_concurrent=0, seed=0):
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stall_rate = stall_rate
+        self.stall_delay = stall_delay
+        self.drop_rate = drop_rate
+        self.fail_first = fail_first
+        self.max_concurrent = max_concurrent
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self.rate_limited = 0
+        self.connections = 0
+        self.faults = {'error': 0, 'stall': 0, 'drop': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        # (request number, fault or None), drawn under the lock so a seeded
+        # run injects the same faults in the same order
+        with self._lock:
+            self.requests += 1
+            draw = self._random.random()
+            if self.requests <= self.fail_first or draw < self.error_rate:
+                fault = 'error'
+            elif draw < self.error_rate + self.stall_rate:
+                fault = 'stall'
+            elif draw < self.error_rate + self.stall_rate + self.drop_rate:
+                fault = 'drop'
+            else:
+                fault = None
+            if fault:
+                self.faults[fault] += 1
+            return self.requests, fault
+
+    def enter(self):
+        # False when the request is over max_concurrent and gets a 429
+        with self._lock:
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                self.rate_limited += 1
+                return False
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.config.connected()
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if not self.config.enter():
+            self.send_json(429, {'error': {'message': "Too many concurrent requests", 'type': 'rate_limit'}})
+            return
+        try:
+            self.respond(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (e.g. a timed-out attempt)
+            self.close_connection = True
+        finally:
+            self.config.leave()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def respond(self, body):
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+            return
+
+        config = self.config
+        number, fault = config.next_request()
+        model = body.get('model', 'stub')
+        if fault == 'error':
+            self.send_json(config.error_status, {'error': {'message': "Injected fault", 'type': 'server_error'}})
+            return
+        time.sleep(config.stall_delay if fault == 'stall' else config.first_token_delay)
+
+        if not body.get('stream'):
+            self.send_json(200, {
+                'id': f"stub-{number}", 'object': 'chat.completion', 'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': config.reply},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        reply = config.reply
+        # A dropped stream stops halfway, without [DONE]
+        end = len(reply) // 2 if fault == 'drop' else len(reply)
+        for start in range(0, end, config.chunk_chars):
+            chunk = {
+                'id': f"stub-{number}", 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': reply[start:start + config.chunk_chars]},
+                             'finish_reason': None}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            if config.token_delay:
+                time.sleep(config.token_delay)
+        if fault == 'drop':
+            # Cut off without the terminating chunk
+            self.close_connection = True
+            return
+        final = {
+            'id': f"stub-{number}", 'object': 'chat.completion.chunk', 'created': int(time.time()),
+            'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+        }
+        self.write_chunk(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_stub(port=0, **config):
+    # Runs the stub on a daemon thread; returns (server, base_url)
+    handler = type("BoundStubHandler", (StubHandler,), {'config': StubConfig(**config)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="together-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local Together-compatible chat completions stub.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-ms", type=float, default=50.0, help="Delay before the first chunk")
+    parser.add_argument("--token-ms", type=float, default=2.0, help="Delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected errors")
+    parser.add_argument("--stall-rate", type=float, default=0.0,
+                        help="Fraction of requests that stall before the first chunk")
+    parser.add_argument("--stall-ms", type=float, default=30000.0, help="How long a stalled request waits")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="Fraction of streams cut off halfway through")
+    parser.add_argument("--fail-first", type=int, default=0, help="Fail this many requests before any succeed")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="Answer 429 beyond this many requests at once (default: no limit)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for fault injection")
+    args = parser.parse_args(argv)
+
+    server, url = start_stub(args.port, first_token_delay=args.first_token_ms / 1000,
+                             token_delay=args.token_ms / 1000, error_rate=args.error_rate,
+                             error_status=args.error_status, stall_rate=args.stall_rate,
+                             stall_delay=args.stall_ms / 1000, drop_rate=args.drop_rate,
+                             fail_first=args.fail_first, max_concurrent=args.max_concurrent, seed=args.seed)
+    print(f"Stub listening on {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import math
+import os
+import re
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("HEARTALERT_CHAT_TOKEN_BUDGET", "3000"))
+
+# After a fold the recent window is trimmed to this share of the budget,
+# so the next few turns fit without another summary call
+KEEP_RATIO = 0.6
+
+# Role/formatting tokens the chat template adds around every message
+MESSAGE_OVERHEAD = 4
+
+# Share of the budget the rolling summary may take
+SUMMARY_RATIO = 0.25
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    # Local estimate close to Llama 3's BPE on English text: punctuation is
+    # one token, words are roughly one token per four characters
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _PIECES.findall(text))
+
+
+def message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+def messages_tokens(messages):
+    return sum(message_tokens(msg) for msg in messages)
+
+
+def fallback_summary(previous, turns):
+    # Extractive summary used when the summarizer is unavailable
+    lines = [previous] if previous else []
+    for msg in turns:
+        speaker = "Patient" if msg["role"] == "user" else "HeartAlert"
+        first_sentence = re.split(r"(?<=[.!?])\s", msg["content"].strip(), maxsplit=1)[0]
+        lines.append(f"{speaker}: {first_sentence[:200]}")
+    return "\n".join(lines)
+
+
+def trim_to_tokens(text, limit):
+    # Drop the oldest lines (then characters) until the text fits
+    lines = text.splitlines()
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > limit:
+        lines.pop(0)
+    text = "\n".join(lines)
+    while text and count_tokens(text) > limit:
+        text = text[len(text) // 10 + 1:]
+    return text
+
+
+class ChatContext:
+    # Keeps the prompt for one chat session within a token budget. The most
+    # recent turns are sent verbatim; older ones are folded into a rolling
+    # summary once, when they leave the window, and the summary is reused
+    # on every later turn.
+    def __init__(self, system_message, summarize, budget=DEFAULT_TOKEN_BUDGET):
+        self.system_message = system_message
+        self.summarize = summarize
+        self.budget = budget
+        self.summary = ""
+        self.summarized = 0
+
+    def reset(self):
+        self.summary = ""
+        self.summarized = 0
+
+    def _fixed_tokens(self):
+        tokens = count_tokens(self.system_message) + MESSAGE_OVERHEAD
+        if self.summary:
+            tokens += count_tokens(self.summary) + MESSAGE_OVERHEAD
+        return tokens
+
+    def _window_start(self, history, limit):
+        # Earliest index such that history[index:] fits in `limit` tokens;
+        # the newest message is always kept
+        start = len(history)
+        used = 0
+        for i in range(len(history) - 1, self.summarized - 1, -1):
+            used += message_tokens(history[i])
+            if used > limit and start < len(history):
+                break
+            start = i
+        return start
+
+    def build(self, history):
+        if len(history) < self.summarized:
+            self.reset()
+
+        limit = self.budget - self._fixed_tokens()
+        start = self._window_start(history, limit)
+        if start > self.summarized:
+            start = self._window_start(history, int(limit * KEEP_RATIO))
+            summary = self.summarize(self.summary, history[self.summarized:start])
+            self.summary = trim_to_tokens(summary, int(self.budget * SUMMARY_RATIO))
+            self.summarized = start
+
+        messages = [{"role": "system", "content": self.system_message}]
+        if self.summary:
+            messages.append({"role": "system",
+                             "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return messages + history[self.summarized:]
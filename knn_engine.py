@@ -0,0 +1,331 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Batches smaller than BATCH_THRESHOLD query the KD-tree directly, but only
+# once the reference set is large enough for the tree to beat a single BLAS
+# pass. On the 734-row heart.csv reference set BLAS wins at every batch size;
+# the tree starts winning for small batches around 50k reference rows
+# (see benchmarks/bench_knn.py).
+BATCH_THRESHOLD = 16
+TREE_MIN_REFERENCE = 50_000
+
+# Distance-matrix entries per BLAS block (8 MiB of float64), so the
+# working set stays cache-friendly however large the reference set grows
+BLOCK_ELEMENTS = 1 << 20
+
+# Relative slack on squared distances from the BLAS expansion
+# ||x||^2 - 2 x.y + ||y||^2. Rows with any two of their k+1 nearest candidates
+# closer than this are re-queried on the tree so ties break like sklearn.
+TIE_TOLERANCE = 1e-12
+
+# After rows are appended, a KD-tree built earlier keeps serving the old rows
+# (the new ones are searched exhaustively) until they exceed this fraction of
+# the rows it covers; then it is rebuilt on next use
+TREE_REBUILD_FRACTION = 0.1
+
+# Optional float32 copy of the reference set (see compact_store): searched
+# instead of fit_X, at half the memory traffic. Its squared distances are
+# within COMPACT_ERROR * (n_features + 4) * (||x||^2 + ||y||^2) of the float64
+# ones; rows whose k+1 nearest candidates are not separated by twice that
+# are re-queried in float64, so neighbours, their order and the votes are
+# exactly those of the float64 search.
+COMPACT_ERROR = 2 * float(np.finfo(np.float32).eps)
+
+# Everything one neighbour search yields: predicted labels, the vote share
+# per class (predict_proba), and the neighbours' distances and row indices
+QueryResult = namedtuple('QueryResult', ['labels', 'proba', 'distances', 'indices'])
+
+
+class ExactKNN:
+    # Exact k-nearest-neighbour classifier over a fitted reference set.
+    # Gives the same answers as the KNeighborsClassifier it was built from,
+    # without sklearn's per-call validation and dispatch.
+    def __init__(self, fit_X, y, classes, n_neighbors=5, weights='uniform',
+                 leaf_size=30, batch_threshold=BATCH_THRESHOLD,
+                 tree_min_reference=TREE_MIN_REFERENCE, sq_norms=None, compact_X=None, tree_layout=None):
+        if weights not in ('uniform', 'distance'):
+            raise ValueError(f"Unsupported weights: {weights!r}")
+        if n_neighbors > len(fit_X):
+            raise ValueError(f"n_neighbors={n_neighbors} exceeds reference set size {len(fit_X)}")
+
+        self.fit_X = np.ascontiguousarray(fit_X, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.intp)
+        self.classes = np.asarray(classes)
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.leaf_size = leaf_size
+        self.batch_threshold = batch_threshold
+        self.tree_min_reference = tree_min_reference
+        self.block_size = max(1, BLOCK_ELEMENTS // len(self.fit_X))
+
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.fit_X, self.fit_X)
+        self.sq_norms = sq_norms
+        self.max_sq_norm = float(self.sq_norms.max())
+        self.compact_X = None
+        if compact_X is not None:
+            if compact_X.shape != self.fit_X.shape:
+                raise ValueError(f"compact_X has shape {compact_X.shape}, expected {self.fit_X.shape}")
+            self.compact_X = np.ascontiguousarray(compact_X, dtype=np.float32)
+            self.compact_sq_norms = np.einsum('ij,ij->i', self.compact_X, self.compact_X,
+                                              dtype=np.float64).astype(np.float32)
+        # Artifact version this engine was loaded from, if any
+        self.version = None
+        self.tree_rows = len(self.fit_X)
+        # (idx, nodes, bounds) of a KD-tree over fit_X[:len(idx)], restored
+        # instead of building a new one (see restore_tree)
+        self.tree_layout = tree_layout
+        if tree_layout is not None:
+            self.tree_rows = len(tree_layout[0])
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+    @classmethod
+    def from_model(cls, model, **kwargs):
+        if model.effective_metric_ != 'euclidean':
+            raise ValueError(f"Only euclidean KNN models are supported, got {model.effective_metric_!r}")
+        if model.outputs_2d_:
+            raise ValueError("Multi-output KNN models are not supported")
+        knn = cls(model._fit_X, model._y, model.classes_, n_neighbors=model.n_neighbors,
+                  weights=model.weights, leaf_size=model.leaf_size, **kwargs)
+        # The model's own tree: one rebuilt by another sklearn release can
+        # partition differently and return equidistant neighbours in another order
+        if getattr(model, '_tree', None) is not None:
+            knn._tree = model._tree
+        return knn
+
+    @classmethod
+    def from_artifact(cls, artifact, base=None, **kwargs):
+        # base: the engine serving the previous version. When this version
+        # only appended rows to it, its norms and KD-tree are reused.
+        params = artifact.knn_params
+        appended = artifact.manifest.get('metadata', {}).get('append', {})
+        if base is not None and base.version is not None and appended.get('base_version') == base.version:
+            knn = base.extended(artifact.fit_X, artifact.y)
+        else:
+            kwargs.setdefault('compact_X', artifact.compact_X)
+            kwargs.setdefault('tree_layout', artifact.tree_layout)
+            knn = cls(artifact.fit_X, artifact.y, artifact.classes, n_neighbors=params['n_neighbors'],
+                      weights=params['weights'], leaf_size=params['leaf_size'], **kwargs)
+        knn.version = artifact.version
+        return knn
+
+    def extended(self, fit_X, y):
+        # Engine over fit_X/y, whose first len(self.fit_X) rows are this
+        # engine's reference set: only the appended rows' norms are computed
+        n_base = len(self.fit_X)
+        fit_X = np.ascontiguousarray(fit_X, dtype=np.float64)
+        appended = fit_X[n_base:]
+        sq_norms = np.concatenate([self.sq_norms, np.einsum('ij,ij->i', appended, appended)])
+        compact_X = None
+        if self.compact_X is not None:
+            compact_X = np.concatenate([self.compact_X, compact_store(appended)])
+        knn = type(self)(fit_X, y, self.classes, n_neighbors=self.n_neighbors, weights=self.weights,
+                         leaf_size=self.leaf_size, batch_threshold=self.batch_threshold,
+                         tree_min_reference=self.tree_min_reference, sq_norms=sq_norms, compact_X=compact_X)
+        has_tree = self._tree is not None or self.tree_layout is not None
+        if has_tree and len(fit_X) - self.tree_rows <= TREE_REBUILD_FRACTION * self.tree_rows:
+            knn.tree_rows = self.tree_rows
+            knn.tree_layout = self.tree_layout
+            knn._tree = self._tree
+        return knn
+
+    def compacted(self):
+        # The same engine searching a float32 copy of its reference set
+        knn = type(self)(self.fit_X, self.y, self.classes, n_neighbors=self.n_neighbors, weights=self.weights,
+                         leaf_size=self.leaf_size, batch_threshold=self.batch_threshold,
+                         tree_min_reference=self.tree_min_reference, sq_norms=self.sq_norms,
+                         compact_X=compact_store(self.fit_X))
+        knn.version = self.version
+        knn.tree_rows = self.tree_rows
+        knn.tree_layout = self.tree_layout
+        knn._tree = self._tree
+        return knn
+
+    def saved_tree_layout(self):
+        # What an artifact needs to restore this engine's KD-tree, or None
+        # if it has not built or loaded one
+        if self._tree is not None:
+            _, idx, nodes, bounds = self._tree.get_arrays()
+            return np.asarray(idx, dtype=np.int64), np.asarray(nodes), np.asarray(bounds)
+        return self.tree_layout
+
+    @property
+    def tree(self):
+        # Built on first use: the BLAS path only needs it for near-ties, so
+        # most processes never pay for the build (or the sklearn import)
+        if self._tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    from sklearn.neighbors import KDTree
+
+                    # Built exactly as KNeighborsClassifier(algorithm='kd_tree')
+                    # builds it, so equidistant neighbours come back in the same order
+                    tree = KDTree(self.fit_X[:self.tree_rows], leaf_size=self.leaf_size)
+                    if self.tree_layout is not None:
+                        tree = restore_tree(tree, self.tree_layout)
+                    self._tree = tree
+        return self._tree
+
+    def tree_query(self, X, k):
+        dist, ind = self.tree.query(X, k=min(k, self.tree_rows))
+        if self.tree_rows == len(self.fit_X):
+            return dist, ind
+
+        # Rows appended after the tree was built: exact distances, merged in.
+        # On equal distances the older row comes first.
+        appended = self.fit_X[self.tree_rows:]
+        extra = np.empty((len(X), len(appended)))
+        step = max(1, BLOCK_ELEMENTS // (len(appended) * X.shape[1]))
+        for start in range(0, len(X), step):
+            diff = X[start:start + step, None, :] - appended[None, :, :]
+            extra[start:start + step] = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+        dist = np.hstack([dist, extra])
+        ind = np.hstack([ind, np.broadcast_to(np.arange(self.tree_rows, len(self.fit_X)), extra.shape)])
+        order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(dist, order, axis=1), np.take_along_axis(ind, order, axis=1)
+
+    # -------------------------
+    # Neighbour Search
+    # -------------------------
+    def kneighbors(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.use_tree(len(X)):
+            return self.tree_query(X, self.n_neighbors)
+        brute = self._brute_kneighbors if self.compact_X is None else self._compact_kneighbors
+        if len(X) <= self.block_size:
+            return brute(X)
+
+        dist = np.empty((len(X), self.n_neighbors))
+        ind = np.empty((len(X), self.n_neighbors), dtype=np.intp)
+        for start in range(0, len(X), self.block_size):
+            stop = start + self.block_size
+            dist[start:stop], ind[start:stop] = brute(X[start:stop])
+        return dist, ind
+
+    def use_tree(self, n_queries):
+        return n_queries < self.batch_threshold and len(self.fit_X) >= self.tree_min_reference
+
+    def _brute_kneighbors(self, X):
+        k = self.n_neighbors
+        n_queries = len(X)
+        x_sq = np.einsum('ij,ij->i', X, X)
+
+        sq_dist = X @ self.fit_X.T
+        sq_dist *= -2.0
+        sq_dist += x_sq[:, None]
+        sq_dist += self.sq_norms[None, :]
+
+        if k < len(self.fit_X):
+            candidates = np.argpartition(sq_dist, k, axis=1)[:, :k + 1]
+        else:
+            candidates = np.broadcast_to(np.arange(len(self.fit_X)), (n_queries, k)).copy()
+        rows = np.arange(n_queries)[:, None]
+        order = np.argsort(sq_dist[rows, candidates], axis=1, kind='stable')
+        candidates = candidates[rows, order]
+
+        ind = candidates[:, :k]
+        diff = X[:, None, :] - self.fit_X[ind]
+        dist = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+        # Near-equal distances anywhere among the candidates may be ordered
+        # differently by the tree: at the k-th place that changes the set,
+        # inside the top k it changes the order query() reports
+        gaps = np.diff(sq_dist[rows, candidates], axis=1)
+        slack = TIE_TOLERANCE * (x_sq + self.max_sq_norm + 1.0)
+        ambiguous = np.flatnonzero((gaps <= slack[:, None]).any(axis=1))
+        if len(ambiguous):
+            dist[ambiguous], ind[ambiguous] = self.tree_query(X[ambiguous], k)
+
+        return dist, ind
+
+    def _compact_kneighbors(self, X):
+        # Candidates from the float32 store; distances are then computed in
+        # float64 from fit_X, so they match _brute_kneighbors bit for bit
+        k = self.n_neighbors
+        n_queries = len(X)
+        if k >= len(self.fit_X):
+            return self._brute_kneighbors(X)
+        X32 = X.astype(np.float32)
+        x_sq = np.einsum('ij,ij->i', X32, X32)
+
+        sq_dist = X32 @ self.compact_X.T
+        sq_dist *= -2.0
+        sq_dist += x_sq[:, None]
+        sq_dist += self.compact_sq_norms[None, :]
+
+        candidates = np.argpartition(sq_dist, k, axis=1)[:, :k + 1]
+        rows = np.arange(n_queries)[:, None]
+        candidate_sq = sq_dist[rows, candidates]
+        order = np.argsort(candidate_sq, axis=1, kind='stable')
+        candidates = candidates[rows, order]
+        candidate_sq = candidate_sq[rows, order]
+
+        ind = candidates[:, :k]
+        diff = X[:, None, :] - self.fit_X[ind]
+        dist = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+        # Any two of the k+1 candidates within the error bound of each other
+        # could be in a different order (or set) in float64
+        error = COMPACT_ERROR * (X.shape[1] + 4) * (x_sq.astype(np.float64) + self.max_sq_norm + 1.0)
+        gaps = np.diff(candidate_sq.astype(np.float64), axis=1)
+        ambiguous = np.flatnonzero((gaps <= 2.0 * error[:, None]).any(axis=1))
+        if len(ambiguous):
+            dist[ambiguous], ind[ambiguous] = self._brute_kneighbors(X[ambiguous])
+        return dist, ind
+
+    # -------------------------
+    # Prediction
+    # -------------------------
+    def _votes(self, dist, ind):
+        if self.weights == 'uniform':
+            weights = np.ones(ind.shape)
+        else:
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / dist
+            exact = np.isinf(weights)
+            has_exact = exact.any(axis=1)
+            weights[has_exact] = exact[has_exact]
+
+        votes = np.zeros((len(ind), len(self.classes)))
+        np.add.at(votes, (np.arange(len(ind))[:, None], self.y[ind]), weights)
+        return votes
+
+    def predict(self, X):
+        votes = self._votes(*self.kneighbors(X))
+        # argmax keeps the first (smallest) class on ties, like sklearn's mode
+        return self.classes[np.argmax(votes, axis=1)]
+
+    def predict_proba(self, X):
+        votes = self._votes(*self.kneighbors(X))
+        return votes / votes.sum(axis=1, keepdims=True)
+
+    def query(self, X):
+        # predict, predict_proba and kneighbors from a single search
+        dist, ind = self.kneighbors(X)
+        votes = self._votes(dist, ind)
+        labels = self.classes[np.argmax(votes, axis=1)]
+        return QueryResult(labels, votes / votes.sum(axis=1, keepdims=True), dist, ind)
+
+
+def restore_tree(tree, layout):
+    # Equidistant neighbours come back in the order of the tree's row
+    # permutation, and another sklearn release can build a different one, so
+    # a saved layout (KDTree.get_arrays() minus the data) is swapped into
+    # tree, a KDTree freshly built on the same rows with the same leaf_size
+    state = list(tree.__getstate__())
+    idx, nodes, bounds = (np.array(array) for array in layout)
+    if (idx.shape, nodes.dtype, nodes.shape, bounds.shape) != (state[1].shape, state[2].dtype,
+                                                                 state[2].shape, state[3].shape):
+        # Laid out differently by this sklearn release: keep the new tree,
+        # which finds the same neighbours but may order exact ties differently
+        return tree
+    state[1:4] = [idx.astype(state[1].dtype), nodes, bounds]
+    tree.__setstate__(tuple(state))
+    return tree
+
+
+def compact_store(fit_X):
+    return np.ascontiguousarray(fit_X, dtype=np.float32)
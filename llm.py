@@ -0,0 +1,246 @@
+import os
+import time
+
+import llm_gateway
+import llm_guard
+import metrics
+from chat_context import ChatContext, count_tokens, fallback_summary, messages_tokens
+from response_cache import request_key
+
+MODEL_NAME = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
+
+CHAT_SYSTEM_MESSAGE = """You are HeartAlert, a professional and caring heart health AI assistant. 
+                    Provide evidence-based, supportive, and actionable health guidance. 
+                    Be empathetic but clear. Keep responses concise and well-formatted.
+                    If the user asks about specific symptoms or medical advice, 
+                    always remind them to consult a healthcare professional."""
+
+RECOMMENDATION_SYSTEM_MESSAGE = "You are HeartAlert AI. Provide clear, well-structured health recommendations. Use simple numbered sections without markdown symbols like asterisks or double asterisks. Write in plain text with clear formatting."
+
+SUMMARY_SYSTEM_MESSAGE = "You maintain a running summary of a conversation between a patient and HeartAlert, a heart health assistant. Update the summary with the new turns. Keep the patient's reported symptoms, health metrics, concerns and the advice already given. Write at most 150 words of plain text."
+
+CHAT_MAX_TOKENS = 500
+SUMMARY_MAX_TOKENS = 250
+RECOMMENDATION_MAX_TOKENS = 700
+TEMPERATURE = 0.7
+
+QUICK_QUESTIONS = [
+    "What are the warning signs of a heart attack?",
+    "How can I lower my cholesterol naturally?",
+    "What does high blood pressure mean?",
+    "How does this AI prediction work?",
+    "What lifestyle changes can improve heart health?",
+    "What do my test results mean?",
+    "When should I see a cardiologist?",
+    "How can I prevent heart disease?"
+]
+
+# Seconds before the summary call gives up and the local summary is used
+SUMMARY_TIMEOUT = 15
+
+# Markdown symbols removed from replies before they are shown or stored
+CHAT_STRIP_SYMBOLS = '*'
+RECOMMENDATION_STRIP_SYMBOLS = '*#'
+
+
+class StreamInterrupted(Exception):
+    # The stream ended without a finish_reason, e.g. a dropped connection
+    pass
+
+
+def create_together_client():
+    # The SDK's own retries are off: llm_guard retries within the call's
+    # deadline instead. Connections are pooled and kept alive between calls.
+    from together import Together
+    return Together(api_key=os.getenv("TOGETHER_API_KEY"), max_retries=0,
+                    http_client=llm_gateway.http_client(_gateway.concurrency))
+
+
+_gateway = llm_gateway.Gateway(create_together_client)
+
+
+def get_client():
+    # The process-wide gateway every session's requests go through; it
+    # creates the Together client on first use, so importing together (and
+    # its SSL setup) stays off the app's first paint. Safe to call from
+    # worker threads.
+    return _gateway
+
+
+class MarkdownStripper:
+    # Incremental equivalent of text.strip() followed by removing markdown
+    # symbols: leading whitespace is dropped and trailing whitespace is held
+    # back until more text arrives, so chunk boundaries don't matter.
+    def __init__(self, symbols):
+        self._table = str.maketrans('', '', symbols)
+        self._started = False
+        self._pending = ''
+
+    def feed(self, chunk):
+        if not self._started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return ''
+            self._started = True
+        text = self._pending + chunk
+        stripped = text.rstrip()
+        self._pending = text[len(stripped):]
+        return stripped.translate(self._table)
+
+
+def chat_messages(history, context=None):
+    # With a ChatContext the prompt is trimmed to its token budget
+    if context is not None:
+        return context.build(history)
+    return [{"role": "system", "content": CHAT_SYSTEM_MESSAGE}] + history
+
+
+def chat_request_key(messages):
+    params = {'temperature': TEMPERATURE, 'max_tokens': CHAT_MAX_TOKENS, 'strip': CHAT_STRIP_SYMBOLS}
+    return request_key(MODEL_NAME, messages, params)
+
+
+def summarize_turns(previous_summary, turns, client=None):
+    transcript = "\n".join(
+        f"{'Patient' if msg['role'] == 'user' else 'HeartAlert'}: {msg['content']}" for msg in turns
+    )
+    prompt = f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+    messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+    try:
+        with metrics.span("llm.summary"):
+            response = (client or get_client()).chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                timeout=SUMMARY_TIMEOUT
+            )
+        summary = response.choices[0].message.content.strip()
+    except Exception as e:
+        if metrics.enabled():
+            metrics.record_llm_call("summary", None, messages_tokens(messages), 0, type(e).__name__)
+        return fallback_summary(previous_summary, turns)
+    if metrics.enabled():
+        usage = getattr(response, 'usage', None)
+        metrics.record_llm_call("summary", None,
+                                usage.prompt_tokens if usage else messages_tokens(messages),
+                                usage.completion_tokens if usage else count_tokens(summary))
+    return summary
+
+
+def create_chat_context(budget=None, client=None):
+    kwargs = {} if budget is None else {'budget': budget}
+    return ChatContext(CHAT_SYSTEM_MESSAGE, lambda summary, turns: summarize_turns(summary, turns, client), **kwargs)
+
+
+def recommendation_messages(prompt):
+    return [
+        {"role": "system", "content": RECOMMENDATION_SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def stream_completion(messages, max_tokens, strip_symbols, client=None, call="completion", timeout=None,
+                      coalesce=True, cancellation=None):
+    # A generator, so the client is resolved (and any error raised) on the
+    # consumer's first next() call. timeout (seconds) bounds the HTTP request
+    # and the wait for a gateway slot. coalesce=False keeps the request from
+    # sharing an identical one already in flight. cancellation: an
+    # llm_guard.Cancellation that abandons the request from another thread.
+    start = time.perf_counter()
+    first_chunk = None
+    usage = None
+    finish_reason = None
+    received = []
+    outcome = "cancelled"
+    try:
+        client = client or get_client()
+        options = {} if timeout is None else {'timeout': timeout}
+        if isinstance(client, llm_gateway.Gateway):
+            options.update(coalesce=coalesce, cancellation=cancellation)
+        stream = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=max_tokens,
+            stream=True,
+            **options
+        )
+        if cancellation is not None:
+            cancellation.add(stream.close)
+        stripper = MarkdownStripper(strip_symbols)
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - start
+                    received.append(delta)
+                    text = stripper.feed(delta)
+                    if text:
+                        yield text
+        finally:
+            # Release the HTTP connection if the consumer stops early
+            stream.close()
+        if finish_reason is None:
+            raise StreamInterrupted("The reply stream ended early")
+        outcome = "ok"
+    except Exception as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        if metrics.enabled():
+            record_completion(call, messages, start, first_chunk, usage, received, outcome)
+
+
+def record_completion(call, messages, start, first_chunk, usage, received, outcome):
+    # Token counts come from the API's usage block when the stream has one,
+    # otherwise from the local estimate
+    if usage is not None and getattr(usage, 'prompt_tokens', None) is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens or 0
+    else:
+        prompt_tokens, completion_tokens = messages_tokens(messages), count_tokens(''.join(received))
+    metrics.record_stage(f"llm.{call}", time.perf_counter() - start,
+                         error=None if outcome in ("ok", "cancelled") else outcome)
+    metrics.record_llm_call(call, first_chunk, prompt_tokens, completion_tokens, outcome)
+
+
+def stream_chat_reply(messages, client=None):
+    return stream_completion(messages, CHAT_MAX_TOKENS, CHAT_STRIP_SYMBOLS, client, call="chat")
+
+
+def stream_recommendations(prompt, client=None):
+    return stream_completion(recommendation_messages(prompt), RECOMMENDATION_MAX_TOKENS,
+                             RECOMMENDATION_STRIP_SYMBOLS, client, call="recommendations")
+
+
+# -------------------------
+# Guarded Calls
+# -------------------------
+# Retries and hedges never share an identical request in flight: that is
+# the request they are meant to replace
+def guarded_chat_reply(messages, client=None, policy=None):
+    # Never raises: a chat reply within the deadline, else a local notice
+    return llm_guard.GuardedStream(
+        lambda timeout, retry, cancellation: stream_completion(messages, CHAT_MAX_TOKENS, CHAT_STRIP_SYMBOLS,
+                                                               client, call="chat", timeout=timeout,
+                                                               coalesce=not retry, cancellation=cancellation),
+        llm_guard.local_chat_reply, policy, call="chat")
+
+
+def guarded_recommendations(prompt, user_data, prediction, client=None, policy=None):
+    # Never raises: LLM recommendations within the deadline, else ones built
+    # locally from the form values and the prediction
+    return llm_guard.GuardedStream(
+        lambda timeout, retry, cancellation: stream_completion(recommendation_messages(prompt),
+                                                               RECOMMENDATION_MAX_TOKENS, RECOMMENDATION_STRIP_SYMBOLS,
+                                                               client, call="recommendations", timeout=timeout,
+                                                               coalesce=not retry, cancellation=cancellation),
+        lambda: llm_guard.local_recommendations(user_data, prediction), policy, call="recommendations")
@@ -0,0 +1,387 @@
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from chat_context import messages_tokens
+from response_cache import request_key
+
+# One gateway per process carries every chat completion request. Identical
+# requests in flight at the same time share one upstream call, at most
+# `concurrency` upstream calls run at once, and an optional per-minute token
+# budget (prompt estimate + max_tokens) is enforced. Requests that have to
+# wait are admitted first come, first served, so a burst queues instead of
+# turning into rate-limit errors.
+#
+# HEARTALERT_LLM_CONCURRENCY: upstream calls in flight at once (default 8)
+# HEARTALERT_LLM_TOKENS_PER_MINUTE: token budget per minute (default 0, unlimited)
+DEFAULT_CONCURRENCY = int(os.getenv("HEARTALERT_LLM_CONCURRENCY", "8"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("HEARTALERT_LLM_TOKENS_PER_MINUTE", "0"))
+# Longest wait for a slot when the request has no timeout of its own
+DEFAULT_QUEUE_TIMEOUT = 30.0
+# Idle pooled connections are kept this long; httpx drops them after 5s,
+# so a quiet app would otherwise reconnect (and redo TLS) on most requests
+KEEPALIVE_EXPIRY = 60.0
+WAIT_WINDOW = 1000
+POOL_HEADROOM = 2
+# Last event of a streamed completion
+STREAM_END = b'data: [DONE]'
+
+
+class GatewayBusy(TimeoutError):
+    # The request waited longer than its timeout for a slot
+    pass
+
+
+class GatewayCancelled(Exception):
+    # The request was abandoned (see Gateway.create) before it got a response
+    pass
+
+
+def http_client(concurrency=DEFAULT_CONCURRENCY):
+    # Connection pool for the Together client: one kept-alive connection per
+    # gateway slot, reused from request to request
+    import httpx
+    from together import DefaultHttpxClient
+
+    # A request abandoned while waiting for response headers frees its slot
+    # at once but keeps its connection until the server answers or the HTTP
+    # timeout ends it, so the pool has room beyond the slots
+    limits = httpx.Limits(max_connections=concurrency * POOL_HEADROOM, max_keepalive_connections=concurrency,
+                          keepalive_expiry=KEEPALIVE_EXPIRY)
+    return DefaultHttpxClient(transport=_reusing_transport(limits))
+
+
+def _reusing_transport(limits):
+    # The SDK stops reading a stream at its [DONE] event and closes the
+    # response before the end of the chunked body has been read, so httpx
+    # can't tell the connection is clean and drops it. This transport reads
+    # that last bit on close, once [DONE] has gone by, and the connection
+    # goes back to the pool. A stream closed before [DONE] (abandoned, or
+    # compressed so the marker isn't visible) is closed as before.
+    import httpx
+
+    class DrainingStream(httpx.SyncByteStream):
+        def __init__(self, stream):
+            self.stream = stream
+            self.chunks = iter(stream)
+            self.tail = b''
+            self.finished = False
+
+        def __iter__(self):
+            for chunk in self.chunks:
+                self.finished = self.finished or STREAM_END in self.tail + chunk
+                self.tail = chunk[-len(STREAM_END):]
+                yield chunk
+
+        def close(self):
+            try:
+                if self.finished:
+                    for _ in self.chunks:
+                        pass
+            finally:
+                self.stream.close()
+
+    class ReusingTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            response = super().handle_request(request)
+            if not response.headers.get('content-type', '').startswith('text/event-stream'):
+                return response
+            return httpx.Response(response.status_code, headers=response.headers,
+                                  stream=DrainingStream(response.stream), extensions=response.extensions)
+
+    return ReusingTransport(limits=limits)
+
+
+class _Flight:
+    # One upstream call and every request sharing it. Streamed chunks are
+    # kept, so a request that joins late replays them from the start, and
+    # whichever consumer needs the next chunk reads it from upstream.
+    def __init__(self, key, stream):
+        self.key = key
+        self.stream = stream
+        self.ready = threading.Event()
+        self.upstream = None
+        self.iterator = None
+        self.error = None
+        self.chunks = []
+        self.done = False
+        self.consumers = 1
+        # Whether the flight holds one of the gateway's slots
+        self.holding = False
+        self.read_lock = threading.Lock()
+
+
+class FlightStream:
+    # One consumer of a flight, and what create(stream=True) returns:
+    # iterates the shared call's chunks and, like the SDK's stream, has
+    # close(). Closing is idempotent and safe from any thread.
+    def __init__(self, gateway, flight):
+        self.gateway = gateway
+        self.flight = flight
+        self.position = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        flight = self.flight
+        while True:
+            if self.closed:
+                raise GatewayCancelled("The stream was closed")
+            if self.position < len(flight.chunks):
+                self.position += 1
+                return flight.chunks[self.position - 1]
+            if flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                raise StopIteration
+            with flight.read_lock:
+                if self.position < len(flight.chunks) or flight.done:
+                    continue
+                try:
+                    flight.chunks.append(next(flight.iterator))
+                except StopIteration:
+                    self.gateway._finish(flight)
+                except Exception as e:
+                    self.gateway._finish(flight, e)
+                    raise
+
+    def close(self):
+        with self.gateway._cond:
+            if self.closed:
+                return
+            self.closed = True
+        self.gateway._leave(self.flight)
+
+
+def _close(upstream):
+    if hasattr(upstream, 'close'):
+        try:
+            upstream.close()
+        except Exception:
+            pass
+
+
+class Gateway:
+    # Exposes chat.completions.create like the SDK client it wraps, so it can
+    # be passed wherever a client is expected. `coalesce=False` makes a
+    # request that must not share a call, e.g. a retry of a stalled one.
+    # `cancellation` (see llm_guard.Cancellation) abandons a request from
+    # another thread: it leaves the queue, or frees its slot and closes its
+    # upstream stream unless another request is still sharing it.
+    def __init__(self, client_factory, concurrency=DEFAULT_CONCURRENCY,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self.chat = self.completions = self
+        self.sent = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._client = None
+        self._flights = {}
+        self._queue = deque()
+        self._active = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self._cond = threading.Condition()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._cond:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    def create(self, coalesce=True, cancellation=None, **params):
+        timeout = params.get('timeout')
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        key = request_key(params.get('model'), params.get('messages'),
+                          {name: value for name, value in params.items()
+                           if name not in ('model', 'messages', 'timeout')})
+        stream = bool(params.get('stream'))
+
+        with self._cond:
+            flight = self._flights.get(key) if coalesce else None
+            if flight is not None and not flight.done:
+                flight.consumers += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = _Flight(key, stream)
+                if coalesce:
+                    self._flights[key] = flight
+                leader = True
+        if not leader and metrics.enabled():
+            metrics.record_llm_gateway("coalesced")
+        consumer = FlightStream(self, flight)
+        if cancellation is not None:
+            cancellation.add(consumer.close)
+
+        if leader:
+            self._open(flight, params, deadline)
+        elif not flight.ready.wait(max(0.0, deadline - time.monotonic())):
+            consumer.close()
+            raise GatewayBusy("Timed out waiting for an identical request in flight")
+        if consumer.closed:
+            raise GatewayCancelled("The request was abandoned")
+        if flight.error is not None and not flight.chunks:
+            consumer.close()
+            raise flight.error
+        if stream:
+            return consumer
+        consumer.close()
+        return flight.upstream
+
+    def _open(self, flight, params, deadline):
+        try:
+            self._acquire(flight, self.cost(params), deadline)
+        except GatewayBusy as e:
+            self._finish(flight, e)
+            return
+        if flight.done:
+            return
+        try:
+            upstream = self.client.chat.completions.create(**params)
+        except Exception as e:
+            self._finish(flight, e)
+            return
+        with self._cond:
+            flight.upstream = upstream
+            abandoned = flight.done
+        if abandoned:
+            # Every consumer left while the request was being sent
+            _close(upstream)
+            return
+        if flight.stream:
+            # The slot is released when the stream ends or its last consumer closes it
+            flight.iterator = iter(flight.upstream)
+            flight.ready.set()
+        else:
+            self._finish(flight)
+
+    def cost(self, params):
+        # Tokens a request may use: the prompt estimate plus its completion cap
+        return messages_tokens(params.get('messages') or []) + (params.get('max_tokens') or 0)
+
+    # -------------------------
+    # Admission
+    # -------------------------
+    def _acquire(self, flight, cost, deadline):
+        # First come, first served: only the head of the queue is admitted,
+        # once a slot is free and the token budget covers its cost. The
+        # flight holds the slot from then on, unless it was abandoned while
+        # queued.
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._queue.append(ticket)
+            self._publish()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if flight.done:
+                        outcome = "cancelled"
+                        break
+                    if self._queue[0] is ticket and self._active < self.concurrency:
+                        wait = self._token_wait(cost, now)
+                        if wait == 0.0:
+                            self._active += 1
+                            flight.holding = True
+                            self.sent += 1
+                            outcome = "sent"
+                            break
+                    if now >= deadline:
+                        self.rejected += 1
+                        outcome = "rejected"
+                        break
+                    self._cond.wait(min(deadline - now, wait) if wait else deadline - now)
+                waited = now - start
+                self._waits.append(waited)
+            finally:
+                self._queue.remove(ticket)
+                self._publish()
+                self._cond.notify_all()
+        if metrics.enabled() and outcome != "cancelled":
+            metrics.record_llm_gateway(outcome, waited)
+        if outcome == "rejected":
+            raise GatewayBusy(f"No LLM slot free within {waited:.1f}s")
+
+    def _token_wait(self, cost, now):
+        # Seconds until the budget covers `cost`; takes it and returns 0 if it
+        # already does. A request larger than a minute's budget waits for a
+        # full bucket rather than forever.
+        if not self.tokens_per_minute:
+            return 0.0
+        rate = self.tokens_per_minute / 60.0
+        self._tokens = min(float(self.tokens_per_minute), self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        cost = min(cost, self.tokens_per_minute)
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return 0.0
+        return (cost - self._tokens) / rate
+
+    def _finish(self, flight, error=None):
+        # The upstream call is over (or abandoned): its slot is free and
+        # later identical requests start a new one
+        with self._cond:
+            if flight.done:
+                return
+            flight.done = True
+            flight.error = error
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.holding:
+                flight.holding = False
+                self._active -= 1
+                self._publish()
+            # Also wakes a leader still queued for the slot
+            self._cond.notify_all()
+        flight.ready.set()
+
+    def _leave(self, flight):
+        # A consumer is done with the flight; when the last one leaves a call
+        # that hasn't finished, it is abandoned: queued, its request is
+        # withdrawn; in flight, its slot is freed at once and its stream
+        # closed. This may run on another thread while a consumer is blocked
+        # reading the stream; that read then fails instead of waiting out
+        # the reply.
+        with self._cond:
+            flight.consumers -= 1
+            if flight.consumers > 0 or flight.done:
+                return
+            upstream = flight.upstream
+            self._finish(flight, GatewayCancelled("The request was abandoned"))
+        if upstream is not None:
+            _close(upstream)
+
+    def _publish(self):
+        if metrics.enabled():
+            metrics.set_llm_gateway_load(len(self._queue), self._active)
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            stats = {
+                'queued': len(self._queue),
+                'in_flight': self._active,
+                'concurrency': self.concurrency,
+                'tokens_per_minute': self.tokens_per_minute,
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+            }
+        for pct in (50, 95):
+            stats[f'wait_p{pct}_ms'] = waits[min(len(waits) - 1, len(waits) * pct // 100)] * 1e3 if waits else 0.0
+        stats['wait_max_ms'] = waits[-1] * 1e3 if waits else 0.0
+        return stats
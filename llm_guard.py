@@ -0,0 +1,406 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Deadline-aware wrapper for streamed LLM calls. Each attempt gets its own
+# timeout, failed attempts are retried with jittered backoff while the
+# budget allows, and a slow attempt can be hedged with a duplicate request
+# once it is slower than a percentile of recent calls. When no attempt has
+# produced text by the deadline, the caller's local fallback is streamed
+# instead, so the user always gets an answer within the budget.
+#
+# HEARTALERT_LLM_BUDGET: seconds to the first token, retries included (default 20)
+# HEARTALERT_LLM_HEDGE_PERCENTILE: e.g. "95" to hedge attempts slower than
+# the p95 time to first token (default: off)
+DEFAULT_BUDGET = float(os.getenv("HEARTALERT_LLM_BUDGET", "20"))
+DEFAULT_HEDGE_PERCENTILE = float(os.getenv("HEARTALERT_LLM_HEDGE_PERCENTILE") or 0) or None
+DEFAULT_ATTEMPT_TIMEOUT = 8.0
+DEFAULT_STALL_TIMEOUT = 10.0
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 2.0
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_CHUNK, _DONE, _ERROR = "chunk", "done", "error"
+
+
+class GuardPolicy:
+    def __init__(self, budget=DEFAULT_BUDGET, attempt_timeout=DEFAULT_ATTEMPT_TIMEOUT,
+                 stall_timeout=DEFAULT_STALL_TIMEOUT, retries=DEFAULT_RETRIES,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE, hedge_min_samples=HEDGE_MIN_SAMPLES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, seed=None):
+        self.budget = budget
+        self.attempt_timeout = attempt_timeout
+        self.stall_timeout = stall_timeout
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.random = random.Random(seed)
+
+    def backoff(self, failures):
+        # Full jitter: uniform in [0, base * 2^(failures-1)], capped
+        return self.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (failures - 1)))
+
+
+class LatencyTracker:
+    # Rolling window of successful times to first token, for hedging
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def tracker(call):
+    with _trackers_lock:
+        return _trackers.setdefault(call, LatencyTracker())
+
+
+class Cancellation:
+    # Passed to open_stream so whatever holds resources for the request (the
+    # LLM gateway's slot, the response stream) can register how to let go of
+    # them; callbacks added after cancel() run at once.
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add(self, callback):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        _quietly(callback)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            _quietly(callback)
+
+
+def _quietly(callback):
+    # Runs on the cancelling thread; the attempt's own thread then fails,
+    # which is ignored since the attempt is no longer live
+    try:
+        callback()
+    except Exception:
+        pass
+
+
+class _Attempt:
+    # One request, pumped on a daemon thread into the shared event queue.
+    # open_stream(timeout, retry, cancellation) opens it; retry is true for
+    # every attempt after the first, including hedges. Cancelling fires the
+    # Cancellation, so an abandoned request gives up its gateway slot and
+    # closes its stream right away instead of when its HTTP timeout runs out.
+    def __init__(self, number, open_stream, timeout, first_timeout, events):
+        self.number = number
+        self.started = time.monotonic()
+        self.first_deadline = self.started + first_timeout
+        self.cancellation = Cancellation()
+        threading.Thread(target=self._run, args=(open_stream, timeout, events),
+                         name=f"llm-attempt-{number}", daemon=True).start()
+
+    def _run(self, open_stream, timeout, events):
+        try:
+            stream = open_stream(timeout, self.number > 1, self.cancellation)
+            try:
+                for text in stream:
+                    if self.cancellation.cancelled:
+                        return
+                    events.put((self, _CHUNK, text))
+            finally:
+                if hasattr(stream, 'close'):
+                    stream.close()
+            events.put((self, _DONE, None))
+        except Exception as e:
+            events.put((self, _ERROR, e))
+
+    def cancel(self):
+        self.cancellation.cancel()
+
+
+class GuardedStream:
+    # Iterator of text chunks. After iteration, `outcome` is "llm",
+    # "fallback" (nothing usable arrived in time) or "partial" (the stream
+    # broke off and the fallback was appended), and `attempts`/`hedged`
+    # say how many requests it took.
+    def __init__(self, open_stream, fallback, policy=None, latency=None, call="completion"):
+        self.open_stream = open_stream
+        self.fallback = fallback
+        self.policy = policy or GuardPolicy()
+        self.latency = latency if latency is not None else tracker(call)
+        self.call = call
+        self.outcome = None
+        self.attempts = 0
+        self.hedged = False
+        self.errors = []
+        self._gen = self._run()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._gen)
+
+    def close(self):
+        self._gen.close()
+
+    def _launch(self, events):
+        self.attempts += 1
+        # The HTTP timeout also bounds the gaps between chunks once streaming
+        timeout = max(self.policy.attempt_timeout, self.policy.stall_timeout)
+        return _Attempt(self.attempts, self.open_stream, timeout, self.policy.attempt_timeout, events)
+
+    def _first_chunk(self, events, deadline):
+        # Returns (attempt, first text) or None once the budget is spent
+        policy = self.policy
+        live = [self._launch(events)]
+        failures = 0
+        retry_at = None
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    return None
+                if retry_at is not None and now >= retry_at:
+                    live.append(self._launch(events))
+                    retry_at = None
+
+                for attempt in [a for a in live if now >= a.first_deadline]:
+                    attempt.cancel()
+                    live.remove(attempt)
+                    failures += 1
+                    self.errors.append(f"attempt {attempt.number}: no response in {policy.attempt_timeout:g}s")
+
+                hedge_at = None
+                if policy.hedge_percentile and len(live) == 1 and not self.hedged:
+                    threshold = self.latency.percentile(policy.hedge_percentile, policy.hedge_min_samples)
+                    if threshold is not None:
+                        hedge_at = live[0].started + threshold
+                        if now >= hedge_at:
+                            live.append(self._launch(events))
+                            self.hedged = True
+                            hedge_at = None
+
+                if not live and retry_at is None:
+                    if failures > policy.retries:
+                        return None
+                    retry_at = now + policy.backoff(failures)
+                    continue
+
+                wake = min([deadline] + [a.first_deadline for a in live] +
+                           [t for t in (hedge_at, retry_at) if t is not None])
+                try:
+                    attempt, kind, payload = events.get(timeout=max(0.0, wake - now))
+                except queue.Empty:
+                    continue
+                if attempt not in live:
+                    continue
+                if kind == _CHUNK:
+                    self.latency.observe(time.monotonic() - attempt.started)
+                    live.remove(attempt)
+                    return attempt, payload
+                live.remove(attempt)
+                failures += 1
+                self.errors.append(f"attempt {attempt.number}: "
+                                   f"{'empty reply' if kind == _DONE else type(payload).__name__}")
+        finally:
+            for attempt in live:
+                attempt.cancel()
+
+    def _run(self):
+        policy = self.policy
+        events = queue.Queue()
+        first = self._first_chunk(events, time.monotonic() + policy.budget)
+        if first is None:
+            self.outcome = "fallback"
+            self._record()
+            yield self.fallback()
+            return
+
+        winner, text = first
+        self.outcome = "llm"
+        try:
+            yield text
+            while True:
+                try:
+                    attempt, kind, payload = events.get(timeout=policy.stall_timeout)
+                except queue.Empty:
+                    self.errors.append(f"attempt {winner.number}: stalled for {policy.stall_timeout:g}s")
+                    break
+                if attempt is not winner:
+                    continue
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    self.errors.append(f"attempt {winner.number}: {type(payload).__name__}")
+                    break
+                yield payload
+            # The reply broke off: finish with the local answer rather than an error
+            self.outcome = "partial"
+            yield "\n\n" + self.fallback()
+        finally:
+            winner.cancel()
+            self._record()
+
+    def _record(self):
+        metrics.record_llm_guard(self.call, self.outcome or "cancelled", self.attempts, self.hedged)
+
+
+# -------------------------
+# Local Fallbacks
+# -------------------------
+FALLBACK_NOTE = ("Note: the HeartAlert assistant could not be reached just now, so these recommendations "
+                 "were prepared directly from your results. Please review them with a healthcare professional.")
+
+CHAT_FALLBACK_REPLY = (
+    "I'm sorry, I can't reach the HeartAlert assistant right now. Please try your question again in a "
+    "moment. If you have chest pain that lasts more than a few minutes, spreads to your arm, jaw or back, "
+    "or comes with shortness of breath, sweating or fainting, call emergency services immediately."
+)
+
+EMERGENCY_SIGNS = ("Call emergency services right away if you have chest pain or pressure lasting more than "
+                   "a few minutes, pain spreading to your arm, jaw or back, shortness of breath, cold sweats "
+                   "or fainting.")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def local_recommendations(user_data, prediction):
+    # Deterministic plain-text recommendations in the same five sections the
+    # LLM is asked for, driven by the form values stored in user_data
+    high = prediction == 1
+    age = _number(user_data.get('Age'))
+    bp = _number(user_data.get('RestingBP'))
+    chol = _number(user_data.get('Cholesterol'))
+    max_hr = _number(user_data.get('MaxHR'))
+    oldpeak = _number(user_data.get('oldpeak'))
+    fasting_bs = _number(user_data.get('fasting_bs')) == 1
+    angina = user_data.get('exercise_angina') in ('Yes', 'Y')
+    symptoms = (user_data.get('symptoms') or '').strip()
+
+    immediate = []
+    if high:
+        immediate.append("Book an appointment with a cardiologist within the next few days and bring this report.")
+        if angina or user_data.get('chest_pain') == 'TA':
+            immediate.append("Your chest pain pattern needs prompt medical review; avoid strenuous effort until then.")
+        immediate.append(EMERGENCY_SIGNS)
+    else:
+        immediate.append("Keep up regular check-ups so changes in blood pressure, cholesterol and blood sugar "
+                         "are caught early.")
+        if symptoms:
+            immediate.append("Mention the symptoms you reported to your doctor at your next visit.")
+        immediate.append("Know the warning signs: " + EMERGENCY_SIGNS[0].lower() + EMERGENCY_SIGNS[1:])
+
+    diet = []
+    if not chol:
+        diet.append("Your cholesterol was not recorded; ask your doctor for a lipid panel.")
+    elif chol >= 240:
+        diet.append(f"Your cholesterol of {chol:g} mg/dL is high (240 or above). Cut saturated fat from red meat, "
+                    "butter and fried food, and add soluble fibre such as oats, beans and lentils.")
+    elif chol >= 200:
+        diet.append(f"Your cholesterol of {chol:g} mg/dL is borderline high (200-239). Favour fish, nuts, olive oil "
+                    "and whole grains over fatty meat and full-fat dairy.")
+    else:
+        diet.append(f"Your cholesterol of {chol:g} mg/dL is in the desirable range; keep eating plenty of "
+                    "vegetables, fruit, whole grains and fish.")
+    if bp and bp >= 130:
+        diet.append(f"With a resting blood pressure of {bp:g} mm Hg, keep salt under 1,500 mg a day and choose "
+                    "fresh over processed and restaurant food.")
+    if fasting_bs:
+        diet.append("Your fasting blood sugar is above 120 mg/dL: limit sugary drinks, sweets and refined "
+                    "carbohydrates.")
+    diet.append("Limit alcohol to no more than one drink a day.")
+
+    exercise = []
+    if high or angina:
+        exercise.append("Check with your doctor before starting any new vigorous exercise; gentle walking is "
+                        "usually a safe start.")
+    else:
+        exercise.append("Aim for at least 150 minutes of moderate activity, such as brisk walking or cycling, "
+                        "each week.")
+    if age:
+        predicted = 220 - age
+        exercise.append(f"Moderate intensity for your age means a heart rate of about "
+                        f"{predicted * 0.5:.0f}-{predicted * 0.7:.0f} bpm.")
+        if max_hr and max_hr < 0.6 * predicted:
+            exercise.append(f"Your maximum heart rate of {max_hr:g} bpm is low for your age "
+                            f"(about {predicted:.0f} bpm is typical); build up gradually.")
+    if angina:
+        exercise.append("Stop and rest if you feel chest pain during exercise, and tell your doctor.")
+
+    lifestyle = [
+        "If you smoke, stopping is the single biggest step you can take for your heart.",
+        "Sleep 7-9 hours a night and make time for stress relief such as walking, breathing exercises or hobbies.",
+    ]
+    if bp and bp >= 130:
+        lifestyle.append("Check your blood pressure at home a few times a week and keep a record.")
+    lifestyle.append("Keep a healthy weight; losing even a few kilograms lowers blood pressure and cholesterol.")
+
+    findings = []
+    if oldpeak is not None and oldpeak >= 2:
+        findings.append(f"ST depression (Oldpeak) of {oldpeak:g}")
+    if user_data.get('st_slope') in ('Flat', 'Down'):
+        findings.append(f"a {user_data['st_slope'].lower()} ST slope")
+    if user_data.get('resting_ecg') in ('ST', 'LVH'):
+        findings.append(f"a resting ECG showing {user_data['resting_ecg']}")
+    if user_data.get('chest_pain') == 'ASY':
+        findings.append("an asymptomatic (ASY) chest pain type")
+    if fasting_bs:
+        findings.append("raised fasting blood sugar")
+    follow_up = []
+    if findings:
+        follow_up.append("Ask your doctor to review " + ", ".join(findings) + ".")
+    if high:
+        follow_up.append("Expect tests such as an ECG, stress test or echocardiogram; bring this report with you.")
+    else:
+        follow_up.append("Have your blood pressure checked at least once a year and cholesterol every few years, "
+                         "more often after 40.")
+    if symptoms:
+        follow_up.append(f"Symptoms to mention: {symptoms}")
+
+    sections = [
+        ("Immediate Actions" if high else "Preventive Measures", immediate),
+        ("Dietary Recommendations", diet),
+        ("Exercise Guidelines", exercise),
+        ("Lifestyle Modifications", lifestyle),
+        ("Medical Follow-up", follow_up),
+    ]
+    text = "\n\n".join(f"{number}. {title}\n" + "\n".join(f"- {line}" for line in lines)
+                       for number, (title, lines) in enumerate(sections, 1))
+    return f"{text}\n\n{FALLBACK_NOTE}"
+
+
+def local_chat_reply():
+    return CHAT_FALLBACK_REPLY
@@ -0,0 +1,276 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+# HEARTALERT_METRICS: "off" (default), "on" to aggregate histograms in
+# process, "log" to also write one JSON log line per span. Disabled spans are
+# a shared no-op, so instrumented code costs one function call.
+MODE = os.getenv("HEARTALERT_METRICS", "off").lower()
+PORT = os.getenv("HEARTALERT_METRICS_PORT")
+PREFIX = "heartalert_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans range from microsecond encodes to minute-long LLM streams
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    'stage_seconds': "Time spent in each pipeline stage",
+    'stage_errors_total': "Stage failures by exception class",
+    'llm_first_chunk_seconds': "Time from request to the first streamed chunk",
+    'llm_tokens_total': "LLM tokens by call and kind (prompt/completion)",
+    'llm_requests_total': "LLM calls by outcome",
+    'llm_guarded_total': "Guarded LLM calls by outcome (llm, partial, fallback)",
+    'llm_attempts_total': "Requests made by guarded LLM calls, retries and hedges included",
+    'llm_hedged_total': "Guarded LLM calls that sent a hedged duplicate request",
+    'llm_gateway_requests_total': "LLM gateway requests by outcome (sent, coalesced, rejected)",
+    'llm_queue_wait_seconds': "Time LLM requests waited in the gateway queue",
+    'llm_queue_depth': "LLM requests waiting for a gateway slot",
+    'llm_in_flight': "Upstream LLM calls in flight",
+}
+
+logger = logging.getLogger("heartalert.metrics")
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def render_prometheus(self):
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum!r}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            describe(name, "gauge")
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def enabled():
+    return MODE in ("on", "log")
+
+
+def configure(mode):
+    # For tools and tests that switch metrics on at runtime
+    global MODE
+    MODE = mode.lower()
+    _setup_logging()
+
+
+def _setup_logging():
+    if MODE == "log" and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+_setup_logging()
+
+
+# -------------------------
+# Recording
+# -------------------------
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.stage, time.perf_counter() - self.start,
+                     error=exc_type.__name__ if exc_type is not None else None, **self.labels)
+        return False
+
+
+def span(stage, **labels):
+    # with metrics.span("predict"): ...
+    if not enabled():
+        return _NOOP
+    return Span(stage, labels)
+
+
+def record_stage(stage, seconds, error=None, **labels):
+    if not enabled():
+        return
+    registry.observe('stage_seconds', seconds, {'stage': stage, **labels})
+    if error is not None:
+        registry.inc('stage_errors_total', 1, {'stage': stage, 'error': error, **labels})
+    if MODE == "log":
+        entry = {'stage': stage, 'seconds': round(seconds, 6), **labels}
+        if error is not None:
+            entry['error'] = error
+        logger.info(json.dumps(entry))
+
+
+def record_llm_call(call, first_chunk_seconds, prompt_tokens, completion_tokens, outcome="ok"):
+    # outcome: "ok", "cancelled" (consumer stopped early) or the exception class
+    if not enabled():
+        return
+    if first_chunk_seconds is not None:
+        registry.observe('llm_first_chunk_seconds', first_chunk_seconds, {'call': call})
+    registry.inc('llm_tokens_total', prompt_tokens, {'call': call, 'kind': 'prompt'})
+    registry.inc('llm_tokens_total', completion_tokens, {'call': call, 'kind': 'completion'})
+    registry.inc('llm_requests_total', 1, {'call': call, 'outcome': outcome})
+    if MODE == "log":
+        logger.info(json.dumps({'llm_call': call, 'first_chunk_seconds': first_chunk_seconds,
+                                'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                                'outcome': outcome}))
+
+
+def record_llm_guard(call, outcome, attempts, hedged):
+    # One guarded call: how it was answered and how many requests it took
+    if not enabled():
+        return
+    registry.inc('llm_guarded_total', 1, {'call': call, 'outcome': outcome})
+    registry.inc('llm_attempts_total', attempts, {'call': call})
+    if hedged:
+        registry.inc('llm_hedged_total', 1, {'call': call})
+    if MODE == "log":
+        logger.info(json.dumps({'llm_guard': call, 'outcome': outcome, 'attempts': attempts, 'hedged': hedged}))
+
+
+def record_llm_gateway(outcome, wait_seconds=None):
+    # outcome: "sent", "coalesced" (shared an identical call in flight) or
+    # "rejected" (no slot within the request's timeout)
+    if not enabled():
+        return
+    registry.inc('llm_gateway_requests_total', 1, {'outcome': outcome})
+    if wait_seconds is not None:
+        registry.observe('llm_queue_wait_seconds', wait_seconds, {})
+    if MODE == "log":
+        logger.info(json.dumps({'llm_gateway': outcome, 'wait_seconds': wait_seconds}))
+
+
+def set_llm_gateway_load(queued, in_flight):
+    if not enabled():
+        return
+    registry.set('llm_queue_depth', queued, {})
+    registry.set('llm_in_flight', in_flight, {})
+
+
+def render_prometheus():
+    return registry.render_prometheus()
+
+
+# -------------------------
+# Exposition
+# -------------------------
+def start_http_server(port, host="0.0.0.0"):
+    # Serves /metrics for Prometheus on a daemon thread. http.server is
+    # imported here so importing this module stays cheap.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            payload = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="heartalert-metrics", daemon=True).start()
+    return server
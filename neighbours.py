@@ -0,0 +1,110 @@
+import numpy as np
+
+from pipeline import CATEGORY_VALUES, FEATURE_COLUMNS, LABEL_COLUMN, NUMERIC_COLUMNS
+
+DATA_PATH = "heart.csv"
+
+
+class ReferenceRows:
+    # Describes KNN reference rows as patients in heart.csv schema. Rows
+    # that came from heart.csv are traced back to their row there (the
+    # training split train.py reproduces), so the original values are shown;
+    # other rows (appended or prototypes) are decoded from the scaled matrix.
+    def __init__(self, knn, encoder, data_path=DATA_PATH):
+        self.knn = knn
+        self.encoder = encoder
+        self.records = None
+        self.row_ids = np.full(len(knn.fit_X), -1)
+        if data_path is not None:
+            self._trace(data_path)
+
+    def _trace(self, data_path):
+        import pandas as pd
+
+        from train import prepare_dataset, split_dataset
+
+        try:
+            df = pd.read_csv(data_path)
+        except FileNotFoundError:
+            return
+        X, y = prepare_dataset(df)
+        X_train, _, _, _ = split_dataset(X, y)
+        scaled = self.encoder.scale_rows(X_train.reindex(columns=self.encoder.columns, fill_value=0)
+                                         .to_numpy(dtype=np.float64))
+        train_rows = X_train.index.to_numpy()
+
+        # The reference set starts with the training split, in split order...
+        fit_X = self.knn.fit_X
+        n = min(len(scaled), len(fit_X))
+        same = (fit_X[:n] == scaled[:n]).all(axis=1)
+        self.row_ids[:n][same] = train_rows[:n][same]
+        # ...unless prototypes.py kept only some of its rows: match those by value
+        missing = np.flatnonzero(self.row_ids < 0)
+        if len(missing):
+            lookup = {}
+            for pos in range(len(scaled)):
+                lookup.setdefault(scaled[pos].tobytes(), train_rows[pos])
+            for i in missing:
+                self.row_ids[i] = lookup.get(fit_X[i].tobytes(), -1)
+        self.records = df[FEATURE_COLUMNS].to_dict(orient='records')
+
+    def decode(self, i):
+        # heart.csv fields of reference row i, recovered from its scaled vector
+        row = np.array(self.knn.fit_X[i], dtype=np.float64)
+        if self.encoder.scale is not None:
+            row *= self.encoder.scale
+        if self.encoder.mean is not None:
+            row += self.encoder.mean
+        record = {col: round(float(row[pos]), 1) for col, pos in self.encoder.numeric_positions}
+        for col, positions in self.encoder.category_positions.items():
+            values = CATEGORY_VALUES[col]
+            present = [value for value, pos in zip(values, positions) if pos >= 0 and row[pos] > 0.5]
+            dropped = [value for value, pos in zip(values, positions) if pos < 0]
+            record[col] = present[0] if present else (dropped[0] if dropped else None)
+        return record
+
+    def describe(self, i, distance):
+        row_id = int(self.row_ids[i])
+        if row_id >= 0:
+            record = dict(self.records[row_id])
+        else:
+            record = self.decode(i)
+        record[LABEL_COLUMN] = int(self.knn.classes[self.knn.y[i]])
+        # 1-based data row in heart.csv, None for rows that aren't from it
+        record['row'] = row_id + 1 if row_id >= 0 else None
+        record['distance'] = round(float(distance), 4)
+        return record
+
+
+def assess(knn, reference_rows, X):
+    # One neighbour search per batch; returns a dict per row with the
+    # predicted label, the vote share behind it and the nearest patients
+    result = knn.query(X)
+    positive = int(np.searchsorted(knn.classes, 1)) if 1 in knn.classes else len(knn.classes) - 1
+    assessments = []
+    for row in range(len(X)):
+        neighbours = [reference_rows.describe(i, d) for i, d in zip(result.indices[row], result.distances[row])]
+        label = int(result.labels[row])
+        assessments.append({
+            'prediction': label,
+            'vote_fraction': round(float(result.proba[row].max()), 4),
+            'positive_fraction': round(float(result.proba[row, positive]), 4),
+            'neighbours': neighbours,
+        })
+    return assessments
+
+
+def similar_patients_text(assessment):
+    # One-line summary for prompts and reports
+    neighbours = assessment['neighbours']
+    positive = sum(n[LABEL_COLUMN] == 1 for n in neighbours)
+    return (f"{positive} of the {len(neighbours)} most similar patients in the reference data had heart disease "
+            f"(model vote {assessment['vote_fraction']:.0%} for this result)")
+
+
+def neighbour_line(neighbour):
+    source = f"heart.csv row {neighbour['row']}" if neighbour['row'] else "Added record"
+    numbers = ", ".join(f"{col} {neighbour[col]:g}" for col in NUMERIC_COLUMNS if col != 'FastingBS')
+    outcome = "heart disease" if neighbour[LABEL_COLUMN] == 1 else "no heart disease"
+    return (f"{source}: {neighbour['Gender']}, {neighbour['ChestPainType']}, {numbers}, "
+            f"ST {neighbour['ST_Slope']} - {outcome} (distance {neighbour['distance']:.2f})")
@@ -0,0 +1,189 @@
+import math
+import os
+
+import joblib
+import numpy as np
+
+import artifact
+import metrics
+
+# pandas and sklearn (via knn_engine) are imported where they are used, so
+# importing this module stays cheap for the app's first paint
+
+# -------------------------
+# Model Artifacts
+# -------------------------
+MODEL_PATH = "KNN_heart.pkl"
+SCALER_PATH = "scaler.pkl"
+COLUMNS_PATH = "columns.pkl"
+ARTIFACT_PATHS = (MODEL_PATH, SCALER_PATH, COLUMNS_PATH)
+
+# heart.csv schema (without the HeartDisease label)
+NUMERIC_COLUMNS = ['Age', 'RestingBP', 'Cholesterol', 'FastingBS', 'MaxHR', 'Oldpeak']
+CATEGORY_VALUES = {
+    'Gender': ['M', 'F'],
+    'ChestPainType': ['ATA', 'NAP', 'TA', 'ASY'],
+    'RestingECG': ['Normal', 'ST', 'LVH'],
+    'ExerciseAngina': ['N', 'Y'],
+    'ST_Slope': ['Up', 'Flat', 'Down'],
+}
+FEATURE_COLUMNS = ['Age', 'Gender', 'ChestPainType', 'RestingBP', 'Cholesterol', 'FastingBS',
+                   'RestingECG', 'MaxHR', 'ExerciseAngina', 'Oldpeak', 'ST_Slope']
+LABEL_COLUMN = 'HeartDisease'
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+def load_models():
+    model = joblib.load(MODEL_PATH)
+    scaler = joblib.load(SCALER_PATH)
+    expected_columns = joblib.load(COLUMNS_PATH)
+    return model, scaler, expected_columns
+
+
+def artifact_version():
+    # The artifact store's checksum version when there is one, otherwise a
+    # cheap fingerprint of the pickles; changes whenever the model is replaced
+    version = artifact.current_version()
+    if version is not None:
+        return version
+    stats = [os.stat(path) for path in ARTIFACT_PATHS]
+    return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+
+def load_pipeline(store=artifact.STORE_DIR, base=None):
+    # Prefers the memory-mapped artifact (no unpickling, no sklearn import);
+    # the pickles are the fallback until `python artifact.py convert` has run.
+    # base is the engine loaded before, reused if the new version appended to it.
+    from knn_engine import ExactKNN
+
+    with metrics.span("model.load"):
+        if artifact.current_version(store) is not None:
+            bundle = artifact.load_artifact(store)
+            return (ExactKNN.from_artifact(bundle, base=base),
+                    FeatureEncoder(bundle.columns, bundle.scaler_mean, bundle.scaler_scale))
+
+        model, scaler, expected_columns = load_models()
+        return ExactKNN.from_model(model), FeatureEncoder.from_scaler(expected_columns, scaler)
+
+
+# -------------------------
+# Feature Encoding
+# -------------------------
+def validate_frame(df):
+    missing = [col for col in FEATURE_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+
+    for col, values in CATEGORY_VALUES.items():
+        unknown = ~df[col].isin(values)
+        if unknown.any():
+            bad = sorted(df.loc[unknown, col].astype(str).unique())
+            raise ValueError(f"Unknown {col} values in {int(unknown.sum())} rows: {', '.join(bad)}")
+
+    nulls = df[NUMERIC_COLUMNS].isnull().any(axis=1)
+    if nulls.any():
+        raise ValueError(f"{int(nulls.sum())} rows have missing numeric values")
+
+
+def record_to_raw_input(record):
+    # One patient in heart.csv schema (e.g. a JSON object) -> the app's
+    # one-hot raw_input, with the same checks as validate_frame
+    missing = [col for col in FEATURE_COLUMNS if col not in record]
+    if missing:
+        raise ValueError(f"Record is missing required fields: {', '.join(missing)}")
+
+    raw_input = {}
+    for col in NUMERIC_COLUMNS:
+        value = record[col]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{col} must be a number, got {value!r}")
+        raw_input[col] = value
+    for col, values in CATEGORY_VALUES.items():
+        if record[col] not in values:
+            raise ValueError(f"Unknown {col} value {record[col]!r}; expected one of {', '.join(values)}")
+        raw_input[f"{col}_{record[col]}"] = 1
+    return raw_input
+
+
+class FeatureEncoder:
+    # Precompiled encoder: one-hot names map to fixed positions and the
+    # StandardScaler mean/scale are applied in place, so a form submission
+    # goes straight into a NumPy row without building a DataFrame.
+    def __init__(self, expected_columns, mean=None, scale=None):
+        self.columns = list(expected_columns)
+        self.index = {name: pos for pos, name in enumerate(self.columns)}
+        self.n_features = len(self.columns)
+
+        self.numeric_positions = [(col, self.index[col]) for col in NUMERIC_COLUMNS]
+        # Dropped dummies (drop_first) map to -1 and are skipped
+        self.category_positions = {
+            col: np.array([self.index.get(f"{col}_{value}", -1) for value in values])
+            for col, values in CATEGORY_VALUES.items()
+        }
+
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_scaler(cls, expected_columns, scaler):
+        return cls(expected_columns,
+                   scaler.mean_ if scaler.with_mean else None,
+                   scaler.scale_ if scaler.with_std else None)
+
+    def scale_rows(self, X):
+        # Same in-place operations as StandardScaler.transform, so the
+        # output is bit-identical
+        if self.mean is not None:
+            X -= self.mean
+        if self.scale is not None:
+            X /= self.scale
+        return X
+
+    def encode(self, raw_input, out=None, scaled=True):
+        # raw_input uses the app's one-hot keys, e.g. {'Age': 40, 'Gender_M': 1, ...}.
+        # With scaled=False the caller applies scale_rows() later, e.g. to a batch
+        row = np.zeros((1, self.n_features)) if out is None else out
+        if out is not None:
+            row.fill(0.0)
+        for name, value in raw_input.items():
+            pos = self.index.get(name)
+            if pos is not None:
+                row[0, pos] = value
+        return self.scale_rows(row) if scaled else row
+
+    def encode_frame(self, df, out=None, scaled=True):
+        import pandas as pd
+
+        validate_frame(df)
+        n_rows = len(df)
+        X = np.zeros((n_rows, self.n_features)) if out is None else out[:n_rows]
+        if out is not None:
+            X.fill(0.0)
+
+        for col, pos in self.numeric_positions:
+            X[:, pos] = df[col].to_numpy(dtype=np.float64)
+
+        rows = np.arange(n_rows)
+        for col, positions in self.category_positions.items():
+            codes = pd.Categorical(df[col], categories=CATEGORY_VALUES[col]).codes
+            target = positions[codes]
+            kept = target >= 0
+            X[rows[kept], target[kept]] = 1.0
+
+        return self.scale_rows(X) if scaled else X
+
+
+# -------------------------
+# Batch Scoring
+# -------------------------
+def score_frame(df, knn, encoder, chunk_size=DEFAULT_CHUNK_SIZE):
+    predictions = np.empty(len(df), dtype=int)
+    buffer = np.empty((min(chunk_size, len(df)), encoder.n_features))
+
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        scaled = encoder.encode_frame(chunk, out=buffer)
+        predictions[start:start + len(chunk)] = knn.predict(scaled)
+
+    return predictions
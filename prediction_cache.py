@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 4096
+
+
+def canonical_key(raw_input):
+    # Form inputs are integers, 0/1 flags and Oldpeak in 0.1 steps, so
+    # rounding to one decimal maps equivalent submissions to one key
+    return tuple((name, round(float(value), 1)) for name, value in sorted(raw_input.items()))
+
+
+class PredictionCache:
+    # Thread-safe LRU cache in front of encode -> scale -> predict. Entries
+    # are tied to a model version and dropped when the artifacts change.
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, version=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, raw_input, compute):
+        key = canonical_key(raw_input)
+        value = self.get(key)
+        if value is None:
+            value = compute(raw_input)
+            self.put(key, value)
+        return value
+
+    def invalidate(self, version=None):
+        with self._lock:
+            self._entries.clear()
+            self.version = version
+
+    def check_version(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'version': self.version,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,257 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import artifact
+from knn_engine import ExactKNN
+from pipeline import LABEL_COLUMN, FeatureEncoder, load_models
+
+# Shrinks the KNN reference set so prediction cost stops growing with every
+# labeled row we add. The reduced set is scored against the full one on a
+# held-out split and only exported if it stays within the tolerance.
+METHODS = ('enn', 'cnn', 'enn+cnn', 'kmeans')
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_RATIO = 0.2
+DEFAULT_ENN_NEIGHBORS = 3
+REPORT_FILE = "prototypes_report.json"
+
+
+# -------------------------
+# Reduction
+# -------------------------
+def edit_enn(X, y, classes, n_neighbors=DEFAULT_ENN_NEIGHBORS):
+    # Wilson editing: drop rows their own k nearest neighbours misclassify
+    # (noise and class-overlap points that only blur the decision boundary)
+    knn = ExactKNN(X, y, classes, n_neighbors=n_neighbors + 1)
+    _, ind = knn.kneighbors(X)
+    rows = np.arange(len(X))
+    # Drop each row's own entry; with duplicates it may not be the first one
+    is_self = ind == rows[:, None]
+    keep_last = ~is_self.any(axis=1)
+    is_self[keep_last, -1] = True
+    neighbours = ind[~is_self].reshape(len(X), n_neighbors)
+
+    votes = np.zeros((len(X), len(classes)))
+    np.add.at(votes, (rows[:, None], y[neighbours]), 1.0)
+    return np.flatnonzero(np.argmax(votes, axis=1) == y)
+
+
+def condense_cnn(X, y, seed=0):
+    # Hart's condensed nearest neighbour: keep only the rows a 1-NN over the
+    # rows kept so far gets wrong, repeating until a full pass adds nothing
+    order = np.random.default_rng(seed).permutation(len(X))
+    kept = []
+    for label in np.unique(y):
+        kept.append(order[np.flatnonzero(y[order] == label)[0]])
+    store = X[kept]
+    store_y = y[kept]
+    is_kept = np.zeros(len(X), dtype=bool)
+    is_kept[kept] = True
+
+    changed = True
+    while changed:
+        changed = False
+        for i in order:
+            if is_kept[i]:
+                continue
+            diff = store - X[i]
+            nearest = np.argmin(np.einsum('ij,ij->i', diff, diff))
+            if store_y[nearest] != y[i]:
+                store = np.vstack([store, X[i]])
+                store_y = np.append(store_y, y[i])
+                is_kept[i] = True
+                changed = True
+    return np.flatnonzero(is_kept)
+
+
+def kmeans_prototypes(X, y, ratio=DEFAULT_RATIO, seed=0):
+    # Per-class k-means centroids; prototypes are new points, not training rows
+    from sklearn.cluster import KMeans
+
+    prototypes, labels = [], []
+    for label in np.unique(y):
+        members = X[y == label]
+        n_clusters = min(len(members), max(1, int(round(ratio * len(members)))))
+        model = KMeans(n_clusters=n_clusters, n_init=3, random_state=seed).fit(members)
+        prototypes.append(model.cluster_centers_)
+        labels.append(np.full(n_clusters, label))
+    return np.vstack(prototypes), np.concatenate(labels)
+
+
+def reduce_reference(knn, method, ratio=DEFAULT_RATIO, enn_neighbors=DEFAULT_ENN_NEIGHBORS, seed=0):
+    # Returns the reduced (fit_X, y); y holds class indices like ExactKNN.y
+    X, y = knn.fit_X, knn.y
+    if method == 'kmeans':
+        return kmeans_prototypes(X, y, ratio, seed)
+
+    kept = np.arange(len(X))
+    if method in ('enn', 'enn+cnn'):
+        kept = kept[edit_enn(X[kept], y[kept], knn.classes, enn_neighbors)]
+    if method in ('cnn', 'enn+cnn'):
+        kept = kept[condense_cnn(X[kept], y[kept], seed)]
+    return X[kept], y[kept]
+
+
+# -------------------------
+# Evaluation
+# -------------------------
+def heart_csv_holdout(encoder, data_path):
+    # The test split train.py scores the shipped model on
+    import pandas as pd
+
+    from train import prepare_dataset, split_dataset
+
+    X, y = prepare_dataset(pd.read_csv(data_path))
+    _, X_test, _, y_test = split_dataset(X, y)
+    X_test = X_test.reindex(columns=encoder.columns, fill_value=0).to_numpy(dtype=np.float64)
+    return encoder.scale_rows(X_test), y_test.to_numpy()
+
+
+def csv_holdout(encoder, path):
+    # Labeled rows in heart.csv format, encoded the way the app scores them
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    if LABEL_COLUMN not in df.columns:
+        raise ValueError(f"{path} has no {LABEL_COLUMN} column")
+    return encoder.encode_frame(df), df[LABEL_COLUMN].to_numpy()
+
+
+def median_seconds(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+
+def evaluate(knn, X, y, repeat=50):
+    from sklearn.metrics import accuracy_score, f1_score
+
+    y_pred = knn.predict(X)
+    rows = [X[i:i + 1] for i in range(min(len(X), repeat))]
+    single = median_seconds(lambda: [knn.predict(row) for row in rows], 5) / len(rows)
+    return {
+        'reference_rows': len(knn.fit_X),
+        'reference_bytes': int(knn.fit_X.nbytes + knn.y.nbytes),
+        'accuracy': float(accuracy_score(y, y_pred)),
+        'f1': float(f1_score(y, y_pred)),
+        'single_ms': single * 1e3,
+        'batch_ms': median_seconds(lambda: knn.predict(X), repeat) * 1e3,
+    }
+
+
+def check_tolerance(full, reduced, tolerance):
+    # Metrics that fell more than `tolerance` (absolute) below the full model
+    return [metric for metric in ('accuracy', 'f1') if full[metric] - reduced[metric] > tolerance]
+
+
+# -------------------------
+# Command Line
+# -------------------------
+def load_source(store, version):
+    if artifact.current_version(store) is not None or version:
+        bundle = artifact.load_artifact(store, version)
+        encoder = FeatureEncoder(bundle.columns, bundle.scaler_mean, bundle.scaler_scale)
+        return ExactKNN.from_artifact(bundle), encoder, bundle.version
+    model, scaler, columns = load_models()
+    return ExactKNN.from_model(model), FeatureEncoder.from_scaler(columns, scaler), "pickles"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reduce the KNN reference set to a smaller set of prototypes.")
+    parser.add_argument("method", choices=METHODS)
+    parser.add_argument("--store", default=artifact.STORE_DIR, help=f"Artifact store (default: {artifact.STORE_DIR})")
+    parser.add_argument("--source", help="Version to reduce (default: CURRENT, else the pickles)")
+    parser.add_argument("--holdout", help="Labeled CSV in heart.csv format (default: the heart.csv test split)")
+    parser.add_argument("--data", default="heart.csv", help="Dataset the default holdout split comes from")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Largest allowed drop in held-out accuracy or F1 (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("--ratio", type=float, default=DEFAULT_RATIO,
+                        help=f"kmeans: prototypes per class as a fraction of its rows (default: {DEFAULT_RATIO})")
+    parser.add_argument("--enn-neighbors", type=int, default=DEFAULT_ENN_NEIGHBORS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true", help="Report only; don't export")
+    parser.add_argument("--activate", action="store_true", help="Point CURRENT at the exported version")
+    parser.add_argument("-o", "--report", default=REPORT_FILE, help=f"JSON report (default: {REPORT_FILE})")
+    args = parser.parse_args(argv)
+    if not 0 < args.ratio <= 1:
+        parser.error("--ratio must be in (0, 1]")
+
+    try:
+        full, encoder, source = load_source(args.store, args.source)
+        if args.holdout:
+            X_holdout, y_holdout = csv_holdout(encoder, args.holdout)
+        else:
+            X_holdout, y_holdout = heart_csv_holdout(encoder, args.data)
+    except (artifact.ArtifactError, OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    start = time.perf_counter()
+    fit_X, y = reduce_reference(full, args.method, args.ratio, args.enn_neighbors, args.seed)
+    reduce_seconds = time.perf_counter() - start
+    if len(fit_X) < full.n_neighbors:
+        sys.exit(f"Error: {args.method} kept {len(fit_X)} rows, fewer than n_neighbors={full.n_neighbors}")
+
+    reduced = ExactKNN(fit_X, y, full.classes, n_neighbors=full.n_neighbors,
+                       weights=full.weights, leaf_size=full.leaf_size)
+    before = evaluate(full, X_holdout, y_holdout)
+    after = evaluate(reduced, X_holdout, y_holdout)
+    failed = check_tolerance(before, after, args.tolerance)
+
+    print(f"{args.method}: {before['reference_rows']} -> {after['reference_rows']} reference rows "
+          f"in {reduce_seconds:.2f}s, {len(y_holdout)} holdout rows\n")
+    print(f"{'':<16} {'full':>10} {'reduced':>10}")
+    for key, fmt in (('accuracy', '{:10.4f}'), ('f1', '{:10.4f}'), ('single_ms', '{:10.4f}'),
+                     ('batch_ms', '{:10.3f}'), ('reference_bytes', '{:10,d}')):
+        print(f"{key:<16} {fmt.format(before[key])} {fmt.format(after[key])}")
+    speedup = {key: before[key] / after[key] if after[key] else None for key in ('single_ms', 'batch_ms')}
+    saved = 1.0 - after['reference_bytes'] / before['reference_bytes']
+    print(f"\nspeedup: {speedup['single_ms']:.2f}x single, {speedup['batch_ms']:.2f}x batch; "
+          f"memory saved: {saved:.1%}")
+
+    report = {
+        'method': args.method,
+        'source': source,
+        'holdout': args.holdout or f"{args.data} test split",
+        'settings': {'tolerance': args.tolerance, 'ratio': args.ratio,
+                     'enn_neighbors': args.enn_neighbors, 'seed': args.seed},
+        'full': before,
+        'reduced': after,
+        'speedup': speedup,
+        'memory_saved': saved,
+        'reduce_seconds': reduce_seconds,
+        'within_tolerance': not failed,
+        'exported': None,
+    }
+
+    if failed:
+        print(f"\nRefusing to export: {', '.join(failed)} dropped more than {args.tolerance} below the full model")
+    elif not args.dry_run:
+        metadata = {
+            'description': f"{args.method} reduction of {source}",
+            'reduction': {key: report[key] for key in ('method', 'source', 'holdout', 'settings')},
+            'holdout_accuracy': after['accuracy'],
+            'holdout_f1': after['f1'],
+        }
+        version = artifact.export_engine(reduced, encoder, store=args.store, activate=args.activate,
+                                         metadata=metadata, compact=full.compact_X is not None)
+        report['exported'] = version
+        if args.activate:
+            print(f"\nExported and activated {version}")
+        else:
+            print(f"\nExported {version}; serve it with: python artifact.py activate {version}")
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import copy
+import re
+import threading
+import uuid
+from datetime import datetime
+
+from fpdf import FPDF, FPDF_VERSION
+
+# Pre-rendered pages and cached layouts edit FPDF's page buffers, which is
+# only known to work on the version requirements.txt pins and `verify.py
+# report` checks; on any other version every report is drawn in full
+SPLICING_SUPPORTED = FPDF_VERSION == '1.7.2'
+
+# FPDF state that carries over from one drawing operation to the next;
+# restored after a pre-rendered page is spliced in
+PAGE_STATE = ('x', 'y', 'lasth', 'ws', 'underline', 'font_family', 'font_style',
+              'font_size_pt', 'font_size', 'text_color', 'fill_color', 'draw_color',
+              'color_flag', 'line_width')
+
+DISCLAIMER = """This report is generated by HeartAlert, an AI-powered heart health assessment tool. This is NOT a substitute for professional medical advice, diagnosis, or treatment.
+
+Always seek the advice of your physician or other qualified health provider with any questions regarding a medical condition. Never disregard professional medical advice or delay seeking it because of information from this report.
+
+HeartAlert uses machine learning algorithms to provide risk assessment based on the data provided. Results should be discussed with a healthcare professional for proper interpretation and action.
+
+This report is for informational purposes only and should be presented to a licensed medical professional for validation and further evaluation.
+
+HeartAlert is a verified AI health assessment platform designed to assist healthcare professionals and patients in preliminary risk screening."""
+
+
+class HeartAlertReport(FPDF):
+    def header(self):
+        self.set_font('Arial', 'B', 24)
+        self.set_text_color(102, 126, 234)
+        self.cell(0, 12, 'HeartAlert', 0, 1, 'C')
+        self.set_font('Arial', 'I', 11)
+        self.set_text_color(100, 100, 100)
+        self.cell(0, 8, 'AI-Powered Heart Health Assessment Report', 0, 1, 'C')
+        self.ln(8)
+        
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.set_text_color(150, 150, 150)
+        self.cell(0, 10, f'Generated by HeartAlert - Page {self.page_no()}', 0, 0, 'C')
+    
+    def chapter_title(self, title):
+        self.set_font('Arial', 'B', 14)
+        self.set_fill_color(102, 126, 234)
+        self.set_text_color(255, 255, 255)
+        self.cell(0, 10, title, 0, 1, 'L', 1)
+        self.ln(4)
+    
+    def chapter_body(self, body):
+        self.set_font('Arial', '', 11)
+        self.set_text_color(0, 0, 0)
+        self.multi_cell(0, 7, body)
+        self.ln()
+
+
+def new_report_id(now=None):
+    # The random suffix keeps IDs unique when reports are made in the same second
+    now = now or datetime.now()
+    return f"HRT-{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8].upper()}"
+
+
+def stamp_fields(now=None, report_id=None):
+    # The parts of a report that change on every render
+    now = now or datetime.now()
+    return {
+        'date': now.strftime('%B %d, %Y'),
+        'time': now.strftime('%I:%M %p'),
+        'report_id': report_id or new_report_id(now),
+    }
+
+
+def draw_disclaimer(pdf):
+    pdf.chapter_title('MEDICAL DISCLAIMER')
+    pdf.chapter_body(DISCLAIMER)
+    
+    # Footer certification
+    pdf.ln(5)
+    pdf.set_font('Arial', 'B', 10)
+    pdf.set_text_color(102, 126, 234)
+    pdf.cell(0, 6, 'Verified AI Health Assessment Platform', 0, 1, 'C')
+
+
+class StaticPage:
+    # Page content drawn once into a scratch document and replayed into each
+    # report. Only the body is recorded: the header is identical on every
+    # page and the footer (page number) is still drawn by the report itself.
+    # Everything the body draws sets its own font and colours, so the
+    # recording doesn't depend on what came before it.
+    def __init__(self, draw):
+        pdf = HeartAlertReport()
+        pdf.add_page()
+        start = len(pdf.pages[1])
+        self.start_y = pdf.y
+        draw(pdf)
+        if pdf.page != 1:
+            raise ValueError("Static page content must fit on one page")
+        self.content = pdf.pages[1][start:]
+        self.state = {name: getattr(pdf, name) for name in PAGE_STATE}
+        self.font_key = pdf.font_family + pdf.font_style
+        self.fonts = {key: font['i'] for key, font in pdf.fonts.items()}
+
+    def fits(self, pdf):
+        # Top of a fresh page, with every font the page uses already registered
+        return pdf.y == self.start_y and all(key in pdf.fonts for key in self.fonts)
+
+    def draw(self, pdf):
+        # Renumber the recorded /Fn references to this document's font table
+        mapping = {str(i): str(pdf.fonts[key]['i']) for key, i in self.fonts.items()}
+        content = self.content
+        if any(old != new for old, new in mapping.items()):
+            content = re.sub(r'/F(\d+) ', lambda m: f"/F{mapping[m.group(1)]} ", content)
+        pdf.pages[pdf.page] += content
+        for name, value in self.state.items():
+            setattr(pdf, name, value)
+        pdf.current_font = pdf.fonts[self.font_key]
+
+
+_disclaimer_page = None
+_disclaimer_lock = threading.Lock()
+
+
+def disclaimer_page():
+    global _disclaimer_page
+    if _disclaimer_page is None:
+        with _disclaimer_lock:
+            if _disclaimer_page is None:
+                _disclaimer_page = StaticPage(draw_disclaimer)
+    return _disclaimer_page
+
+
+def draw_similar_patients(pdf, assessment):
+    from neighbours import neighbour_line, similar_patients_text
+
+    pdf.set_font('Arial', '', 10)
+    pdf.set_text_color(0, 0, 0)
+    pdf.multi_cell(0, 6, f"{similar_patients_text(assessment)}.")
+    pdf.ln(2)
+    pdf.set_font('Arial', 'B', 10)
+    pdf.cell(0, 6, 'Most similar patients:', 0, 1)
+    pdf.set_font('Arial', '', 9)
+    for neighbour in assessment['neighbours']:
+        pdf.multi_cell(0, 5, f"- {neighbour_line(neighbour)}")
+    pdf.ln()
+
+
+def draw_what_if(pdf, what_if):
+    from what_if import what_if_lines
+
+    pdf.chapter_title('WHAT IF YOUR NUMBERS CHANGED')
+    pdf.set_font('Arial', '', 10)
+    pdf.set_text_color(0, 0, 0)
+    for line in what_if_lines(what_if):
+        pdf.multi_cell(0, 6, line)
+    pdf.ln()
+
+
+def generate_pdf_report(user_data, prediction, tips, symptoms, chat_history, assessment=None,
+                        now=None, report_id=None, static_pages=True):
+    # assessment: neighbours.assess() output for this prediction, if available,
+    # with the app's what_if.explore() summary under 'what_if'
+    pdf = draw_report(user_data, prediction, tips, symptoms, chat_history, assessment,
+                      stamp_fields(now, report_id), static_pages)
+    return pdf.output(dest='S').encode('latin1')
+
+
+class ReportBody:
+    # A report laid out once with placeholders for its date, time and Report
+    # ID. Layout is most of the cost of a report, so render() can stamp
+    # fresh values into a copy of it on every download.
+    def __init__(self, user_data, prediction, tips, symptoms, chat_history, assessment=None, static_pages=True):
+        token = uuid.uuid4().hex[:16]
+        self.placeholders = {name: f"[{token}:{name}]" for name in ('date', 'time', 'report_id')}
+        self.pdf = draw_report(user_data, prediction, tips, symptoms, chat_history, assessment,
+                               self.placeholders, static_pages)
+        self.size = sum(len(content) for content in self.pdf.pages.values())
+
+    def render(self, now=None, report_id=None):
+        pdf = copy.deepcopy(self.pdf)
+        fields = stamp_fields(now, report_id)
+        for n, content in pdf.pages.items():
+            for name, placeholder in self.placeholders.items():
+                content = content.replace(placeholder, fields[name])
+            pdf.pages[n] = content
+        return pdf.output(dest='S').encode('latin1')
+
+
+def draw_report(user_data, prediction, tips, symptoms, chat_history, assessment, stamp, static_pages=True):
+    # The whole report, not yet closed; stamp: stamp_fields() or placeholders
+    pdf = HeartAlertReport()
+    pdf.add_page()
+    
+    # Patient Information
+    pdf.chapter_title('PATIENT INFORMATION')
+    patient_info = f"""Name: {user_data['name']}
+Date: {stamp['date']}
+Time: {stamp['time']}
+Report ID: {stamp['report_id']}"""
+    pdf.chapter_body(patient_info)
+    
+    # Symptoms
+    if symptoms:
+        pdf.chapter_title('REPORTED SYMPTOMS')
+        pdf.chapter_body(symptoms)
+    
+    # Health Metrics
+    pdf.chapter_title('HEALTH METRICS')
+    metrics = f"""Age: {user_data['Age']} years
+Gender: {user_data['sex']}
+Resting Blood Pressure: {user_data['RestingBP']} mm Hg
+Cholesterol: {user_data['Cholesterol']} mg/dL
+Maximum Heart Rate: {user_data['MaxHR']} bpm
+Chest Pain Type: {user_data['chest_pain']}
+Oldpeak (ST Depression): {user_data['oldpeak']}
+Fasting Blood Sugar: {'> 120 mg/dL' if user_data['fasting_bs'] else '< 120 mg/dL'}
+Resting ECG: {user_data['resting_ecg']}
+Exercise Angina: {user_data['exercise_angina']}
+ST Slope: {user_data['st_slope']}"""
+    pdf.chapter_body(metrics)
+    
+    # Assessment Result
+    pdf.chapter_title('RISK ASSESSMENT')
+    pdf.set_font('Arial', 'B', 12)
+    if prediction == 1:
+        pdf.set_text_color(220, 38, 38)
+        result = "HIGH RISK - Immediate medical consultation recommended"
+    else:
+        pdf.set_text_color(34, 197, 94)
+        result = "LOW RISK - Continue maintaining healthy lifestyle"
+    pdf.multi_cell(0, 8, result)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln()
+    if assessment:
+        draw_similar_patients(pdf, assessment)
+    if assessment and assessment.get('what_if'):
+        draw_what_if(pdf, assessment['what_if'])
+    
+    # AI Recommendations
+    pdf.chapter_title('PERSONALIZED HEALTH RECOMMENDATIONS')
+    pdf.chapter_body(tips)
+    
+    # Chat History
+    if len(chat_history) > 0:
+        pdf.add_page()
+        pdf.chapter_title('AI CONSULTATION CONVERSATION')
+        for msg in chat_history:
+            if msg['role'] == 'user':
+                pdf.set_font('Arial', 'B', 10)
+                pdf.set_text_color(102, 126, 234)
+                pdf.multi_cell(0, 6, f"Patient: {msg['content']}")
+                pdf.ln(2)
+            elif msg['role'] == 'assistant':
+                pdf.set_font('Arial', '', 10)
+                pdf.set_text_color(0, 0, 0)
+                pdf.multi_cell(0, 6, f"HeartAlert AI: {msg['content']}")
+                pdf.ln(3)
+    
+    # Disclaimer
+    pdf.add_page()
+    if static_pages and SPLICING_SUPPORTED and disclaimer_page().fits(pdf):
+        disclaimer_page().draw(pdf)
+    else:
+        draw_disclaimer(pdf)
+    return pdf
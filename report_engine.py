@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_WORKERS = os.cpu_count() or 1
+JOBS_PER_WORKER = 4
+
+# Used by bulk reports when the input has no Recommendations column
+BULK_TIPS = ("Personalized recommendations are not included in batch reports. "
+             "Please review these results with your healthcare provider.")
+
+
+def report_key(user_data, prediction, tips, symptoms, chat_history, assessment=None):
+    # Content address of a report: the same inputs always map to the same key
+    inputs = [user_data, prediction, tips, symptoms, chat_history]
+    if assessment:
+        inputs.append(assessment)
+    payload = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ReportCache:
+    # Thread-safe LRU of laid-out reports (report.ReportBody), bounded by
+    # their total size
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, body):
+        if body.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.size
+            self._entries[key] = body
+            self.bytes += body.size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = ReportCache()
+
+
+def get_report(user_data, prediction, tips, symptoms, chat_history, assessment=None, cache=None):
+    # Renders the PDF for these inputs from the cached layout, laying it out
+    # on a miss. Every call gets the current date and a new Report ID.
+    import report
+
+    cache = _cache if cache is None else cache
+    with metrics.span("report.render", chat="yes" if chat_history else "no"):
+        if not report.SPLICING_SUPPORTED:
+            return report.generate_pdf_report(user_data, prediction, tips, symptoms, chat_history, assessment)
+        key = report_key(user_data, prediction, tips, symptoms, chat_history, assessment)
+        body = cache.get(key)
+        if body is None:
+            body = report.ReportBody(user_data, prediction, tips, symptoms, chat_history, assessment)
+            cache.put(key, body)
+        return body.render()
+
+
+# -------------------------
+# Bulk Generation
+# -------------------------
+def user_data_from_record(record, name, symptoms=""):
+    # heart.csv row -> the user_data dict app.py stores for a report
+    return {
+        'name': name,
+        'Age': record['Age'],
+        'sex': 'Male' if record['Gender'] == 'M' else 'Female',
+        'RestingBP': record['RestingBP'],
+        'Cholesterol': record['Cholesterol'],
+        'MaxHR': record['MaxHR'],
+        'chest_pain': record['ChestPainType'],
+        'oldpeak': record['Oldpeak'],
+        'fasting_bs': record['FastingBS'],
+        'resting_ecg': record['RestingECG'],
+        'exercise_angina': 'Yes' if record['ExerciseAngina'] == 'Y' else 'No',
+        'st_slope': record['ST_Slope'],
+        'symptoms': symptoms,
+    }
+
+
+def column_text(record, column):
+    # Optional text column; missing and empty (NaN) cells read as ""
+    value = record.get(column)
+    return "" if value is None or value != value else str(value)
+
+
+def _warm_worker():
+    # Render the static pages once per worker process
+    import report
+    report.disclaimer_page()
+
+
+def _render_jobs(jobs, output_dir):
+    # jobs: (key, inputs, rows) per distinct report. Each of its rows gets its
+    # own PDF with a new Report ID and date, stamped into one layout.
+    import report
+
+    results = []
+    for key, inputs, rows in jobs:
+        body = report.ReportBody(*inputs) if report.SPLICING_SUPPORTED else None
+        written = []
+        for _ in range(rows):
+            report_id = report.new_report_id()
+            if body is not None:
+                pdf_bytes = body.render(report_id=report_id)
+            else:
+                pdf_bytes = report.generate_pdf_report(*inputs, report_id=report_id)
+            path = os.path.join(output_dir, f"{report_id}.pdf")
+            # Write under a temporary name so a crash never leaves a partial PDF
+            fd, tmp = tempfile.mkstemp(prefix=".report-", suffix=".pdf", dir=output_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp, path)
+            written.append((report_id, path))
+        results.append((key, written))
+    return results
+
+
+def bulk_generate(report_inputs, output_dir, workers=DEFAULT_WORKERS):
+    # report_inputs: (user_data, prediction, tips, symptoms, chat_history)
+    # tuples, optionally followed by an assessment. Every row gets its own
+    # <output_dir>/<report_id>.pdf; rows with identical inputs share one
+    # layout. Returns the (report_id, path) per row and the layouts drawn.
+    os.makedirs(output_dir, exist_ok=True)
+    keys = [report_key(*inputs) for inputs in report_inputs]
+    rows = {}
+    for key, inputs in zip(keys, report_inputs):
+        rows.setdefault(key, [key, inputs, 0])[2] += 1
+    unique = [tuple(job) for job in rows.values()]
+
+    chunk_size = max(1, math.ceil(len(unique) / (workers * JOBS_PER_WORKER)))
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+
+    if workers <= 1:
+        _warm_worker()
+        results = [_render_jobs(chunk, output_dir) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker) as pool:
+            results = list(pool.map(_render_jobs, chunks, [output_dir] * len(chunks)))
+    written = {key: iter(reports) for chunk_results in results for key, reports in chunk_results}
+    return [next(written[key]) for key in keys], len(unique)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate HeartAlert PDF reports for a scored cohort.")
+    parser.add_argument("input", help="CSV in heart.csv schema, e.g. the output of batch_score.py")
+    parser.add_argument("-o", "--output-dir", default="reports", help="Directory for the PDFs (default: reports)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Worker processes (default: {DEFAULT_WORKERS})")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        sys.exit("--workers must be at least 1")
+
+    import pandas as pd
+
+    from pipeline import load_pipeline, score_frame
+
+    df = pd.read_csv(args.input)
+    if 'Prediction' not in df.columns:
+        knn, encoder = load_pipeline()
+        try:
+            df['Prediction'] = score_frame(df, knn, encoder)
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+
+    inputs = []
+    for i, record in enumerate(df.to_dict(orient='records')):
+        name = column_text(record, 'Name') or f"Patient {i + 1}"
+        symptoms = column_text(record, 'Symptoms')
+        tips = column_text(record, 'Recommendations') or BULK_TIPS
+        inputs.append((user_data_from_record(record, name, symptoms), int(record['Prediction']), tips, symptoms, []))
+
+    start = time.perf_counter()
+    reports, laid_out = bulk_generate(inputs, args.output_dir, args.workers)
+    elapsed = time.perf_counter() - start
+
+    df['Report ID'] = [report_id for report_id, _ in reports]
+    df['Report'] = [path for _, path in reports]
+    index_path = os.path.join(args.output_dir, "index.csv")
+    df.to_csv(index_path, index=False)
+    rate = len(reports) / elapsed if elapsed > 0 else float('inf')
+    print(f"Rendered {len(reports)} reports ({len(reports) - laid_out} from a shared layout) in {elapsed:.2f}s "
+          f"({rate:,.0f} reports/sec)")
+    print(f"Index written to {index_path}")
+
+
+if __name__ == "__main__":
+    main()
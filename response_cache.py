@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.getenv("HEARTALERT_RESPONSE_CACHE", os.path.join(".cache", "responses.sqlite3"))
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def request_key(model, messages, params):
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    # Disk-backed LLM response cache. Entries expire after `ttl` seconds and
+    # are shared by every session and server process using the same file.
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response, ttl=None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now + ttl)
+            )
+
+    def evict_expired(self):
+        with self._lock:
+            return self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            total, live = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(expires_at > ?), 0) FROM responses", (time.time(),)
+            ).fetchone()
+        return {'entries': total, 'live': live, 'hits': self.hits, 'misses': self.misses}
+
+
+# -------------------------
+# Command Line
+# -------------------------
+def warm(cache, force=False):
+    # Pre-populate the answers a new session gets for each Quick Question
+    import llm
+
+    for question in llm.QUICK_QUESTIONS:
+        messages = llm.chat_messages([{"role": "user", "content": question}])
+        key = llm.chat_request_key(messages)
+        if not force and cache.get(key) is not None:
+            print(f"cached   {question}")
+            continue
+        start = time.perf_counter()
+        reply = ''.join(llm.stream_chat_reply(messages))
+        cache.put(key, reply)
+        print(f"warmed   {question} ({time.perf_counter() - start:.1f}s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the HeartAlert LLM response cache.")
+    parser.add_argument("command", choices=["warm", "stats", "evict", "clear"])
+    parser.add_argument("--path", default=DEFAULT_PATH, help=f"Cache file (default: {DEFAULT_PATH})")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_TTL, help="Entry lifetime in seconds")
+    parser.add_argument("--force", action="store_true", help="warm: refresh entries that are still live")
+    args = parser.parse_args(argv)
+
+    cache = ResponseCache(args.path, ttl=args.ttl)
+    if args.command == "warm":
+        warm(cache, force=args.force)
+    elif args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "evict":
+        print(f"Evicted {cache.evict_expired()} expired entries")
+    else:
+        cache.clear()
+        print("Cache cleared")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import metrics
+import pipeline
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 2.0
+MAX_RECORDS_PER_REQUEST = 10_000
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# How often to check model_store/CURRENT for a new version
+RELOAD_INTERVAL = 1.0
+
+RISK_LABELS = {0: "LOW", 1: "HIGH"}
+
+_STOP = object()
+
+
+# -------------------------
+# Micro-batching
+# -------------------------
+class MicroBatcher:
+    # Coalesces concurrent requests into one call of `fn`. A batch is closed
+    # when it reaches max_batch_size or max_wait seconds after its first item
+    # arrived, whichever comes first. The wait only applies while traffic is
+    # batching at all (the previous batch had more than one item); otherwise
+    # the batch takes what is already queued, so a lone request isn't delayed.
+    def __init__(self, fn, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT_MS / 1000):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._last_size = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="heartalert-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'queued': self._queue.qsize(),
+        }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + (self.max_wait if self._last_size > 1 else 0.0)
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            self._last_size = len(batch)
+            futures = [future for _, future in batch if future.set_running_or_notify_cancel()]
+            items = [item for item, future in batch if future.running()]
+            if not items:
+                continue
+            try:
+                results = self.fn(items)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+# -------------------------
+# Scoring
+# -------------------------
+class ScoringService:
+    # Loads the pipeline in the background so the HTTP server can answer
+    # health checks immediately; /readyz turns 200 once scoring is possible.
+    # After that it follows model_store/CURRENT: a new version is loaded and
+    # warmed on the loader thread, then swapped in between batches.
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT_MS / 1000,
+                 reload_interval=RELOAD_INTERVAL):
+        self.pipeline = None
+        self.version = None
+        self.load_error = None
+        self.reloads = 0
+        self.started = time.time()
+        self.ready = threading.Event()
+        self.reload_interval = reload_interval
+        self.batcher = MicroBatcher(self._score_batch, max_batch_size, max_wait)
+        threading.Thread(target=self._load, name="heartalert-loader", daemon=True).start()
+
+    def _load(self):
+        try:
+            self._swap(pipeline.artifact_version())
+        except Exception as e:
+            self.load_error = f"{type(e).__name__}: {e}"
+            return
+        self.ready.set()
+
+        while self.reload_interval:
+            time.sleep(self.reload_interval)
+            try:
+                version = pipeline.artifact_version()
+                if version != self.version:
+                    self._swap(version)
+                    self.reloads += 1
+            except Exception as e:
+                # Keep serving the loaded version
+                self.load_error = f"{type(e).__name__}: {e}"
+
+    def _swap(self, version):
+        base = self.pipeline[0] if self.pipeline else None
+        knn, encoder = pipeline.load_pipeline(base=base)
+        # Warm the scoring path before it takes traffic
+        knn.predict(np.zeros((1, encoder.n_features)))
+        # Swapped as one tuple, so a batch always knows which version scored it
+        self.pipeline = (knn, encoder, version)
+        self.version = version
+        self.load_error = None
+
+    def _score_batch(self, raw_inputs):
+        # Rows are filled unscaled and the scaler runs once on the whole
+        # batch. Each result is (prediction, version of the engine used).
+        knn, encoder, version = self.pipeline
+        X = np.zeros((len(raw_inputs), encoder.n_features))
+        with metrics.span("encode", path="service"):
+            for i, raw_input in enumerate(raw_inputs):
+                encoder.encode(raw_input, out=X[i:i + 1], scaled=False)
+        with metrics.span("scale", path="service"):
+            encoder.scale_rows(X)
+        with metrics.span("predict", path="service"):
+            return [(prediction, version) for prediction in knn.predict(X).tolist()]
+
+    def score(self, records, timeout):
+        # (prediction, model version) per record; a reload between the
+        # batches a request is split across can give them different versions
+        raw_inputs = []
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                raise ValueError(f"Record {i} must be a JSON object")
+            try:
+                raw_inputs.append(pipeline.record_to_raw_input(record))
+            except ValueError as e:
+                raise ValueError(f"Record {i}: {e}")
+        futures = [self.batcher.submit(raw_input) for raw_input in raw_inputs]
+        deadline = time.monotonic() + timeout
+        return [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+
+    def health(self):
+        return {'status': 'ok', 'uptime_s': round(time.time() - self.started, 1), 'batching': self.batcher.stats(),
+                'model_version': str(self.version), 'reloads': self.reloads, 'load_error': self.load_error}
+
+    def readiness(self):
+        if self.ready.is_set():
+            return 200, {'status': 'ready', 'model_version': str(self.version)}
+        if self.load_error:
+            return 503, {'status': 'failed', 'error': self.load_error}
+        return 503, {'status': 'loading'}
+
+
+def prediction_body(prediction):
+    return {'prediction': int(prediction), 'risk': RISK_LABELS[int(prediction)]}
+
+
+# -------------------------
+# HTTP
+# -------------------------
+class ScoringHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can reuse connections between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits ~40ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+    server_version = "HeartAlert"
+    service = None
+    request_timeout = 10.0
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self.send_json(200, self.service.health())
+        elif self.path == "/readyz":
+            self.send_json(*self.service.readiness())
+        elif self.path == "/metrics":
+            payload = metrics.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", metrics.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            # The body is left unread, so the connection can't be reused
+            self.close_connection = True
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+
+        # The body is only read with a valid length; otherwise the connection
+        # is closed, since the rest of the request can't be found
+        if self.headers.get("Content-Length") is None:
+            self.close_connection = True
+            self.send_json(411, {'error': "Content-Length is required"})
+            return
+        try:
+            length = int(self.headers["Content-Length"])
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self.send_json(400, {'error': "Content-Length must be a non-negative integer"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self.send_json(413, {'error': "Request body too large"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self.send_json(400, {'error': "Body must be valid JSON"})
+            return
+
+        # A single record, or {"records": [...]} for several patients
+        single = isinstance(payload, dict) and "records" not in payload
+        records = [payload] if single else payload.get("records") if isinstance(payload, dict) else None
+        if not isinstance(records, list) or not records:
+            self.send_json(400, {'error': "Send a patient record or {\"records\": [...]}"})
+            return
+        if len(records) > MAX_RECORDS_PER_REQUEST:
+            self.send_json(413, {'error': f"At most {MAX_RECORDS_PER_REQUEST} records per request"})
+            return
+        if not self.service.ready.is_set():
+            self.send_json(503, {'error': "Model is not loaded yet"})
+            return
+
+        try:
+            with metrics.span("service.request"):
+                results = self.service.score(records, self.request_timeout)
+        except ValueError as e:
+            self.send_json(422, {'error': str(e)})
+            return
+        except FutureTimeout:
+            self.send_json(504, {'error': "Scoring timed out"})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': f"Scoring failed: {e}"})
+            return
+
+        versions = {version for _, version in results}
+        if single:
+            prediction, version = results[0]
+            self.send_json(200, {**prediction_body(prediction), 'model_version': str(version)})
+        elif len(versions) == 1:
+            self.send_json(200, {'predictions': [prediction_body(p) for p, _ in results],
+                                 'model_version': str(versions.pop())})
+        else:
+            # Split across a reload: each prediction says which version made it
+            self.send_json(200, {'predictions': [{**prediction_body(p), 'model_version': str(v)} for p, v in results],
+                                 'model_version': None})
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a burst of new connections; the socketserver default of 5
+    # refuses clients once a few dozen connect at once
+    request_queue_size = 256
+
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch_size=MAX_BATCH_SIZE,
+                  max_wait_ms=MAX_WAIT_MS, verbose=False):
+    service = ScoringService(max_batch_size, max_wait_ms / 1000)
+    handler = type("BoundScoringHandler", (ScoringHandler,), {'service': service})
+    server = ScoringServer((host, port), handler)
+    server.verbose = verbose
+    return server, service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HeartAlert headless scoring service.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="Largest micro-batch passed to the model (1 disables batching)")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="How long a batch waits for more requests after the first one arrives")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    server, service = create_server(args.host, args.port, args.max_batch_size, args.max_wait_ms, args.verbose)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} "
+          f"(max batch {args.max_batch_size}, max wait {args.max_wait_ms} ms)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.batcher.close()
+
+
+if __name__ == "__main__":
+    main()
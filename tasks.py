@@ -0,0 +1,173 @@
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# CPU-bound stages (model loading, PDF builds) share a small pool; LLM
+# streams spend nearly all their time waiting on the network, so they get a
+# pool of their own that a burst of sessions can't exhaust. The LLM gateway
+# still caps how many of them reach the API at once.
+MAX_WORKERS = 8
+STREAM_WORKERS = 64
+# Longest a stage may wait for a free worker; its own deadline only starts
+# once it runs
+QUEUE_TIMEOUT = 30.0
+
+_DONE = object()
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def create_executor():
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="heartalert")
+
+
+def create_stream_executor():
+    return ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="heartalert-stream")
+
+
+class Task:
+    # A background stage with a deadline, counted from when a worker starts
+    # it. The cancel event is shared with the worker so long-running work
+    # can stop early.
+    def __init__(self, name, timeout, queue_timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.deadline = None
+        self.started = threading.Event()
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def _run(self, fn, args):
+        self.deadline = time.monotonic() + self.timeout
+        self.started.set()
+        return fn(*args)
+
+    def wait_started(self):
+        if not self.started.wait(self.queue_timeout):
+            self.cancel()
+            raise TaskTimeout(f"{self.name} waited too long for a worker")
+
+    def remaining(self):
+        if self.deadline is None:
+            return self.timeout
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def result(self):
+        if self.cancelled:
+            raise TaskCancelled(f"{self.name} was cancelled")
+        self.wait_started()
+        try:
+            return self.future.result(timeout=self.remaining())
+        except FutureTimeout:
+            self.cancel()
+            raise TaskTimeout(f"{self.name} did not finish in time")
+        except CancelledError:
+            raise TaskCancelled(f"{self.name} was cancelled")
+
+
+class StreamTask(Task):
+    # Runs a generator on a worker thread and hands its items back through a
+    # queue, so the caller can render them while other work proceeds.
+    def __init__(self, name, timeout):
+        super().__init__(name, timeout)
+        self._queue = queue.Queue()
+
+    def _pump(self, gen_fn, args):
+        try:
+            stream = gen_fn(*args)
+            try:
+                for item in stream:
+                    if self.cancelled:
+                        break
+                    self._queue.put(item)
+            finally:
+                if hasattr(stream, 'close'):
+                    stream.close()
+        except Exception as e:
+            self._queue.put(_Failure(e))
+            return
+        self._queue.put(_DONE)
+
+    def __iter__(self):
+        self.wait_started()
+        while True:
+            if self.cancelled:
+                raise TaskCancelled(f"{self.name} was cancelled")
+            try:
+                item = self._queue.get(timeout=self.remaining())
+            except queue.Empty:
+                self.cancel()
+                raise TaskTimeout(f"{self.name} did not finish in time")
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+
+class SessionTasks:
+    # Background stages for one user session, run on shared executors:
+    # submit() on `executor`, stream() on `stream_executor` (default: the
+    # same one). Submitting a stage replaces (and cancels) the previous one
+    # of the same name.
+    def __init__(self, executor, stream_executor=None):
+        self.executor = executor
+        self.stream_executor = stream_executor or executor
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _replace(self, task):
+        with self._lock:
+            previous = self._tasks.get(task.name)
+            self._tasks[task.name] = task
+        if previous is not None:
+            previous.cancel()
+
+    def submit(self, name, fn, *args, timeout):
+        task = Task(name, timeout)
+        self._replace(task)
+        task.future = self.executor.submit(task._run, fn, args)
+        return task
+
+    def stream(self, name, gen_fn, *args, timeout):
+        task = StreamTask(name, timeout)
+        self._replace(task)
+        task.future = self.stream_executor.submit(task._run, task._pump, (gen_fn, args))
+        return task
+
+    def get(self, name):
+        with self._lock:
+            return self._tasks.get(name)
+
+    def cancel_all(self):
+        with self._lock:
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+        for task in tasks:
+            task.cancel()
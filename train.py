@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.preprocessing import StandardScaler
+
+import artifact
+from pipeline import COLUMNS_PATH, LABEL_COLUMN, MODEL_PATH, SCALER_PATH
+
+DATA_PATH = "heart.csv"
+CACHE_DIR = os.path.join(".cache", "train")
+DEFAULT_OUTPUT_DIR = "training_output"
+REPORT_FILE = "training_report.json"
+
+# Same split as HeartdiseaseFinal.ipynb
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+DEFAULT_FOLDS = 5
+METRICS = {'accuracy': accuracy_score, 'f1': f1_score}
+
+# The app's scoring engine (knn_engine.ExactKNN) serves KNN models, so that
+# is what gets exported; the other candidates are trained for comparison.
+EXPORT_MODEL = 'knn'
+
+
+# -------------------------
+# Candidates
+# -------------------------
+def make_estimator(name, params):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.naive_bayes import GaussianNB
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.svm import SVC
+    from sklearn.tree import DecisionTreeClassifier
+
+    factories = {
+        'logistic_regression': lambda: LogisticRegression(max_iter=1000),
+        'knn': KNeighborsClassifier,
+        'naive_bayes': GaussianNB,
+        'decision_tree': lambda: DecisionTreeClassifier(random_state=RANDOM_STATE),
+        'svm': lambda: SVC(random_state=RANDOM_STATE),
+    }
+    return factories[name]().set_params(**params)
+
+
+# The first entry of each grid is the notebook's default configuration
+PARAM_GRIDS = {
+    'logistic_regression': {'C': [1.0, 0.01, 0.1, 10.0]},
+    'knn': {'n_neighbors': [5, 3, 7, 9, 11, 15, 21], 'weights': ['uniform', 'distance']},
+    'naive_bayes': {'var_smoothing': [1e-9, 1e-8, 1e-7, 1e-6]},
+    'decision_tree': {'max_depth': [None, 3, 5, 8], 'min_samples_leaf': [1, 5, 10]},
+    'svm': {'C': [1.0, 0.1, 10.0], 'gamma': ['scale', 0.01, 0.1]},
+}
+
+
+def expand_grid(grid):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+# -------------------------
+# Preprocessing (as in the notebook)
+# -------------------------
+def prepare_dataset(df):
+    df = df.copy()
+    # Zeros are missing measurements: replace with the mean of the non-zero values
+    for col in ('Cholesterol', 'RestingBP'):
+        mean = df.loc[df[col] != 0, col].mean()
+        df[col] = df[col].replace(0, mean).round(2)
+
+    # astype(int) truncates the imputed means and Oldpeak, exactly like the
+    # notebook the shipped model was trained with
+    encoded = pd.get_dummies(df, drop_first=True).astype(int)
+    X = encoded.drop(LABEL_COLUMN, axis=1)
+    y = encoded[LABEL_COLUMN]
+    return X, y
+
+
+def split_dataset(X, y):
+    return train_test_split(X, y, stratify=y, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+
+
+def encode_folds(X_train, y_train, n_folds, cache_dir=CACHE_DIR):
+    # Scaled train/validation matrices for every CV fold, with the scaler fit
+    # on each fold's training part. They are shared by every candidate and
+    # cached on disk, keyed on the data and the fold settings.
+    X_values = np.ascontiguousarray(X_train.to_numpy(dtype=np.float64))
+    y_values = y_train.to_numpy()
+    digest = hashlib.sha256()
+    digest.update(X_values.tobytes())
+    digest.update(y_values.tobytes())
+    digest.update(f"{n_folds}:{RANDOM_STATE}".encode())
+    path = os.path.join(cache_dir, f"folds-{digest.hexdigest()[:16]}.joblib")
+    if os.path.exists(path):
+        return joblib.load(path, mmap_mode='r'), True
+
+    folds = []
+    cv = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=RANDOM_STATE)
+    for train_idx, val_idx in cv.split(X_values, y_values):
+        scaler = StandardScaler().fit(X_values[train_idx])
+        folds.append((scaler.transform(X_values[train_idx]), y_values[train_idx],
+                      scaler.transform(X_values[val_idx]), y_values[val_idx]))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(folds, tmp)
+    os.replace(tmp, path)
+    return folds, False
+
+
+# -------------------------
+# Search
+# -------------------------
+def evaluate_candidate(name, params, fold, fold_index):
+    X_tr, y_tr, X_val, y_val = fold
+    start = time.perf_counter()
+    y_pred = make_estimator(name, params).fit(X_tr, y_tr).predict(X_val)
+    scores = {metric: float(fn(y_val, y_pred)) for metric, fn in METRICS.items()}
+    return name, params, fold_index, scores, time.perf_counter() - start
+
+
+def search(folds, models, n_jobs):
+    tasks = [(name, params, fold, i)
+             for name in models
+             for params in expand_grid(PARAM_GRIDS[name])
+             for i, fold in enumerate(folds)]
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(evaluate_candidate)(*task) for task in tasks
+    )
+
+    grouped = {}
+    for name, params, _, scores, seconds in results:
+        entry = grouped.setdefault((name, json.dumps(params, sort_keys=True)),
+                                   {'model': name, 'params': params, 'folds': [], 'fit_seconds': 0.0})
+        entry['folds'].append(scores)
+        entry['fit_seconds'] += seconds
+
+    candidates = []
+    for entry in grouped.values():
+        for metric in METRICS:
+            values = [scores[metric] for scores in entry['folds']]
+            entry[f"cv_{metric}"] = float(np.mean(values))
+            entry[f"cv_{metric}_std"] = float(np.std(values))
+        del entry['folds']
+        candidates.append(entry)
+    return candidates
+
+
+def best_per_model(candidates, metric):
+    # Highest mean CV score; ties go to the earlier grid entry
+    best = {}
+    for entry in candidates:
+        current = best.get(entry['model'])
+        if current is None or entry[f"cv_{metric}"] > current[f"cv_{metric}"]:
+            best[entry['model']] = entry
+    return best
+
+
+# -------------------------
+# Command Line
+# -------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Retrain the HeartAlert models and export the app's artifacts.")
+    parser.add_argument("--data", default=DATA_PATH, help=f"Training CSV (default: {DATA_PATH})")
+    parser.add_argument("-o", "--output-dir", default=DEFAULT_OUTPUT_DIR,
+                        help="Where to write the pickles, model_store/ and the report "
+                             f"(default: {DEFAULT_OUTPUT_DIR}; use . to replace the app's model)")
+    parser.add_argument("--models", default=",".join(PARAM_GRIDS),
+                        help=f"Comma-separated candidates (default: all of {', '.join(PARAM_GRIDS)})")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS, help="Stratified CV folds")
+    parser.add_argument("--metric", choices=list(METRICS), default='f1', help="Model selection metric")
+    parser.add_argument("--jobs", type=int, default=-1, help="Parallel workers (default: all cores)")
+    parser.add_argument("--notebook-defaults", action="store_true",
+                        help="Skip the search and export the notebook's default KNN (reproduces KNN_heart.pkl)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    models = [name.strip() for name in args.models.split(",") if name.strip()]
+    unknown = [name for name in models if name not in PARAM_GRIDS]
+    if unknown:
+        sys.exit(f"Unknown models: {', '.join(unknown)}")
+    if EXPORT_MODEL not in models and not args.notebook_defaults:
+        sys.exit(f"--models must include {EXPORT_MODEL}, the model the app serves")
+
+    timings = {}
+    start = time.perf_counter()
+    X, y = prepare_dataset(pd.read_csv(args.data))
+    X_train, X_test, y_train, y_test = split_dataset(X, y)
+    timings['preprocess'] = time.perf_counter() - start
+
+    candidates, best = [], {}
+    if args.notebook_defaults:
+        best = {EXPORT_MODEL: {'model': EXPORT_MODEL, 'params': {}}}
+    else:
+        start = time.perf_counter()
+        folds, cached = encode_folds(X_train, y_train, args.folds)
+        timings['encode_folds'] = time.perf_counter() - start
+        print(f"{args.folds} folds {'loaded from cache' if cached else 'encoded'} in {timings['encode_folds']:.2f}s")
+
+        start = time.perf_counter()
+        candidates = search(folds, models, args.jobs)
+        timings['search'] = time.perf_counter() - start
+        print(f"Evaluated {len(candidates)} configurations x {args.folds} folds in {timings['search']:.2f}s")
+        best = best_per_model(candidates, args.metric)
+
+    # Refit the selected configurations on the full training split and score
+    # them once on the held-out test split
+    start = time.perf_counter()
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+    fitted = {}
+    for name, entry in best.items():
+        model = make_estimator(name, entry['params']).fit(X_train_scaled, y_train)
+        y_pred = model.predict(X_test_scaled)
+        entry['test_accuracy'] = float(accuracy_score(y_test, y_pred))
+        entry['test_f1'] = float(f1_score(y_test, y_pred))
+        fitted[name] = model
+    timings['refit'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    os.makedirs(args.output_dir, exist_ok=True)
+    columns = X.columns.tolist()
+    joblib.dump(fitted[EXPORT_MODEL], os.path.join(args.output_dir, MODEL_PATH))
+    joblib.dump(scaler, os.path.join(args.output_dir, SCALER_PATH))
+    joblib.dump(columns, os.path.join(args.output_dir, COLUMNS_PATH))
+    version = artifact.convert_pickles(fitted[EXPORT_MODEL], scaler, columns,
+                                       store=os.path.join(args.output_dir, artifact.STORE_DIR))
+    timings['export'] = time.perf_counter() - start
+
+    print(f"\n{'model':<20} {'params':<40} {'cv ' + args.metric:>10} {'test acc':>9} {'test f1':>8}")
+    for name, entry in best.items():
+        cv = entry.get(f"cv_{args.metric}")
+        cv_text = f"{cv:10.4f}" if cv is not None else f"{'-':>10}"
+        print(f"{name:<20} {json.dumps(entry['params']):<40} {cv_text} "
+              f"{entry['test_accuracy']:9.4f} {entry['test_f1']:8.4f}")
+
+    report = {
+        'data': args.data,
+        'rows': {'train': len(X_train), 'test': len(X_test)},
+        'folds': None if args.notebook_defaults else args.folds,
+        'metric': args.metric,
+        'exported': {'model': EXPORT_MODEL, 'params': best[EXPORT_MODEL]['params'], 'artifact_version': version},
+        'best': best,
+        'candidates': sorted(candidates, key=lambda c: (c['model'], -c[f"cv_{args.metric}"])),
+        'timings_seconds': timings,
+    }
+    report_path = os.path.join(args.output_dir, REPORT_FILE)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nExported {EXPORT_MODEL} {best[EXPORT_MODEL]['params']} as artifact {version} to {args.output_dir}")
+    print(f"Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+import argparse
+import itertools
+import os
+import re
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import artifact
+from knn_engine import TREE_REBUILD_FRACTION, ExactKNN, compact_store
+from neighbours import ReferenceRows, assess
+from pipeline import CATEGORY_VALUES, LABEL_COLUMN, FeatureEncoder, load_models
+
+DATA_PATH = "heart.csv"
+SYNTHETIC_ROWS = 100_000
+# Synthetic reference set for the float32 store check, labeled by the model
+COMPACT_REFERENCE_ROWS = 50_000
+
+
+# -------------------------
+# Reference (app.py DataFrame) Path
+# -------------------------
+def raw_input_from_row(row):
+    raw_input = {
+        'Age': row['Age'],
+        'RestingBP': row['RestingBP'],
+        'Cholesterol': row['Cholesterol'],
+        'FastingBS': row['FastingBS'],
+        'MaxHR': row['MaxHR'],
+        'Oldpeak': row['Oldpeak'],
+    }
+    for col in CATEGORY_VALUES:
+        raw_input[f"{col}_{row[col]}"] = 1
+    return raw_input
+
+
+def reference_scaled(raw_input, scaler, expected_columns):
+    input_df = pd.DataFrame([raw_input])
+    for col in expected_columns:
+        if col not in input_df.columns:
+            input_df[col] = 0
+    input_df = input_df[expected_columns]
+    return scaler.transform(input_df)
+
+
+# -------------------------
+# Checks
+# -------------------------
+def check_encoder(df, model, scaler, expected_columns):
+    encoder = FeatureEncoder.from_scaler(expected_columns, scaler)
+    reference = np.vstack([
+        reference_scaled(raw_input_from_row(row), scaler, expected_columns)
+        for _, row in df.iterrows()
+    ])
+
+    failures = []
+    single = np.vstack([encoder.encode(raw_input_from_row(row)) for _, row in df.iterrows()])
+    if not np.array_equal(single, reference):
+        failures.append(f"single-row encoding differs on {count_rows(single, reference)} rows")
+
+    batch = encoder.encode_frame(df)
+    if not np.array_equal(batch, reference):
+        failures.append(f"batch encoding differs on {count_rows(batch, reference)} rows")
+
+    if not np.array_equal(model.predict(batch), model.predict(reference)):
+        failures.append("predictions differ")
+
+    return failures
+
+
+def check_knn(df, model, scaler, expected_columns):
+    encoder = FeatureEncoder.from_scaler(expected_columns, scaler)
+    knn = ExactKNN.from_model(model)
+
+    # heart.csv itself, the training matrix (exact duplicates, so plenty of
+    # distance ties), random form inputs and near-ties inside the top k
+    queries = {
+        'data': encoder.encode_frame(df),
+        'training': model._fit_X,
+        'synthetic': encoder.encode_frame(synthetic_frame(SYNTHETIC_ROWS)),
+        'midpoints': midpoint_queries(model),
+    }
+
+    failures = []
+    for name, X in queries.items():
+        ref_dist, ref_ind = model.kneighbors(X)
+        dist, ind = knn.kneighbors(X)
+        differing = int((np.sort(ind, axis=1) != np.sort(ref_ind, axis=1)).any(axis=1).sum())
+        if differing:
+            failures.append(f"{name}: neighbour sets differ on {differing} rows")
+        # query() reports neighbours in this order, so ties must break the same way
+        elif not np.array_equal(ind, ref_ind):
+            failures.append(f"{name}: neighbour order differs on {count_rows(ind, ref_ind)} rows")
+        if not np.allclose(dist, ref_dist, rtol=0, atol=1e-9):
+            failures.append(f"{name}: neighbour distances differ")
+        if not np.array_equal(knn.predict(X), model.predict(X)):
+            failures.append(f"{name}: batch predictions differ")
+
+        single = np.concatenate([knn.predict(X[i:i + 1]) for i in range(min(len(X), 200))])
+        if not np.array_equal(single, model.predict(X[:len(single)])):
+            failures.append(f"{name}: single-row predictions differ")
+
+    return failures
+
+
+def check_artifact(df, model, scaler, expected_columns):
+    # The served artifact must reproduce the pickled model it was converted from
+    if artifact.current_version() is None:
+        return [f"no artifact in {artifact.STORE_DIR}; run `python artifact.py convert`"]
+    bundle = artifact.load_artifact(verify=True)
+
+    failures = []
+    if bundle.columns != list(expected_columns):
+        failures.append("column order differs from columns.pkl")
+        return failures
+
+    encoder = FeatureEncoder(bundle.columns, bundle.scaler_mean, bundle.scaler_scale)
+    knn = ExactKNN.from_artifact(bundle)
+    for name, frame in (('data', df), ('synthetic', synthetic_frame(SYNTHETIC_ROWS))):
+        X = encoder.encode_frame(frame)
+        reference = scaler.transform(FeatureEncoder(expected_columns).encode_frame(frame))
+        if not np.array_equal(X, reference):
+            failures.append(f"{name}: scaled features differ on {count_rows(X, reference)} rows")
+        if not np.array_equal(knn.predict(X), model.predict(reference)):
+            failures.append(f"{name}: predictions differ")
+
+    # Similar patients are listed in search order, so ties must break as in
+    # the pickled model whichever sklearn rebuilds the KD-tree
+    for name, X in (('training', model._fit_X), ('midpoints', midpoint_queries(model))):
+        ref_dist, ref_ind = model.kneighbors(X)
+        dist, ind = knn.kneighbors(X)
+        if not np.array_equal(ind, ref_ind):
+            failures.append(f"{name}: neighbours or their order differ on {count_rows(ind, ref_ind)} rows")
+        if not np.allclose(dist, ref_dist, rtol=0, atol=1e-9):
+            failures.append(f"{name}: neighbour distances differ")
+
+    return failures
+
+
+def check_compact(df, model, scaler, expected_columns):
+    # Searching the float32 store gives the float64 engine's neighbours, in
+    # the same order and with the same distances, and so the same votes
+    encoder = FeatureEncoder.from_scaler(expected_columns, scaler)
+    knn = ExactKNN.from_model(model)
+    reference_X = encoder.encode_frame(synthetic_frame(COMPACT_REFERENCE_ROWS, seed=1))
+    large = ExactKNN(reference_X, np.searchsorted(model.classes_, model.predict(reference_X)), model.classes_,
+                     n_neighbors=model.n_neighbors, weights=model.weights, leaf_size=model.leaf_size)
+    cases = {
+        'data': (knn, encoder.encode_frame(df)),
+        'training': (knn, model._fit_X),
+        'synthetic': (knn, encoder.encode_frame(synthetic_frame(SYNTHETIC_ROWS))),
+        'large reference': (large, encoder.encode_frame(synthetic_frame(5_000, seed=2))),
+    }
+
+    failures = []
+    for name, (engine, X) in cases.items():
+        compact = engine.compacted()
+        expected, result = engine.query(X), compact.query(X)
+        if not np.array_equal(result.indices, expected.indices):
+            failures.append(f"{name}: neighbours differ on {count_rows(result.indices, expected.indices)} rows")
+        if not np.array_equal(result.distances, expected.distances):
+            failures.append(f"{name}: neighbour distances differ")
+        if not (np.array_equal(result.labels, expected.labels) and np.array_equal(result.proba, expected.proba)):
+            failures.append(f"{name}: predictions differ")
+
+    # The store written to the served artifact is fit_X rounded to float32
+    if artifact.current_version() is not None:
+        bundle = artifact.load_artifact(verify=True)
+        if bundle.compact_X is not None and not np.array_equal(bundle.compact_X, compact_store(bundle.fit_X)):
+            failures.append(f"{bundle.version}: fit_X32 is not fit_X in float32")
+    return failures
+
+
+def check_query(df, model, scaler, expected_columns):
+    # One search gives what predict, predict_proba and kneighbors give, and
+    # similar patients are traced to the heart.csv rows they were built from
+    from train import prepare_dataset
+
+    encoder = FeatureEncoder.from_scaler(expected_columns, scaler)
+    knn = ExactKNN.from_model(model)
+    failures = []
+    for name, X in (('data', encoder.encode_frame(df)),
+                    ('synthetic', encoder.encode_frame(synthetic_frame(10_000)))):
+        result = knn.query(X)
+        if not np.array_equal(result.labels, model.predict(X)):
+            failures.append(f"{name}: labels differ from predict")
+        if not np.allclose(result.proba, model.predict_proba(X)):
+            failures.append(f"{name}: vote fractions differ from predict_proba")
+        dist, _ = model.kneighbors(X)
+        if not np.allclose(result.distances, dist, rtol=0, atol=1e-9):
+            failures.append(f"{name}: neighbour distances differ from kneighbors")
+
+    rows = ReferenceRows(knn, encoder, DATA_PATH)
+    X, y = prepare_dataset(pd.read_csv(DATA_PATH))
+    X = encoder.scale_rows(X[expected_columns].to_numpy(dtype=np.float64))
+    if (rows.row_ids < 0).any():
+        failures.append(f"{int((rows.row_ids < 0).sum())} reference rows not traced to heart.csv")
+    elif not (np.array_equal(X[rows.row_ids], knn.fit_X) and np.array_equal(y.to_numpy()[rows.row_ids], model._y)):
+        failures.append("reference rows traced to the wrong heart.csv rows")
+    return failures
+
+
+def check_append(df, model, scaler, expected_columns):
+    # An engine extended with appended rows, still serving the old rows from
+    # the KD-tree built before the append, answers like a model fit on all rows
+    from sklearn.neighbors import KNeighborsClassifier
+
+    encoder = FeatureEncoder.from_scaler(expected_columns, scaler)
+    base = ExactKNN.from_model(model, tree_min_reference=0)
+    base.tree
+    new_rows = df.sample(int(len(base.fit_X) * TREE_REBUILD_FRACTION), random_state=0)
+    fit_X = np.vstack([base.fit_X, encoder.encode_frame(new_rows)])
+    y = np.concatenate([base.y, np.searchsorted(model.classes_, new_rows[LABEL_COLUMN])])
+    knn = base.extended(fit_X, y)
+
+    failures = []
+    if knn.tree is not base.tree:
+        failures.append("the KD-tree was rebuilt instead of reused")
+    reference = KNeighborsClassifier(n_neighbors=model.n_neighbors, weights=model.weights).fit(fit_X, model.classes_[y])
+    queries = {
+        'data': encoder.encode_frame(df),
+        'reference': fit_X,
+        'synthetic': encoder.encode_frame(synthetic_frame(10_000)),
+    }
+    for name, X in queries.items():
+        # Small batches take the tree path
+        dist, _ = zip(*(knn.kneighbors(X[i:i + 8]) for i in range(0, len(X), 8)))
+        ref_dist, _ = reference.kneighbors(X)
+        if not np.allclose(np.vstack(dist), ref_dist, rtol=0, atol=1e-9):
+            failures.append(f"{name}: neighbour distances differ")
+        predictions = np.concatenate([knn.predict(X[i:i + 8]) for i in range(0, len(X), 8)])
+        if not np.array_equal(predictions, reference.predict(X)):
+            failures.append(f"{name}: predictions differ on {int((predictions != reference.predict(X)).sum())} rows")
+    return failures
+
+
+def check_drift(df, model, scaler, expected_columns):
+    # Under the default policy, appending rows drawn at random from the data
+    # itself keeps the scaler; rows from an older population refit it
+    from append import DRIFT_MIN_ROWS, append_rows
+
+    version = artifact.current_version()
+    if version is None:
+        return [f"no artifact in {artifact.STORE_DIR}; run `python artifact.py convert`"]
+    cases = {f"{n} random rows (seed {seed})": (df.sample(n, random_state=seed), False)
+             for n in (100, DRIFT_MIN_ROWS, 2 * DRIFT_MIN_ROWS) for seed in range(3)}
+    # Consecutive rows come from one site, so small blocks differ by chance
+    cases['first 100 rows'] = (df.head(100), False)
+    cases['rows 15 years older'] = (df.sample(DRIFT_MIN_ROWS, random_state=0).assign(Age=lambda d: d['Age'] + 15), True)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as store:
+        shutil.copytree(os.path.join(artifact.STORE_DIR, version), os.path.join(store, version))
+        artifact.set_current(version, store)
+        for name, (rows, expected) in cases.items():
+            result = append_rows(rows, store=store, activate=False)
+            if result['refit'] != expected:
+                drift = result['drift']
+                failures.append(f"{name}: {'refit' if result['refit'] else 'no refit'} at drift {drift['score']:.3f} "
+                                f"({drift['feature']})")
+    return failures
+
+
+def check_report(df, model, scaler, expected_columns):
+    # Reports with the pre-rendered disclaimer page, and reports stamped into
+    # a cached layout, must match a full render byte for byte (apart from
+    # the PDF creation timestamp)
+    import report
+    from report_engine import user_data_from_record
+
+    now = datetime(2024, 1, 1, 9, 30)
+    chats = {
+        'no chat': [],
+        'long chat': [{'role': 'user', 'content': 'How can I lower my cholesterol? ' * 5},
+                      {'role': 'assistant', 'content': 'Eat more fibre and exercise regularly. ' * 60}] * 4,
+    }
+    knn = ExactKNN.from_model(model)
+    rows = ReferenceRows(knn, FeatureEncoder.from_scaler(expected_columns, scaler))
+    assessments = assess(knn, rows, model._fit_X[:20])
+    failures = []
+    for i, record in enumerate(df.head(20).to_dict(orient='records')):
+        user_data = user_data_from_record(record, f"Patient {i + 1}", "Chest tightness")
+        for name, chat in chats.items():
+            # Every other report has a similar-patients section
+            args = (user_data, int(record[LABEL_COLUMN]), "1. Preventive Measures\nWalk daily.",
+                    user_data['symptoms'], chat, assessments[i] if i % 2 else None)
+            spliced = report.generate_pdf_report(*args, now=now, report_id="HRT-TEST")
+            full = report.generate_pdf_report(*args, now=now, report_id="HRT-TEST", static_pages=False)
+            stamped = report.ReportBody(*args).render(now=now, report_id="HRT-TEST")
+            if strip_creation_date(spliced) != strip_creation_date(full):
+                failures.append(f"row {i}, {name}: static-page report differs from a full render")
+            if strip_creation_date(stamped) != strip_creation_date(full):
+                failures.append(f"row {i}, {name}: report stamped into a cached layout differs from a full render")
+    return failures
+
+
+def check_what_if(df, model, scaler, expected_columns):
+    # Every what-if variant is scored like the same submission sent through
+    # the DataFrame path and sklearn, and the "no change" variant agrees with
+    # the assessment of the submission itself
+    import report
+    import what_if
+    from report_engine import user_data_from_record
+
+    encoder = FeatureEncoder.from_scaler(expected_columns, scaler)
+    knn = ExactKNN.from_model(model)
+    rows = ReferenceRows(knn, encoder, None)
+    records = pd.concat([df.head(40), synthetic_frame(40)], ignore_index=True)
+    failures = []
+    for i, row in records.iterrows():
+        raw_input = raw_input_from_row(row)
+        values = what_if.factor_values(raw_input)
+        X = what_if.variant_rows(raw_input, encoder, values)
+        combos = itertools.product(*values.values())
+        variants = [{**raw_input, **dict(zip(values, combo))} for combo in combos]
+        reference = np.vstack([reference_scaled(v, scaler, expected_columns) for v in variants[::37]])
+        if count_rows(X[::37], reference):
+            failures.append(f"row {i}: variant rows differ from the DataFrame path")
+        summary = what_if.explore(knn, encoder, raw_input)
+        proba = model.predict_proba(X)[:, 1].reshape(tuple(len(v) for v in values.values()))
+        current = [int(np.searchsorted(v, float(raw_input[f]))) for f, v in values.items()]
+        for axis, (factor, points) in enumerate(summary['sweeps'].items()):
+            index = list(current)
+            for j, (_, fraction, _) in enumerate(points):
+                index[axis] = j
+                if not np.isclose(fraction, proba[tuple(index)], atol=1e-4):
+                    failures.append(f"row {i}: {factor} sweep differs from predict_proba")
+                    break
+        if summary['variants'] != len(X) or not np.isclose(summary['low_risk_share'], (proba < 0.5).mean(), atol=1e-4):
+            failures.append(f"row {i}: low-risk share differs from predict_proba")
+        assessment = assess(knn, rows, encoder.encode(raw_input))[0]
+        if summary['prediction'] != assessment['prediction']:
+            failures.append(f"row {i}: unchanged variant predicts {summary['prediction']}, "
+                            f"the assessment {assessment['prediction']}")
+        if i % 20 == 0:
+            user_data = user_data_from_record(row, f"Patient {i + 1}")
+            report.generate_pdf_report(user_data, assessment['prediction'], "Walk daily.", "", [],
+                                       {**assessment, 'what_if': summary})
+    return failures
+
+
+def check_training(df, model, scaler, expected_columns):
+    # train.py's preprocessing and split must rebuild the shipped model's
+    # inputs exactly: same columns, scaler statistics and reference rows
+    from sklearn.preprocessing import StandardScaler
+
+    from train import prepare_dataset, split_dataset
+
+    X, y = prepare_dataset(df)
+    X_train, _, y_train, _ = split_dataset(X, y)
+    rebuilt = StandardScaler().fit(X_train)
+
+    failures = []
+    if X.columns.tolist() != list(expected_columns):
+        failures.append("encoded columns differ from columns.pkl")
+        return failures
+    if not (np.array_equal(rebuilt.mean_, scaler.mean_) and np.array_equal(rebuilt.scale_, scaler.scale_)):
+        failures.append("scaler statistics differ from scaler.pkl")
+    if not np.array_equal(rebuilt.transform(X_train), model._fit_X):
+        failures.append("scaled training rows differ from the model's reference set")
+    if not np.array_equal(model.classes_[model._y], y_train.to_numpy()):
+        failures.append("training labels differ from the model's")
+    return failures
+
+
+def strip_creation_date(pdf_bytes):
+    return re.sub(rb'/CreationDate \(D:\d+\)', b'', pdf_bytes)
+
+
+def midpoint_queries(model):
+    # Points halfway between each training row and its nearest distinct
+    # neighbour: two neighbours at (almost) the same distance
+    _, ind = model.kneighbors(model._fit_X)
+    nearest = [next((j for j in row if not np.array_equal(model._fit_X[j], model._fit_X[i])), i)
+               for i, row in enumerate(ind)]
+    return (model._fit_X + model._fit_X[nearest]) / 2.0
+
+
+def synthetic_frame(n_rows, seed=0):
+    # Random submissions within the app's form ranges
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Age': rng.integers(18, 101, n_rows),
+        'RestingBP': rng.integers(80, 201, n_rows),
+        'Cholesterol': rng.integers(100, 601, n_rows),
+        'FastingBS': rng.integers(0, 2, n_rows),
+        'MaxHR': rng.integers(60, 221, n_rows),
+        'Oldpeak': rng.integers(0, 61, n_rows) / 10,
+    })
+    for col, values in CATEGORY_VALUES.items():
+        df[col] = rng.choice(values, n_rows)
+    return df
+
+
+def count_rows(a, b):
+    return int((a != b).any(axis=1).sum())
+
+
+CHECKS = {
+    'encoder': check_encoder,
+    'knn': check_knn,
+    'artifact': check_artifact,
+    'compact': check_compact,
+    'append': check_append,
+    'drift': check_drift,
+    'query': check_query,
+    'report': check_report,
+    'what_if': check_what_if,
+    'training': check_training,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parity checks for the HeartAlert scoring pipeline.")
+    parser.add_argument("checks", nargs="*",
+                        help=f"Checks to run: {', '.join(CHECKS)} (default: all)")
+    parser.add_argument("--data", default=DATA_PATH, help="CSV in heart.csv schema to check against")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+    checks = args.checks or list(CHECKS)
+
+    df = pd.read_csv(args.data)
+    model, scaler, expected_columns = load_models()
+
+    failed = False
+    for name in checks:
+        failures = CHECKS[name](df, model, scaler, expected_columns)
+        if failures:
+            failed = True
+            for failure in failures:
+                print(f"FAIL {name}: {failure}")
+        else:
+            print(f"ok   {name} ({len(df)} rows)")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
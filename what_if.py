@@ -0,0 +1,143 @@
+import numpy as np
+
+# Factors a patient can change, and the values each is tried at. The
+# patient's own value is always added to its grid, so every other variant
+# can be compared with "change nothing". The full grid is 256-512
+# combinations, which one neighbour search scores in a few milliseconds.
+FACTOR_GRIDS = {
+    'Cholesterol': (180, 220, 260),
+    'RestingBP': (110, 130, 150),
+    'MaxHR': (110, 140, 170),
+    'Oldpeak': (0.0, 1.0, 2.0),
+    'FastingBS': (0, 1),
+}
+FACTOR_NAMES = {
+    'Cholesterol': "Cholesterol (mg/dL)",
+    'RestingBP': "Resting BP (mm Hg)",
+    'MaxHR': "Max heart rate (bpm)",
+    'Oldpeak': "Oldpeak (ST depression)",
+    'FastingBS': "Fasting blood sugar > 120",
+}
+
+
+def factor_values(raw_input, grids=FACTOR_GRIDS):
+    return {factor: np.unique(np.append(np.asarray(grid, dtype=np.float64), float(raw_input[factor])))
+            for factor, grid in grids.items()}
+
+
+def variant_rows(raw_input, encoder, values):
+    # Every combination of the factor values as one scaled matrix: the
+    # submission is encoded once, repeated, and the factor columns are
+    # overwritten from a meshgrid, so no row is built in Python
+    mesh = np.meshgrid(*values.values(), indexing='ij')
+    X = np.repeat(encoder.encode(raw_input, scaled=False), mesh[0].size, axis=0)
+    for factor, grid in zip(values, mesh):
+        X[:, encoder.index[factor]] = grid.ravel()
+    return encoder.scale_rows(X)
+
+
+def explore(knn, encoder, raw_input, grids=FACTOR_GRIDS):
+    # Scores all variants with one neighbour search and summarises them:
+    # the risk vote along each factor on its own, the lowest-risk
+    # combination, and the smallest change that flips the prediction
+    values = factor_values(raw_input, grids)
+    shape = tuple(len(v) for v in values.values())
+    result = knn.query(variant_rows(raw_input, encoder, values))
+    positive = int(np.searchsorted(knn.classes, 1)) if 1 in knn.classes else len(knn.classes) - 1
+    risk = result.proba[:, positive].reshape(shape)
+    labels = result.labels.reshape(shape)
+
+    current = tuple(int(np.searchsorted(v, float(raw_input[f]))) for f, v in values.items())
+    # How many factors, and how far in scaled units, each variant moves
+    grid_index = np.indices(shape).reshape(len(shape), -1).T
+    n_moved = (grid_index != np.array(current)).sum(axis=1)
+    distance = np.zeros(len(grid_index))
+    for axis, (factor, v) in enumerate(values.items()):
+        scale = encoder.scale[encoder.index[factor]] if encoder.scale is not None else 1.0
+        distance += np.abs(v[grid_index[:, axis]] - v[current[axis]]) / scale
+
+    def variant(flat):
+        index = np.unravel_index(flat, shape)
+        return {
+            'changes': {f: as_number(v[i]) for (f, v), i, c in zip(values.items(), index, current) if i != c},
+            'positive_fraction': round(float(risk[index]), 4),
+            'prediction': int(labels[index]),
+        }
+
+    flat_risk = risk.ravel()
+    # Lowest vote first, then the fewest and smallest changes
+    best = np.lexsort((distance, n_moved, flat_risk))[0]
+    flipped = np.flatnonzero(labels.ravel() != labels[current])
+    flip = None
+    if len(flipped):
+        flip = variant(flipped[np.lexsort((flat_risk[flipped], distance[flipped], n_moved[flipped]))[0]])
+
+    sweeps = {}
+    for axis, (factor, v) in enumerate(values.items()):
+        index = list(current)
+        points = []
+        for i, value in enumerate(v):
+            index[axis] = i
+            points.append([as_number(value), round(float(risk[tuple(index)]), 4), int(labels[tuple(index)])])
+        sweeps[factor] = points
+
+    return {
+        'variants': int(risk.size),
+        'current': {f: as_number(v[i]) for (f, v), i in zip(values.items(), current)},
+        'positive_fraction': round(float(risk[current]), 4),
+        'prediction': int(labels[current]),
+        'low_risk_share': round(float((labels != knn.classes[positive]).mean()), 4),
+        'sweeps': sweeps,
+        'best': variant(best),
+        'flip': flip,
+    }
+
+
+def as_number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 1)
+
+
+# -------------------------
+# Text
+# -------------------------
+def format_value(factor, value):
+    if factor == 'FastingBS':
+        return "yes" if value else "no"
+    return f"{value:g}"
+
+
+def change_text(changes):
+    return ", ".join(f"{FACTOR_NAMES[f]} {format_value(f, v)}" for f, v in changes.items()) or "no change"
+
+
+def sweep_line(what_if, factor):
+    # e.g. "Cholesterol (mg/dL) - 160: 40%, [240]: 60%, 280: 80%"; the
+    # patient's own value is in brackets
+    yours = what_if['current'][factor]
+    points = []
+    for value, fraction, _ in what_if['sweeps'][factor]:
+        text = format_value(factor, value)
+        points.append(f"{f'[{text}]' if value == yours else text}: {fraction:.0%}")
+    return f"{FACTOR_NAMES[factor]} - {', '.join(points)}"
+
+
+def what_if_lines(what_if):
+    # Plain-text summary shared by the app and the PDF report
+    risk = "HIGH RISK" if what_if['prediction'] == 1 else "LOW RISK"
+    lines = [f"{what_if['variants']} combinations of the factors below were scored; "
+             f"{what_if['low_risk_share']:.0%} of them come out LOW RISK. "
+             f"Your values: {risk}, {what_if['positive_fraction']:.0%} of similar patients had heart disease."]
+    lines.append("Share of similar patients with heart disease as each factor changes on its own:")
+    lines.extend(f"- {sweep_line(what_if, factor)}" for factor in what_if['sweeps'])
+    best = what_if['best']
+    if best['changes']:
+        lines.append(f"Lowest-risk combination: {change_text(best['changes'])} "
+                     f"({best['positive_fraction']:.0%}, {'HIGH' if best['prediction'] == 1 else 'LOW'} RISK).")
+    flip = what_if['flip']
+    if flip:
+        outcome = "LOW RISK" if flip['prediction'] != 1 else "HIGH RISK"
+        lines.append(f"Smallest change to {outcome}: {change_text(flip['changes'])} ({flip['positive_fraction']:.0%}).")
+    else:
+        lines.append(f"No combination tried changes the result from {risk}.")
+    return lines